@@ -8,6 +8,9 @@ except: pass
 # Avoiding the absl error for duplicated flags if run again the cell from a notebook
 allow_flags_override();
 
+flags.DEFINE_bool('log_checkpoint_metrics', False, 'Log the metrics of the evaluated checkpoints in checkpoint_metrics.jsonl '
+                  'of the checkpoint directory, for the retention of the best checkpoint by checkpoint_best_metric of the train.')
+
 def eval_main(unused_argv, **kwargs):
     """Main function for the evaluation.
     Args:
@@ -25,6 +28,13 @@ def eval_main(unused_argv, **kwargs):
         print('Evaluation parameters not set. Skipping.')
         return
     init_eval_environment(eval_parameters)
+    # Log the metrics of the evaluated checkpoints for the retention of the best checkpoint of the train
+    metrics_logger = None
+    if (eval_parameters.log_checkpoint_metrics):
+        from train_checkpoints import CheckpointMetricsLogger
+        metrics_logger = CheckpointMetricsLogger(eval_parameters.checkpoint_dir, kwargs.get('eval_callback'))
+        metrics_logger.install()
+        kwargs['eval_callback'] = metrics_logger
     # Import the eval main function
     from object_detection import model_main_tf2
     eval_parameters.update_flags()
@@ -37,6 +47,8 @@ def eval_main(unused_argv, **kwargs):
     finally:
         # Stop the tensorboard
         stop_tensorboard(tb_process)
+        if (metrics_logger):
+            metrics_logger.uninstall()
 
 if __name__ == '__main__':
     if (not is_executable()):
@@ -17,6 +17,7 @@ class EvalParameters(BaseParameters):
         self._eval_timeout = 3600
         self._wait_interval = 300
         self._tensorboard_port = 8080
+        self._log_checkpoint_metrics = False
         self._is_path.extend([
             'pipeline_config_path',
             'checkpoint_dir'])
@@ -49,6 +50,10 @@ class EvalParameters(BaseParameters):
     def tensorboard_port(self): return self._tensorboard_port
     @tensorboard_port.setter
     def tensorboard_port(self, value): self._tensorboard_port = value
+    @property
+    def log_checkpoint_metrics(self): return self._log_checkpoint_metrics
+    @log_checkpoint_metrics.setter
+    def log_checkpoint_metrics(self, value): self._log_checkpoint_metrics = value
 
 EvalParameters.default = EvalParameters.default or EvalParameters()
 
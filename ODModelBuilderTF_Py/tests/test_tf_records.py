@@ -0,0 +1,105 @@
+import  os
+import  shutil
+import  types
+
+import  pytest
+
+from    tf_records import RecordSources, ShardsPlan, TFRecord, get_tf_record_file_names, get_tf_record_files
+from    tf_records_benchmark import generate_voc_dataset
+from    tf_records_index import TFRecordIndex
+
+def _sources(previous_shards = None, added = None):
+    """
+    Return the sources of a record for the planning of its shards
+    Keyword arguments:
+    previous_shards -- the number of shards of the existing record or None
+    added           -- the keys of the added sources
+    """
+    previous = types.SimpleNamespace(num_shards = previous_shards) if previous_shards else None
+    return RecordSources(None, previous, added, False, False, None)
+
+def _record_filenames(output_file):
+    """
+    Return the file names of the images of the examples of a record, in the order of the shards files
+    Keyword arguments:
+    output_file -- the record file path and name
+    """
+    import tensorflow as tf
+    return [tf.train.Example.FromString(serialized.numpy()).features.feature['image/filename'].bytes_list.value[0].decode()
+            for serialized in tf.data.TFRecordDataset(get_tf_record_files(output_file))]
+
+@pytest.fixture
+def dataset(tmp_path):
+    """Directory of 8 generated images with their annotations, and an empty images directory of the record"""
+    pytest.importorskip('object_detection.utils.dataset_util')
+    source_dir = str(tmp_path / 'source')
+    generate_voc_dataset(source_dir, 8, 64, 48, 2)
+    image_dir = tmp_path / 'images'
+    image_dir.mkdir()
+    return source_dir, str(image_dir), str(tmp_path / 'train.record')
+
+def _copy_images(source_dir, image_dir, indices):
+    """
+    Copy some images of the generated dataset with their annotations
+    Keyword arguments:
+    source_dir  -- the directory of the generated dataset
+    image_dir   -- the images directory of the record
+    indices     -- the indices of the images
+    """
+    for i in indices:
+        for ext in ('jpg', 'xml'):
+            shutil.copy2(os.path.join(source_dir, f'image{i:06d}.{ext}'), image_dir)
+
+def test_plan_shards_full_build():
+    assert TFRecord.plan_shards('train.record', _sources(), 3, 10, 0) == ShardsPlan(0, 3, None)
+    assert TFRecord.plan_shards('train.record', _sources(), 3, 2, 0) == ShardsPlan(0, 2, None)
+
+def test_plan_shards_append():
+    # New shards up to the count of a full build
+    assert TFRecord.plan_shards('train.record', _sources(2, ['a.xml'] * 4), 8, 4, 0) == ShardsPlan(2, 4, None)
+    assert TFRecord.plan_shards('train.record', _sources(2, ['a.xml'] * 4), 3, 4, 0) == ShardsPlan(2, 1, None)
+
+def test_plan_shards_fold_in_last_shard():
+    fold_file = get_tf_record_file_names('train.record', 3)[-1]
+    assert TFRecord.plan_shards('train.record', _sources(3, ['a.xml'] * 4), 3, 4, 0) == ShardsPlan(2, 1, fold_file)
+
+def test_plan_shards_all_duplicates():
+    assert TFRecord.plan_shards('train.record', _sources(2, ['a.xml']), 8, 0, 0) == ShardsPlan(2, 0, None)
+
+def test_append_in_new_shards(dataset, capsys):
+    source_dir, image_dir, output_file = dataset
+    _copy_images(source_dir, image_dir, range(4))
+    TFRecord().create_tf_record(image_dir, output_file, num_shards = 8, rebuild = False)
+    _copy_images(source_dir, image_dir, range(4, 8))
+    TFRecord().create_tf_record(image_dir, output_file, num_shards = 8, rebuild = False)
+    assert 'Appending 4 new images' in capsys.readouterr().out
+    assert len(get_tf_record_files(output_file)) == 8
+    index = TFRecordIndex(output_file)
+    assert sorted(index.filenames) == [f'image{i:06d}.jpg' for i in range(8)]
+    assert [str(index.filenames[i]) for i in index.subset(1)] == _record_filenames(output_file)
+
+def test_append_folded_in_last_shard(dataset):
+    source_dir, image_dir, output_file = dataset
+    _copy_images(source_dir, image_dir, range(4))
+    TFRecord().create_tf_record(image_dir, output_file, num_shards = 2, rebuild = False)
+    _copy_images(source_dir, image_dir, range(4, 8))
+    TFRecord().create_tf_record(image_dir, output_file, num_shards = 2, rebuild = False)
+    assert len(get_tf_record_files(output_file)) == 2
+    index = TFRecordIndex(output_file)
+    assert list(index.shards) == [0, 1, 0, 1, 1, 1, 1, 1]
+    assert [str(index.filenames[i]) for i in index.subset(1)] == _record_filenames(output_file)
+    for i in range(len(index)):
+        assert index.example(i).features.feature['image/filename'].bytes_list.value[0].decode() == index.filenames[i]
+    assert not os.path.exists(get_tf_record_files(output_file)[-1] + '.tmp')
+
+def test_up_to_date(dataset, capsys):
+    source_dir, image_dir, output_file = dataset
+    _copy_images(source_dir, image_dir, range(4))
+    TFRecord().create_tf_record(image_dir, output_file, rebuild = False)
+    capsys.readouterr()
+    TFRecord().create_tf_record(image_dir, output_file, rebuild = False)
+    assert 'is up to date' in capsys.readouterr().out
+    # A change of the options rebuilds the record
+    TFRecord().create_tf_record(image_dir, output_file, num_shards = 2, rebuild = False)
+    assert len(get_tf_record_files(output_file)) == 2
+    assert len(TFRecordIndex(output_file)) == 4
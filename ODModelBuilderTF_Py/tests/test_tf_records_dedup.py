@@ -0,0 +1,98 @@
+import  shutil
+
+import  numpy as np
+import  pytest
+
+from    tf_records import ImageAnnotations
+from    tf_records_benchmark import generate_voc_dataset
+from    tf_records_dedup import TFRecordDedup, merge_boxes
+
+def _image(filename, width, height, classes, boxes):
+    """
+    Return the annotations of an image
+    Keyword arguments:
+    filename    -- the image file name
+    width       -- the width of the image
+    height      -- the height of the image
+    classes     -- the labels of the boxes
+    boxes       -- the boxes as xmin, ymin, xmax, ymax
+    """
+    return ImageAnnotations(filename, width, height, classes, np.array(boxes, np.float32).reshape(-1, 4))
+
+def test_invalid_settings():
+    with pytest.raises(Exception, match = 'Unknown deduplication mode'):
+        TFRecordDedup('fuzzy')
+    for threshold in (-1, 64):
+        with pytest.raises(Exception, match = 'not in the range'):
+            TFRecordDedup('perceptual', threshold = threshold)
+
+@pytest.mark.parametrize('threshold', [0, 4, 7, 63])
+def test_bands_cover_the_hash(threshold):
+    dedup = TFRecordDedup('perceptual', threshold = threshold)
+    dhash = 0x0123456789abcdef
+    bands = dedup._get_bands(dhash)
+    width = 64 // (threshold + 1)
+    assert len(bands) == threshold + 1
+    assert sum(band << (i * width) for i, band in enumerate(bands)) == dhash
+
+def test_find_within_threshold():
+    dedup = TFRecordDedup('perceptual', threshold = 4)
+    dhash = 0x0123456789abcdef
+    dedup._add('a', dhash, 0)
+    assert dedup._find('a', None) == (0, True)
+    # 4 bits flipped in 4 different bands still leave a band in common
+    assert dedup._find('b', dhash ^ (1 | 1 << 13 | 1 << 26 | 1 << 39)) == (0, False)
+    # 5 bits flipped, one per band
+    assert dedup._find('c', dhash ^ (1 | 1 << 13 | 1 << 26 | 1 << 39 | 1 << 52)) == (None, False)
+    # 5 bits flipped in the same band: a band is in common but the distance is over the threshold
+    assert dedup._find('d', dhash ^ 0b11111) == (None, False)
+
+def test_exact_mode_ignores_near_duplicates():
+    dedup = TFRecordDedup('exact')
+    dedup._add('a', None, 0)
+    assert dedup._find('b', None) == (None, False)
+
+def test_merge_boxes():
+    image = _image('a.jpg', 100, 100, ['cat'], [[10, 10, 50, 50]])
+    # The duplicate has double size: its first box is the same object of the kept image
+    duplicate = _image('b.jpg', 200, 200, ['cat', 'dog', 'cat'], [[20, 20, 100, 100], [100, 100, 180, 180], [120, 20, 180, 80]])
+    merged = merge_boxes(image, duplicate)
+    assert merged.classes == ['cat', 'dog', 'cat']
+    np.testing.assert_allclose(merged.boxes, [[10, 10, 50, 50], [50, 50, 90, 90], [60, 10, 90, 40]])
+    assert merged.boxes.dtype == np.float32
+    # The same box with a different label is a different object
+    assert merge_boxes(image, _image('c.jpg', 100, 100, ['dog'], [[10, 10, 50, 50]])).classes == ['cat', 'dog']
+
+def test_deduplicate_merge(tmp_path):
+    generate_voc_dataset(str(tmp_path), 2, 64, 48, 1)
+    shutil.copy2(tmp_path / 'image000000.jpg', tmp_path / 'copy.jpg')
+    images = [
+        _image('image000000.jpg', 64, 48, ['cat'], [[1, 1, 20, 20]]),
+        _image('image000001.jpg', 64, 48, ['cat'], [[1, 1, 20, 20]]),
+        _image('copy.jpg', 64, 48, ['dog'], [[30, 30, 60, 40]])]
+    dedup = TFRecordDedup('exact', merge = True)
+    kept = dedup.deduplicate(images, str(tmp_path))
+    assert [image.filename for image in kept] == ['image000000.jpg', 'image000001.jpg']
+    assert kept[0].classes == ['cat', 'dog']
+    assert (dedup.removed_exact, dedup.removed_perceptual, dedup.merged) == (1, 0, 1)
+
+def test_save_load_append(tmp_path, capsys):
+    generate_voc_dataset(str(tmp_path), 2, 64, 48, 1)
+    shutil.copy2(tmp_path / 'image000000.jpg', tmp_path / 'copy.jpg')
+    output_file = str(tmp_path / 'a.record')
+    dedup = TFRecordDedup('perceptual', merge = True)
+    dedup.deduplicate([_image('image000000.jpg', 64, 48, [], [])], str(tmp_path))
+    dedup.save(output_file)
+    assert TFRecordDedup.exists(output_file)
+    assert not (tmp_path / 'a.record.hashes.npz.tmp').exists()
+    # The images already written in the record are duplicates, but their boxes cannot be merged
+    dedup = TFRecordDedup('perceptual', merge = True)
+    dedup.load(output_file, append = True)
+    images = [_image('copy.jpg', 64, 48, ['cat'], [[1, 1, 20, 20]]), _image('image000001.jpg', 64, 48, [], [])]
+    assert [image.filename for image in dedup.deduplicate(images, str(tmp_path))] == ['image000001.jpg']
+    assert dedup.merged == 0
+    # The streaming filter drops the duplicates with a warning
+    dedup = TFRecordDedup('exact', merge = True)
+    dedup.load(output_file, append = True)
+    assert [image.filename for image in dedup.filter(images, str(tmp_path))] == ['image000001.jpg']
+    assert 'cannot be merged in streaming mode' in capsys.readouterr().out
@@ -0,0 +1,68 @@
+import  pytest
+
+from    tf_records import get_tf_record_file_names
+from    tf_records_index import TFRecordIndex
+
+tf = pytest.importorskip('tensorflow')
+
+def _write_record(output_file, records, num_shards):
+    """
+    Write records round robin in the shards of a record and return the entries of its index
+    Keyword arguments:
+    output_file -- the record file path and name
+    records     -- the serialized records
+    num_shards  -- the number of shards
+    """
+    files = get_tf_record_file_names(output_file, num_shards)
+    writers = [tf.io.TFRecordWriter(f) for f in files]
+    offsets = [0] * num_shards
+    entries = []
+    for i, serialized in enumerate(records):
+        shard = i % num_shards
+        writers[shard].write(serialized)
+        entries.append((shard, offsets[shard], len(serialized), f'image{i}.jpg', i))
+        offsets[shard] += TFRecordIndex.get_record_size(serialized)
+    for writer in writers:
+        writer.close()
+    return entries
+
+def test_record_size(tmp_path):
+    # The framing of a record is the length, the length crc and the data crc
+    output_file = str(tmp_path / 'a.record')
+    with tf.io.TFRecordWriter(output_file) as writer:
+        writer.write(b'x' * 100)
+    assert TFRecordIndex.get_record_size(b'x' * 100) == 116 == (tmp_path / 'a.record').stat().st_size
+
+def test_read_at_offsets(tmp_path):
+    output_file = str(tmp_path / 'a.record')
+    records = [bytes([i]) * (10 + i * 7) for i in range(7)]
+    TFRecordIndex.save(output_file, 3, _write_record(output_file, records, 3))
+    assert TFRecordIndex.exists(output_file)
+    index = TFRecordIndex(output_file)
+    assert len(index) == 7 and index.num_shards == 3
+    assert list(index.read(range(7))) == records
+    assert [index[i] for i in (5, 0, 3)] == [records[5], records[0], records[3]]
+    assert index.find('image4.jpg') == 4 and index.find('missing.jpg') == -1
+    # The indices sorted by position, the same of the sequential read of the shards
+    sequential = [r.numpy() for r in tf.data.TFRecordDataset(index.files)]
+    assert [records[i] for i in index.subset(1)] == sequential
+    assert index.subset(2) == [0, 6, 4, 2]
+    assert sorted(index.shard(0, 2) + index.shard(1, 2)) == list(range(7))
+
+def test_save_append(tmp_path):
+    output_file = str(tmp_path / 'a.record')
+    entries = _write_record(output_file, [b'a' * 20, b'b' * 30], 1)
+    TFRecordIndex.save(output_file, 1, entries[:1])
+    TFRecordIndex.save(output_file, 1, entries[1:], append = True)
+    index = TFRecordIndex(output_file)
+    assert list(index.offsets) == [0, 36] and list(index.filenames) == ['image0.jpg', 'image1.jpg']
+    assert list(index.read([1, 0])) == [b'b' * 30, b'a' * 20]
+    assert not (tmp_path / 'a.record.index.npz.tmp').exists()
+
+def test_write_subset(tmp_path):
+    output_file = str(tmp_path / 'a.record')
+    records = [bytes([i]) * 12 for i in range(5)]
+    TFRecordIndex.save(output_file, 2, _write_record(output_file, records, 2))
+    index = TFRecordIndex(output_file)
+    index.write([4, 1], str(tmp_path / 'b.record'))
+    assert [r.numpy() for r in tf.data.TFRecordDataset(str(tmp_path / 'b.record'))] == [records[4], records[1]]
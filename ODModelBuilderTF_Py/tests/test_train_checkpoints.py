@@ -0,0 +1,49 @@
+import  os
+
+import  pytest
+
+from    train_checkpoints import CheckpointWriter, get_best_checkpoint, read_checkpoint_metrics, write_checkpoint_metrics
+
+tf = pytest.importorskip('tensorflow')
+
+def test_best_checkpoint(tmp_path):
+    model_dir = str(tmp_path)
+    write_checkpoint_metrics(model_dir, 'ckpt-1', { 'mAP': 0.5, 'Loss/total_loss': 0.3 })
+    write_checkpoint_metrics(model_dir, os.path.join(model_dir, 'ckpt-2'), { 'mAP': 0.7, 'Loss/total_loss': 0.4 })
+    write_checkpoint_metrics(model_dir, 'ckpt-1', { 'mAP': 0.6, 'Loss/total_loss': 0.2 })
+    metrics = read_checkpoint_metrics(model_dir)
+    assert metrics['ckpt-1']['mAP'] == 0.6
+    checkpoints = [os.path.join(model_dir, f'ckpt-{i}') for i in range(1, 4)]
+    assert get_best_checkpoint(checkpoints, metrics, 'mAP') == checkpoints[1]
+    assert get_best_checkpoint(checkpoints, metrics, 'Loss/total_loss') == checkpoints[0]
+    assert get_best_checkpoint(checkpoints, metrics, 'AR') is None
+
+@pytest.mark.parametrize('async_write', [False, True])
+def test_apply_retention(tmp_path, monkeypatch, async_write):
+    # A relative directory, as the model directories of the parameters
+    monkeypatch.chdir(tmp_path)
+    model_dir = os.path.join('train', 'model')
+    writer = CheckpointWriter(async_write, keep_last = 2, best_metric = 'mAP')
+    writer.install()
+    try:
+        variable = tf.Variable(tf.zeros((10,)))
+        manager = tf.train.CheckpointManager(tf.train.Checkpoint(v = variable), model_dir, max_to_keep = 10)
+        for i in range(5):
+            variable.assign_add(tf.ones((10,)))
+            manager.save()
+            if (i == 0):
+                writer.sync()
+                write_checkpoint_metrics(model_dir, 'ckpt-1', { 'mAP': 0.9 })
+    finally:
+        writer.uninstall()
+    assert tf.train.CheckpointManager is not type(manager)
+    assert sorted(f[:-len('.index')] for f in os.listdir(model_dir) if f.endswith('.index')) == ['ckpt-1', 'ckpt-4', 'ckpt-5']
+    assert tf.train.latest_checkpoint(model_dir) == os.path.join(model_dir, 'ckpt-5')
+    state = tf.train.get_checkpoint_state(model_dir)
+    assert list(state.all_model_checkpoint_paths) == [os.path.join(model_dir, f'ckpt-{i}') for i in (1, 4, 5)]
+    # A new manager, as the one of a resumed train, finds the kept checkpoints
+    manager = tf.train.CheckpointManager(tf.train.Checkpoint(v = variable), model_dir, max_to_keep = 10)
+    assert [os.path.basename(c) for c in manager.checkpoints] == ['ckpt-1', 'ckpt-4', 'ckpt-5']
+    restored = tf.Variable(tf.zeros((10,)))
+    tf.train.Checkpoint(v = restored).restore(manager.latest_checkpoint).assert_existing_objects_matched()
+    assert restored.numpy().tolist() == [5.0] * 10
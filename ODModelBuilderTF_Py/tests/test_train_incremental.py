@@ -0,0 +1,63 @@
+import  numpy as np
+import  pytest
+
+from    train_incremental import check_class_heads_remap, get_class_head_variables, remap_checkpoint, remap_classes
+
+_suffix = '/.ATTRIBUTES/VARIABLE_VALUE'
+
+def test_remap_bias():
+    # 2 anchors of 3 classes: the background, cat and dog. The new labels are dog, cat and bird
+    bias = np.array([0, 1, 2, 10, 11, 12], np.float32)
+    remapped = remap_classes(bias, [0, 2, 1, None], 3)
+    assert remapped.tolist() == [0, 2, 1, 0, 10, 12, 11, 10]
+
+def test_remap_kernel():
+    kernel = np.arange(2 * 3 * 4, dtype = np.float32).reshape(2, 3, 4)
+    remapped = remap_classes(kernel, [1, None, 0], 2)
+    assert remapped.shape == (2, 3, 6)
+    np.testing.assert_array_equal(remapped.reshape(2, 3, 2, 3)[..., 0], kernel.reshape(2, 3, 2, 2)[..., 1])
+    np.testing.assert_array_equal(remapped.reshape(2, 3, 2, 3)[..., 1], 0)
+    np.testing.assert_array_equal(remapped.reshape(2, 3, 2, 3)[..., 2], kernel.reshape(2, 3, 2, 2)[..., 0])
+
+def test_class_head_variables():
+    ssd = 'model/_box_predictor/_prediction_heads/class_predictions_with_background/_class_predictor/'
+    rcnn = 'model/_mask_rcnn_box_predictor/_class_prediction_head/_class_predictor_layers/'
+    names = [
+        ssd + 'kernel' + _suffix,
+        ssd + 'bias' + _suffix,
+        ssd + 'kernel/.OPTIMIZER_SLOT/optimizer/momentum' + _suffix,
+        'model/_box_predictor/_base_tower_layers_for_heads/class_predictions_with_background/0/kernel' + _suffix,
+        'model/_box_predictor/_prediction_heads/box_encodings/_box_encoder_predictor/kernel' + _suffix,
+        # Only the last layer of a sequence of layers is the output of the head
+        rcnn + '0/kernel' + _suffix,
+        rcnn + '1/kernel' + _suffix,
+        rcnn + '1/bias' + _suffix,
+        'model/_first_stage_box_predictor/_prediction_heads/class_predictions_with_background/0/kernel' + _suffix,
+        'model/_prediction_head_dict/object_center/0/layer_with_weights-1/kernel' + _suffix,
+        'model/_prediction_head_dict/object_center/0/layer_with_weights-0/kernel' + _suffix]
+    assert get_class_head_variables(names) == {
+        ssd + 'kernel' + _suffix,
+        ssd + 'bias' + _suffix,
+        rcnn + '1/kernel' + _suffix,
+        rcnn + '1/bias' + _suffix,
+        'model/_prediction_head_dict/object_center/0/layer_with_weights-1/kernel' + _suffix }
+
+def test_remap_checkpoint():
+    pytest.importorskip('tensorflow')
+    assert check_class_heads_remap()
+
+def test_remap_checkpoint_same_labels(tmp_path):
+    tf = pytest.importorskip('tensorflow')
+    head = tf.Module()
+    head.bias = tf.Variable(np.arange(6, dtype = np.float32))
+    predictor = tf.Module()
+    predictor._prediction_heads = { 'class_predictions_with_background': head }
+    model = tf.Module()
+    model._box_predictor = predictor
+    checkpoint = tf.train.Checkpoint(model = model).write(str(tmp_path / 'ckpt-1'))
+    assert remap_checkpoint(checkpoint, str(tmp_path / 'ckpt-0'), [0, 1, 2], 3) == []
+    old = tf.train.load_checkpoint(checkpoint)
+    new = tf.train.load_checkpoint(str(tmp_path / 'ckpt-0'))
+    assert old.get_variable_to_shape_map() == new.get_variable_to_shape_map()
+    for name in old.get_variable_to_shape_map():
+        np.testing.assert_array_equal(old.get_tensor(name), new.get_tensor(name))
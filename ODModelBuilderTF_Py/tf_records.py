@@ -1,12 +1,88 @@
+from    collections import deque, namedtuple
+import  csv
 import  glob
 import  io
 import  os
 from    pathlib import Path
 import  shutil
+import  time
 
 try:
-    from    base_parameters import BaseParameters
+    from    train_parameters import TrainParameters
 except: pass
+try:
+    from    utilities import is_archive
+except: pass
+try:
+    from    tf_records_manifest import TFRecordManifest
+except: pass
+try:
+    from    tf_records_index import TFRecordIndex
+except: pass
+try:
+    from    tf_records_annotations import TFRecordAnnotations
+except: pass
+try:
+    from    tf_records_dedup import TFRecordDedup
+except: pass
+
+# Target size of each record shard when their number is automatically chosen
+_shard_target_size = 100 * 1024 * 1024
+# Maximum number of automatically chosen record shards
+_max_auto_shards = 256
+# Extensions of the image files read from the archives
+_image_extensions = ('.jpg', '.jpeg', '.png')
+# Patterns of the bulk annotations files by annotations format
+_annotations_file_patterns = { 'coco': '*.json', 'csv': '*.csv' }
+# Annotations of an image: the boxes are a float32 array of rows (xmin, ymin, xmax, ymax) in pixels.
+# The optional encoded field holds the content of the image when it's read from an archive.
+# Defined at module level for being picklable by the encoding workers
+ImageAnnotations = namedtuple('ImageAnnotations', ['filename', 'width', 'height', 'classes', 'boxes', 'encoded'], defaults = [None])
+# Sources of a record compared with its manifest. The added keys are None for a full build and empty if the record is up to date
+RecordSources = namedtuple('RecordSources', ['manifest', 'previous', 'added', 'archive', 'bulk', 'annotations_file'])
+# Shards to write: the index of the first one, their count and the existing last shard where the images are folded or None
+ShardsPlan = namedtuple('ShardsPlan', ['first_shard', 'new_shards', 'fold_file'])
+# TFRecord instance used by the encoding worker processes
+_worker_record = None
+
+def _init_encoding_worker(record):
+    """
+    Initializer of the encoding worker processes
+    Keyword arguments:
+    record  -- the TFRecord instance with the labels dictionary already built
+    """
+    global _worker_record
+    _worker_record = record
+
+def _encode_example(group, path, labels):
+    """
+    Encode a serialized TensorFlow example in a worker process
+    Keyword arguments:
+    group   -- group's name
+    path    -- path of the labeled images
+    labels  -- the current labels of the main process, for the labels found after the start of the worker
+    """
+    if (len(labels) != len(_worker_record._label_dict)):
+        _worker_record.set_labels(labels)
+    return _worker_record.create_tf_example(group, path).SerializeToString()
+
+def _ordered_map(executor, fn, iterable, max_pending):
+    """
+    Map a function over an iterable through an executor, yielding the results in order
+    and keeping a bounded number of pending jobs
+    Keyword arguments:
+    executor    -- the executor running the jobs
+    fn          -- the function to map
+    iterable    -- the iterable of arguments tuples
+    max_pending -- the maximum number of submitted and not yet consumed jobs
+    """
+    pending = deque()
+    for args in iterable:
+        pending.append(executor.submit(fn, *args))
+        if (len(pending) >= max_pending):
+            yield pending.popleft().result()
+    while (pending):
+        yield pending.popleft().result()
 
 class TFRecord:
     """Class for the TensorFlow records creation"""
@@ -15,49 +91,74 @@ class TFRecord:
         super().__init__()
         self._label_set = set()
         self._label_dict = dict()
+        self._verify_images = 0
+        self._resize_target = None
+        self._resize_quality = 95
+        self._fixed_labels = False
+    @property
+    def labels(self):
+        """ The labels, ordered by index """
+        self.build_label_dict()
+        return list(self._label_dict)
+    def set_labels(self, labels):
+        """
+        Set the initial labels, keeping their order for the indices
+        Keyword arguments:
+        labels  -- the ordered list of labels
+        """
+        self._label_dict.clear()
+        for label in labels:
+            self._label_dict[label] = len(self._label_dict) + 1
+        self._label_set.update(labels)
     def class_text_to_int(self, row_label):
         """
         Convertion of the text of the labels to an integer index
         Keyword arguments:
         row_label   -- the label to convert to int
         """
-        if (len(self._label_dict) == 0):
-            count = len(self._label_set)
-            labelIx = 1
-            for label in self._label_set:
-                self._label_dict[label] = labelIx
-                labelIx += 1
+        if (row_label not in self._label_dict and not self._fixed_labels):
+            self.build_label_dict()
+        if (row_label not in self._label_dict):
+            raise Exception(f'Error!!! The label {row_label} is not in the known labels')
         return self._label_dict[row_label]
+    def build_label_dict(self):
+        """
+        Build the dictionary of the labels indices from the set of the labels.
+        The labels not yet indexed are appended in alphabetical order
+        """
+        for label in sorted(self._label_set.difference(self._label_dict)):
+            self._label_dict[label] = len(self._label_dict) + 1
     def create_tf_example(self, group, path):
         """
         TensorFlow example creator
         Keyword arguments:
-        group   -- group's name
+        group   -- the annotations of the image
         path    -- path of the labeled images
         """
         from object_detection.utils import dataset_util
-        from PIL import Image
+        import numpy as np
         import tensorflow as tf
-        with tf.compat.v1.gfile.GFile(os.path.join(path, '{}'.format(group.filename)), 'rb') as fid:
-            encoded_jpg = fid.read()
-        encoded_jpg_io = io.BytesIO(encoded_jpg)
-        image = Image.open(encoded_jpg_io)
-        width, height = image.size
+        if (group.encoded is not None):
+            encoded_jpg = group.encoded
+        else:
+            with tf.compat.v1.gfile.GFile(os.path.join(path, '{}'.format(group.filename)), 'rb') as fid:
+                encoded_jpg = fid.read()
+        # Take the size from the annotations or from the header of the image, without decoding it
+        image_format, width, height = get_image_info(encoded_jpg)
+        if (group.width > 0 and group.height > 0):
+            width, height = group.width, group.height
+        if (not width or not height or self._must_verify(group.filename)):
+            width, height = self._verify_image(group.filename, encoded_jpg, width, height)
+        xmins, ymins, xmaxs, ymaxs = (group.boxes / np.array([width, height, width, height], np.float32)).T.tolist()
+        # Downscale the image to the size needed by the model. The boxes are normalized so they don't change
+        scale = get_resize_scale(self._resize_target, width, height)
+        if (scale < 1):
+            encoded_jpg, width, height = resize_image(encoded_jpg, scale, self._resize_quality)
+            image_format = 'jpeg'
         filename = group.filename.encode('utf8')
-        image_format = b'jpg'
-        xmins = []
-        xmaxs = []
-        ymins = []
-        ymaxs = []
-        classes_text = []
-        classes = []
-        for index, row in group.object.iterrows():
-            xmins.append(row['xmin'] / width)
-            xmaxs.append(row['xmax'] / width)
-            ymins.append(row['ymin'] / height)
-            ymaxs.append(row['ymax'] / height)
-            classes_text.append(row['class'].encode('utf8'))
-            classes.append(self.class_text_to_int(row['class']))
+        image_format = b'png' if image_format == 'png' else b'jpg'
+        classes_text = [label.encode('utf8') for label in group.classes]
+        classes = [self.class_text_to_int(label) for label in group.classes]
         tf_example = tf.train.Example(features=tf.train.Features(feature={
             'image/height': dataset_util.int64_feature(height),
             'image/width': dataset_util.int64_feature(width),
@@ -73,95 +174,846 @@ class TFRecord:
             'image/object/class/label': dataset_util.int64_list_feature(classes),
         }))
         return tf_example
-    def create_tf_record(self, image_dir, output_file, labels_file = None, csv_file = None):
+    def _must_verify(self, filename):
+        """
+        Return True if the image belongs to the sampled subset of images to verify
+        Keyword arguments:
+        filename    -- the image file name
+        """
+        import zlib
+        return self._verify_images > 0 and zlib.crc32(filename.encode('utf8')) % self._verify_images == 0
+    def _verify_image(self, filename, encoded, width, height):
+        """
+        Decode an image returning its real size. A warning is printed if it differs from the expected one
+        Keyword arguments:
+        filename    -- the image file name
+        encoded     -- the encoded image
+        width       -- the expected width or None
+        height      -- the expected height or None
+        """
+        from PIL import Image
+        try:
+            image = Image.open(io.BytesIO(encoded))
+            image.load()
+        except Exception as exc:
+            raise Exception(f'Error!!! The image {filename} cannot be decoded: {exc}')
+        if (width and height and image.size != (width, height)):
+            print(f'Warning: the image {filename} is {image.size[0]}x{image.size[1]} instead of {width}x{height}')
+        return image.size
+    def create_tf_record(self, image_dir, output_file, labels_file = None, csv_file = None, num_workers = 1, num_shards = 1, rebuild = True, verify_images = 0, resize_target = None, resize_quality = 95, streaming = False, collect_labels = True, dedup = None, dedup_merge = False, dedup_threshold = 4, annotations_format = 'voc'):
         """
         TensorFlow record creator
         Keyword arguments:
-        image_dir   -- the directory containing the images
-        output_file -- the output file path and name
-        labels_file -- the optional output file path and name of the resulting labels file
-        csv_file    -- the optional output file path and name of the csv file
+        image_dir       -- the directory containing the images, or a tar or zip archive of them read in a single streaming pass
+        output_file     -- the output file path and name
+        labels_file     -- the optional output file path and name of the resulting labels file
+        csv_file        -- the optional output file path and name of the csv file
+        num_workers     -- number of processes encoding the examples. If < 1 all the available CPUs are used
+        num_shards      -- number of shards of the output file. If < 1 it's chosen from the size of the dataset
+        rebuild         -- force the rebuild of the record even if its manifest tells that it's up to date
+        verify_images   -- decode and check the size of 1 image every verify_images. If < 1 no image is verified
+        resize_target   -- the optional resizing of the model, as returned by get_resize_target, to which the images are downscaled
+        resize_quality  -- the JPEG quality of the downscaled images
+        streaming       -- parse, group and encode the annotations as a pipeline of generators, with a memory usage independent of the dataset size.
+                           Only the annotations of consecutive xml files are grouped in the same image
+        collect_labels  -- in streaming mode, collect the labels in a first pass over the xml files.
+                           If False the labels must be set up front with set_labels
+        dedup           -- remove the duplicated images: 'exact' for the same content or 'perceptual' also for the near duplicated ones. None for no deduplication
+        dedup_merge     -- merge the boxes of the duplicated images in the kept ones instead of dropping them.
+                           Not available in streaming mode and for the archives, where a warning is printed and the duplicates are dropped
+        dedup_threshold -- the maximum hamming distance of the perceptual hashes of two near duplicated images
+        annotations_format  -- 'voc' for an xml file per image, or the format of a single annotations file in the images directory
+                               loaded in bulk by one of the annotation_readers: 'coco' for a COCO json file or 'csv' for a flat csv file
         """
-        import tensorflow as tf
-        writer = tf.compat.v1.python_io.TFRecordWriter(output_file)
+        self._verify_images = verify_images
+        self._resize_target = resize_target
+        self._resize_quality = resize_quality
+        self._fixed_labels = streaming and not collect_labels
         path = os.path.join(image_dir)
-        examples = self.xml_to_csv(image_dir)
-        grouped = self.split(examples, 'filename')
-        for group in grouped:
-            tf_example = self.create_tf_example(group, path)
-            writer.write(tf_example.SerializeToString())
-        writer.close()
-        print(f'Created the TFRecord file {str(Path(output_file).resolve())}')
+        options = { 'num_shards': num_shards }
+        if (resize_target):
+            options['resize'] = [*resize_target, resize_quality]
+        deduplicator = None
+        if (dedup):
+            options['dedup'] = [dedup, dedup_merge, dedup_threshold]
+            # Created before reading the sources, so its invalid settings fail early
+            deduplicator = TFRecordDedup(dedup, dedup_merge, dedup_threshold)
+        if (annotations_format != 'voc'):
+            options['annotations_format'] = annotations_format
+        sources = self.scan_sources(image_dir, output_file, options, annotations_format, rebuild)
+        grouped = None
+        streamed = False
+        if (sources.added is not None and len(sources.added) == 0):
+            print(f'The TFRecord file {str(Path(output_file).resolve())} is up to date')
+        else:
+            grouped, num_images, dataset_size = self.read_sources(sources, image_dir, output_file, num_shards, streaming, collect_labels, deduplicator)
+            streamed = sources.archive or (streaming and not sources.bulk)
+            if (streamed and csv_file is not None):
+                grouped = stream_csv(grouped, csv_file)
+            # Build the labels dictionary before sharing the instance with the workers
+            self.build_label_dict()
+            if (num_workers < 1):
+                num_workers = os.cpu_count() or 1
+            if (num_images is not None):
+                num_workers = min(num_workers, max(num_images, 1))
+            plan = self.plan_shards(output_file, sources, num_shards, num_images, dataset_size)
+            if (sources.added):
+                print(f'Appending {num_images} new images to the TFRecord file {str(Path(output_file).resolve())}')
+            output_files = self.open_shards(output_file, plan, bool(sources.added))
+            offsets = [os.path.getsize(plan.fold_file)] if plan.fold_file else [0] * plan.new_shards
+            start_time = time.perf_counter()
+            index_entries, count, size = self.write_examples(grouped, path, output_files, plan.first_shard, offsets, num_workers)
+            if (plan.fold_file):
+                # A TFRecord file is a plain sequence of records: the new ones are appended to the last shard
+                with open(plan.fold_file, 'ab') as f, open(output_files[0], 'rb') as tmp:
+                    shutil.copyfileobj(tmp, f)
+                os.remove(output_files[0])
+            elapsed = max(time.perf_counter() - start_time, 1e-6)
+            manifest = sources.manifest
+            manifest.num_shards = plan.first_shard + plan.new_shards
+            TFRecordIndex.save(output_file, manifest.num_shards, index_entries, append = bool(sources.added))
+            if (manifest.num_shards > 1):
+                print(f'Created the TFRecord files {str(Path(output_file).resolve())}-?????-of-{manifest.num_shards:05d}')
+            else:
+                print(f'Created the TFRecord file {str(Path(output_file).resolve())}')
+            print(f'Encoded {count} examples ({size / 1048576:.1f} MB) in {elapsed:.1f}s with {num_workers} worker(s): '
+                  f'{count / elapsed:.1f} images/s, {size / 1048576 / elapsed:.1f} MB/s')
+            if (deduplicator):
+                deduplicator.save(output_file)
+                deduplicator.report()
+            manifest.labels = self.labels
+            manifest.save(output_file + '.manifest.json')
         if labels_file is not None:
-            from google.protobuf import text_format
-            from object_detection.protos.string_int_label_map_pb2 import StringIntLabelMap, StringIntLabelMapItem
-            msg = StringIntLabelMap()
-            for id, name in enumerate(self._label_set, start = 1):
-                msg.item.append(StringIntLabelMapItem(id = id, name = name))
-            text = str(text_format.MessageToBytes(msg, as_utf8 = True), 'utf-8')
-            with open(labels_file, 'w') as f:
-                f.write(text)
-            print(f'Created the labels map file {str(Path(labels_file).resolve())}')
-        if csv_file is not None:
-            examples.to_csv(csv_file, index = None)
+            self.write_labels_file(labels_file)
+        if csv_file is not None and grouped is not None:
+            if (not streamed):
+                write_csv(grouped, csv_file)
             print(f'Created the CSV file {str(Path(csv_file).resolve())}')
-    def split(self, df, group):
-        """
-        Split the labels in an image
-        Keyword arguments:
-        df      -- TensorFlow example
-        group   -- group's name
-        """
-        from collections import namedtuple
-        data = namedtuple('data', ['filename', 'object'])
-        gb = df.groupby(group)
-        return [data(filename, gb.get_group(x)) for filename, x in zip(gb.groups.keys(), gb.groups)]
-    def xml_to_csv(self, path):
-        """
-        Convert the xml files generated by labeling image softwares into the cvs panda format
-        Keyword arguments:
-        path    -- Path of the generated csv file
-        """
-        import pandas as pd
-        import xml.etree.ElementTree as ET
-        xml_list = []
-        for xml_file in glob.glob(path + '/*.xml'):
-            tree = ET.parse(xml_file)
-            root = tree.getroot()
-            for member in root.findall('object'):
-                value = (
-                    root.find('filename').text,
-                    int(root.find('size')[0].text),
-                    int(root.find('size')[1].text),
-                    member[0].text,
-                    int(member[4][0].text),
-                    int(member[4][1].text),
-                    int(member[4][2].text),
-                    int(member[4][3].text))
-                xml_list.append(value)
-                self._label_set.add(member[0].text)
-        column_name = ['filename', 'width', 'height', 'class', 'xmin', 'ymin', 'xmax', 'ymax']
-        xml_df = pd.DataFrame(xml_list, columns = column_name)
-        return xml_df
-
-def create_tf_records(prm: BaseParameters):
+    def scan_sources(self, image_dir, output_file, options, annotations_format = 'voc', rebuild = False):
+        """
+        Scan the sources of a record and compare them with the manifest of the existing record.
+        Return the RecordSources with the keys of the added sources: None for a full build, empty if the record is up to date
+        Keyword arguments:
+        image_dir           -- the directory containing the images, or a tar or zip archive of them
+        output_file         -- the record file path and name
+        options             -- the options of the record stored in the manifest
+        annotations_format  -- 'voc' for an xml file per image, or the format of a bulk annotations file
+        rebuild             -- ignore the manifest of the existing record
+        """
+        previous = None if rebuild else TFRecordManifest.load(output_file + '.manifest.json')
+        archive = is_archive(image_dir)
+        bulk = not archive and annotations_format != 'voc'
+        annotations_file = None
+        if (archive):
+            manifest = TFRecordManifest.scan_file(image_dir, previous, options)
+        elif (bulk):
+            annotations_file = find_annotations_file(image_dir, annotations_format)
+            manifest = TFRecordManifest.scan_file(annotations_file, previous, options)
+        else:
+            manifest = TFRecordManifest.scan(image_dir, previous, options)
+        added = None
+        if (previous and previous.options == manifest.options and len(get_tf_record_files(output_file)) == previous.num_shards and TFRecordIndex.exists(output_file)):
+            labels = self.labels
+            common = min(len(labels), len(previous.labels))
+            if (labels[:common] == previous.labels[:common]):
+                if (archive or bulk):
+                    added = [] if manifest.entries == previous.entries else None
+                else:
+                    added = manifest.get_added(previous)
+                if (added is not None):
+                    self.set_labels(previous.labels if len(previous.labels) > len(labels) else labels)
+        return RecordSources(manifest, previous, added, archive, bulk, annotations_file)
+    def read_sources(self, sources, image_dir, output_file, num_shards = 1, streaming = False, collect_labels = True, deduplicator = None):
+        """
+        Read the annotations of the sources to write, without the duplicates if required.
+        Return the annotations grouped by image (a list, or a generator in the streamed modes), their number
+        (None if unknown until the end of the read) and the size of the dataset
+        Keyword arguments:
+        sources         -- the sources as returned by scan_sources
+        image_dir       -- the directory containing the images, or a tar or zip archive of them
+        output_file     -- the record file path and name
+        num_shards      -- number of shards of the output file. If < 1 the size of the dataset is computed also for the bulk annotations
+        streaming       -- parse, group and encode the xml files as a pipeline of generators
+        collect_labels  -- in streaming mode, collect the labels in a first pass over the xml files
+        deduplicator    -- the optional TFRecordDedup removing the duplicated images
+        """
+        manifest = sources.manifest
+        keys = sources.added if sources.added else list(manifest.entries)
+        # The xml files are the ones of the manifest, without the skipped invalid annotations
+        xml_files = None if sources.archive or sources.bulk else [os.path.join(image_dir, key) for key in keys]
+        dataset_size = None
+        if (sources.archive):
+            # The number of images is unknown until the end of the single pass
+            grouped = self.read_archive(image_dir)
+            num_images = None
+            dataset_size = os.path.getsize(image_dir)
+        elif (sources.bulk):
+            grouped = group_annotations(annotation_readers[manifest.options['annotations_format']](sources.annotations_file))
+            for image in grouped:
+                self._label_set.update(image.classes)
+            num_images = len(grouped)
+            print(f'Read {num_images} annotated images from {str(Path(sources.annotations_file).resolve())}')
+        elif (streaming):
+            if (collect_labels):
+                self.collect_labels(image_dir, xml_files)
+            grouped = stream_annotations(self.parse_annotations(image_dir, xml_files))
+            num_images = len(keys)
+        else:
+            grouped = self.read_stored_annotations(image_dir, output_file, manifest, keys)
+            num_images = len(grouped)
+        if (deduplicator):
+            if (TFRecordDedup.exists(output_file)):
+                deduplicator.load(output_file, append = bool(sources.added))
+            image_hashes = None if sources.archive or sources.bulk else { entry['image']: entry['image_info'][2] for entry in manifest.entries.values() }
+            if (isinstance(grouped, list)):
+                grouped = deduplicator.deduplicate(grouped, image_dir, image_hashes)
+                num_images = len(grouped)
+            else:
+                grouped = deduplicator.filter(grouped, image_dir, image_hashes)
+        if (sources.bulk and num_shards < 1):
+            dataset_size = sum(os.path.getsize(os.path.join(image_dir, image.filename)) for image in grouped)
+        elif (not sources.archive and not sources.bulk):
+            dataset_size = sum(manifest.entries[key]['image_info'][0] for key in keys)
+        return grouped, num_images, dataset_size
+    @staticmethod
+    def plan_shards(output_file, sources, num_shards, num_images, dataset_size):
+        """
+        Return the ShardsPlan of the shards to write. The appended images go in new shards, until the count
+        of a full build of the whole dataset is reached. Past it they are folded in the last existing shard
+        Keyword arguments:
+        output_file     -- the record file path and name
+        sources         -- the sources as returned by scan_sources
+        num_shards      -- number of shards of the output file. If < 1 it's chosen from the size of the dataset
+        num_images      -- number of images to write or None if unknown
+        dataset_size    -- the size of the images to write
+        """
+        new_shards = num_shards if num_shards >= 1 else get_auto_shards_count(dataset_size)
+        if (num_images is not None):
+            new_shards = min(new_shards, max(num_images, 1))
+        if (not sources.added):
+            return ShardsPlan(0, new_shards, None)
+        if (num_images == 0):
+            # All the new images were removed as duplicates: no shards to append
+            new_shards = 0
+        first_shard = sources.previous.num_shards
+        # The shards count doesn't grow past the one of a full build of the whole dataset
+        max_shards = num_shards if num_shards > 0 else get_auto_shards_count(sum(entry['image_info'][0] for entry in sources.manifest.entries.values()))
+        if (new_shards > 0 and first_shard + new_shards > max_shards):
+            new_shards = max(max_shards - first_shard, 0)
+            if (new_shards == 0):
+                # Fold the new images in the last shard: they are written in a temporary file then appended to it
+                return ShardsPlan(first_shard - 1, 1, get_tf_record_file_names(output_file, first_shard)[-1])
+        return ShardsPlan(first_shard, new_shards, None)
+    @staticmethod
+    def open_shards(output_file, plan, append):
+        """
+        Prepare the files of the shards of a plan, returning the ones to write
+        Keyword arguments:
+        output_file -- the record file path and name
+        plan        -- the ShardsPlan as returned by plan_shards
+        append      -- the images are appended to the existing record
+        """
+        if (plan.fold_file):
+            return [plan.fold_file + '.tmp']
+        if (append):
+            # Append the new shards, renaming the existing ones with the new total count
+            output_files = get_tf_record_file_names(output_file, plan.first_shard + plan.new_shards)
+            for old_file, new_file in zip(get_tf_record_file_names(output_file, plan.first_shard), output_files):
+                os.replace(old_file, new_file)
+            return output_files[plan.first_shard:]
+        remove_tf_record_files(output_file)
+        return get_tf_record_file_names(output_file, plan.new_shards)
+    def write_examples(self, groups, path, output_files, first_shard = 0, offsets = None, num_workers = 1):
+        """
+        Write the examples of the groups round robin in the shard files.
+        Return the index entries (shard, offset, length, filename, box count), the count and the size of the examples
+        Keyword arguments:
+        groups          -- the iterable of the groups of labels of each image
+        path            -- path of the labeled images
+        output_files    -- the files of the shards to write
+        first_shard     -- the index in the record of the first shard to write
+        offsets         -- the initial write offsets of the shards, 0 if None
+        num_workers     -- number of processes encoding the examples
+        """
+        import tensorflow as tf
+        writers = [tf.compat.v1.python_io.TFRecordWriter(f) for f in output_files]
+        offsets = list(offsets) if offsets else [0] * len(output_files)
+        index_entries = []
+        count = 0
+        size = 0
+        try:
+            for group, serialized in self.serialize_examples(groups, path, num_workers):
+                shard = count % len(output_files)
+                writers[shard].write(serialized)
+                index_entries.append((first_shard + shard, offsets[shard], len(serialized), group.filename, len(group.classes)))
+                offsets[shard] += TFRecordIndex.get_record_size(serialized)
+                count += 1
+                size += len(serialized)
+        finally:
+            for writer in writers:
+                writer.close()
+        return index_entries, count, size
+    def write_labels_file(self, labels_file):
+        """
+        Write the labels map file of the labels
+        Keyword arguments:
+        labels_file -- the labels file path and name
+        """
+        from google.protobuf import text_format
+        from object_detection.protos.string_int_label_map_pb2 import StringIntLabelMap, StringIntLabelMapItem
+        msg = StringIntLabelMap()
+        for id, name in enumerate(self.labels, start = 1):
+            msg.item.append(StringIntLabelMapItem(id = id, name = name))
+        text = str(text_format.MessageToBytes(msg, as_utf8 = True), 'utf-8')
+        with open(labels_file, 'w') as f:
+            f.write(text)
+        print(f'Created the labels map file {str(Path(labels_file).resolve())}')
+    def serialize_examples(self, groups, path, num_workers = 1):
+        """
+        Generator of the groups with their serialized TensorFlow examples, in the same order of the groups.
+        The groups are consumed lazily, keeping a bounded number of examples in memory
+        Keyword arguments:
+        groups      -- the iterable of the groups of labels of each image
+        path        -- path of the labeled images
+        num_workers -- number of processes encoding the examples
+        """
+        if (num_workers > 1):
+            from concurrent.futures import ProcessPoolExecutor
+            submitted = deque()
+            def jobs():
+                for group in groups:
+                    submitted.append(group)
+                    # Index the labels of the group before sending them to the workers
+                    if (not self._fixed_labels):
+                        for label in group.classes:
+                            self.class_text_to_int(label)
+                    yield group, path, list(self._label_dict)
+            with ProcessPoolExecutor(num_workers, initializer = _init_encoding_worker, initargs = (self,)) as executor:
+                for serialized in _ordered_map(executor, _encode_example, jobs(), num_workers * 4):
+                    yield submitted.popleft(), serialized
+        else:
+            for group in groups:
+                yield group, self.create_tf_example(group, path).SerializeToString()
+    def collect_labels(self, path, xml_files = None, num_readers = 16):
+        """
+        Collect the labels of the xml files generated by labeling image softwares, without keeping their annotations
+        Keyword arguments:
+        path        -- Path of the xml files
+        xml_files   -- the optional list of xml files to read instead of all the ones in the path
+        num_readers -- number of threads parsing the files
+        """
+        from concurrent.futures import ThreadPoolExecutor
+        if (xml_files is None):
+            xml_files = sorted(glob.glob(os.path.join(glob.escape(path), '*.xml')))
+        with ThreadPoolExecutor(num_readers) as executor:
+            for labels in executor.map(parse_annotation_labels, xml_files):
+                self._label_set.update(labels)
+    def parse_annotations(self, path, xml_files = None, num_readers = 16):
+        """
+        Generator of the annotations of the xml files generated by labeling image softwares.
+        The files are parsed by a pool of threads and the annotations are yielded in the order of the files
+        Keyword arguments:
+        path        -- Path of the xml files
+        xml_files   -- the optional list of xml files to read instead of all the ones in the path
+        num_readers -- number of threads parsing the files
+        """
+        from concurrent.futures import ThreadPoolExecutor
+        if (xml_files is None):
+            xml_files = sorted(glob.glob(os.path.join(glob.escape(path), '*.xml')))
+        with ThreadPoolExecutor(num_readers) as executor:
+            jobs = ((xml_file,) for xml_file in xml_files)
+            for annotations in _ordered_map(executor, parse_annotation_file, jobs, num_readers * 4):
+                if (annotations is not None):
+                    self._label_set.update(annotations.classes)
+                    yield annotations
+    def read_archive(self, archive_file):
+        """
+        Generator of the annotations of the images of a tar or zip archive, with the content of the images.
+        The archive is read in a single sequential pass, pairing in memory the xml files with their images
+        Keyword arguments:
+        archive_file    -- the archive
+        """
+        import numpy as np
+        import posixpath
+        pending_images = dict()
+        pending_annotations = dict()
+        for name, data in read_archive_files(archive_file):
+            if (name.lower().endswith('.xml')):
+                image = parse_annotation_file(io.BytesIO(data))
+                if (image is None):
+                    continue
+                self._label_set.update(image.classes)
+                key = posixpath.join(posixpath.dirname(name), image.filename)
+                previous = pending_annotations.get(key)
+                if (previous is not None):
+                    image = image._replace(
+                        classes = previous.classes + image.classes,
+                        boxes = np.concatenate([previous.boxes, image.boxes]))
+                if (key in pending_images):
+                    yield image._replace(encoded = pending_images.pop(key))
+                else:
+                    pending_annotations[key] = image
+            elif (name.lower().endswith(_image_extensions)):
+                if (name in pending_annotations):
+                    yield pending_annotations.pop(name)._replace(encoded = data)
+                else:
+                    pending_images[name] = data
+        for key in pending_annotations:
+            print(f'Warning: the image {key} is not in the archive {archive_file}')
+        if (len(pending_images) > 0):
+            print(f'Warning: {len(pending_images)} images of the archive {archive_file} have no annotations')
+    def read_stored_annotations(self, path, output_file, manifest, keys, num_readers = 16):
+        """
+        Read the annotations of xml files grouping them by image. The unchanged files are taken from the columnar store
+        of the record and only the new or changed ones are parsed. The store is then updated for all the files of the manifest
+        Keyword arguments:
+        path        -- Path of the xml files
+        output_file -- the record file path and name
+        manifest    -- the manifest of the xml files
+        keys        -- the keys in the manifest of the xml files to read
+        num_readers -- number of threads parsing the files
+        """
+        from concurrent.futures import ThreadPoolExecutor
+        try:
+            store = TFRecordAnnotations(output_file) if TFRecordAnnotations.exists(output_file) else TFRecordAnnotations()
+        except Exception as exc:
+            print(f'Warning: the stored annotations cannot be read: {exc}')
+            store = TFRecordAnnotations()
+        annotations = dict()
+        missing = []
+        for key, entry in manifest.entries.items():
+            found, image = store.get(key, entry['xml'][2])
+            if (found):
+                annotations[key] = image
+            else:
+                missing.append(key)
+        if (len(missing) > 0):
+            with ThreadPoolExecutor(num_readers) as executor:
+                jobs = ((os.path.join(path, key),) for key in missing)
+                for key, image in zip(missing, _ordered_map(executor, parse_annotation_file, jobs, num_readers * 4)):
+                    annotations[key] = image
+        if (len(missing) > 0 or len(store) != len(manifest.entries)):
+            TFRecordAnnotations.save(output_file, [(key, entry['xml'][2], annotations[key]) for key, entry in manifest.entries.items()])
+        print(f'Read {len(manifest.entries) - len(missing)} annotation files from the store and parsed {len(missing)}')
+        images = [annotations[key] for key in keys if annotations[key] is not None]
+        for image in images:
+            self._label_set.update(image.classes)
+        return group_annotations(images)
+    def read_annotations(self, path, xml_files = None, num_readers = 16):
+        """
+        Read the xml files generated by labeling image softwares, grouping the annotations by image
+        Keyword arguments:
+        path        -- Path of the xml files
+        xml_files   -- the optional list of xml files to read instead of all the ones in the path
+        num_readers -- number of threads parsing the files
+        """
+        return group_annotations(self.parse_annotations(path, xml_files, num_readers))
+
+def group_annotations(annotations):
+    """
+    Group by image file name the annotations read from the xml files, sorting them by name
+    Keyword arguments:
+    annotations -- the iterable of the annotations of the xml files
+    """
+    import numpy as np
+    images = dict()
+    for image in annotations:
+        previous = images.get(image.filename)
+        if (previous is not None):
+            image = image._replace(
+                classes = previous.classes + image.classes,
+                boxes = np.concatenate([previous.boxes, image.boxes]))
+        images[image.filename] = image
+    return [images[filename] for filename in sorted(images)]
+
+def find_annotations_file(image_dir, annotations_format):
+    """
+    Return the single bulk annotations file of a format contained in the images directory
+    Keyword arguments:
+    image_dir           -- the directory containing the images
+    annotations_format  -- the format of the annotations file
+    """
+    if (annotations_format not in annotation_readers):
+        raise Exception(f'Error!!! Unknown annotations format {annotations_format}')
+    files = sorted(glob.glob(os.path.join(glob.escape(image_dir), _annotations_file_patterns[annotations_format])))
+    if (len(files) != 1):
+        raise Exception(f'Error!!! The directory {image_dir} must contain exactly one {annotations_format} annotations file')
+    return files[0]
+
+def read_coco_annotations(annotations_file):
+    """
+    Read in bulk the annotations of the images from a COCO json file
+    Keyword arguments:
+    annotations_file    -- the COCO json file
+    """
+    import  json
+    import  numpy as np
+    with open(annotations_file, 'r') as f:
+        content = json.load(f)
+    categories = { category['id']: category['name'] for category in content['categories'] }
+    image_boxes = dict()
+    for annotation in content['annotations']:
+        image_boxes.setdefault(annotation['image_id'], []).append(annotation)
+    images = []
+    for image in content['images']:
+        annotations = image_boxes.get(image['id'])
+        if (not annotations):
+            continue
+        boxes = np.array([annotation['bbox'] for annotation in annotations], np.float32).reshape(-1, 4)
+        boxes[:, 2:] += boxes[:, :2]
+        images.append(ImageAnnotations(
+            image['file_name'],
+            int(image.get('width', 0)),
+            int(image.get('height', 0)),
+            [categories[annotation['category_id']] for annotation in annotations],
+            boxes))
+    return images
+
+def read_csv_annotations(annotations_file):
+    """
+    Read in bulk the annotations of the images from a flat csv file, one row per box,
+    with the columns filename, width, height, class, xmin, ymin, xmax and ymax
+    Keyword arguments:
+    annotations_file    -- the csv file
+    """
+    import numpy as np
+    image_rows = dict()
+    with open(annotations_file, 'r', newline = '') as f:
+        for row in csv.DictReader(f):
+            image_rows.setdefault(row['filename'], []).append(row)
+    images = []
+    for filename, rows in image_rows.items():
+        images.append(ImageAnnotations(
+            filename,
+            int(float(rows[0]['width'] or 0)),
+            int(float(rows[0]['height'] or 0)),
+            [row['class'] for row in rows],
+            np.array([[float(row[c]) for c in ('xmin', 'ymin', 'xmax', 'ymax')] for row in rows], np.float32)))
+    return images
+
+# Readers of the bulk annotations files by annotations format
+annotation_readers = { 'coco': read_coco_annotations, 'csv': read_csv_annotations }
+
+def stream_annotations(annotations):
+    """
+    Generator grouping by image file name the annotations of consecutive xml files
+    Keyword arguments:
+    annotations -- the iterable of the annotations of the xml files
+    """
+    import numpy as np
+    current = None
+    for image in annotations:
+        if (current is not None and current.filename == image.filename):
+            current = current._replace(
+                classes = current.classes + image.classes,
+                boxes = np.concatenate([current.boxes, image.boxes]))
+            continue
+        if (current is not None):
+            yield current
+        current = image
+    if (current is not None):
+        yield current
+
+def parse_annotation_labels(xml_file):
+    """
+    Return the set of the labels of the objects of a Pascal VOC xml file
+    Keyword arguments:
+    xml_file    -- the xml file
+    """
+    import xml.etree.ElementTree as ET
+    labels = set()
+    for event, element in ET.iterparse(xml_file):
+        if (element.tag == 'object'):
+            labels.add(element.findtext('name'))
+            element.clear()
+    return labels
+
+def parse_annotation_file(xml_file):
+    """
+    Parse incrementally a Pascal VOC xml file, reading the fields by tag name.
+    Return None if the file doesn't contain any object
+    Keyword arguments:
+    xml_file    -- the xml file path or file object
+    """
+    import numpy as np
+    import xml.etree.ElementTree as ET
+    filename = None
+    width = height = 0
+    classes = []
+    boxes = []
+    for event, element in ET.iterparse(xml_file):
+        if (element.tag == 'object'):
+            bndbox = element.find('bndbox')
+            classes.append(element.findtext('name'))
+            boxes.append([float(bndbox.findtext(tag)) for tag in ('xmin', 'ymin', 'xmax', 'ymax')])
+            element.clear()
+        elif (element.tag == 'filename' and filename is None):
+            filename = element.text
+        elif (element.tag == 'size'):
+            width = int(float(element.findtext('width')))
+            height = int(float(element.findtext('height')))
+    if (len(classes) == 0):
+        return None
+    return ImageAnnotations(filename, width, height, classes, np.array(boxes, np.float32))
+
+def read_archive_files(archive_file):
+    """
+    Generator of the names and the contents of the files of a tar or zip archive, in the order they are stored
+    Keyword arguments:
+    archive_file    -- the archive
+    """
+    import tarfile
+    import zipfile
+    if (zipfile.is_zipfile(archive_file)):
+        with zipfile.ZipFile(archive_file) as archive:
+            for info in sorted(archive.infolist(), key = lambda info: info.header_offset):
+                if (not info.is_dir()):
+                    yield info.filename, archive.read(info)
+    else:
+        with tarfile.open(archive_file, 'r|*') as archive:
+            for member in archive:
+                if (member.isfile()):
+                    yield member.name, archive.extractfile(member).read()
+
+def get_image_info(data):
+    """
+    Return the format, the width and the height of a JPEG or PNG image reading only its header.
+    The width and the height are None if the format is not recognized
+    Keyword arguments:
+    data    -- the encoded image
+    """
+    if (data[:8] == b'\x89PNG\r\n\x1a\n' and data[12:16] == b'IHDR'):
+        return 'png', int.from_bytes(data[16:20], 'big'), int.from_bytes(data[20:24], 'big')
+    if (data[:2] == b'\xff\xd8'):
+        # Walk the segments up to the start of frame marker
+        i = 2
+        while (i + 9 <= len(data)):
+            if (data[i] != 0xff):
+                break
+            marker = data[i + 1]
+            if (marker == 0xff):
+                i += 1
+                continue
+            if (marker == 0x01 or 0xd0 <= marker <= 0xd9):
+                i += 2
+                continue
+            if (0xc0 <= marker <= 0xcf and marker not in (0xc4, 0xc8, 0xcc)):
+                return 'jpeg', int.from_bytes(data[i + 7:i + 9], 'big'), int.from_bytes(data[i + 5:i + 7], 'big')
+            i += 2 + int.from_bytes(data[i + 2:i + 4], 'big')
+        return 'jpeg', None, None
+    return None, None, None
+
+def get_resize_target(pipeline_config_path):
+    """
+    Return the image resizer of a model as a tuple ('fixed_shape', height, width) or
+    ('keep_aspect_ratio', min_dimension, max_dimension). Return None for other resizers
+    Keyword arguments:
+    pipeline_config_path    -- the pipeline configuration file of the model
+    """
+    from object_detection.utils import config_util
+    model_config = config_util.get_configs_from_pipeline_file(pipeline_config_path)['model']
+    image_resizer = getattr(model_config, model_config.WhichOneof('model')).image_resizer
+    resizer_type = image_resizer.WhichOneof('image_resizer_oneof')
+    if (resizer_type == 'fixed_shape_resizer'):
+        return 'fixed_shape', image_resizer.fixed_shape_resizer.height, image_resizer.fixed_shape_resizer.width
+    if (resizer_type == 'keep_aspect_ratio_resizer'):
+        resizer = image_resizer.keep_aspect_ratio_resizer
+        return 'keep_aspect_ratio', resizer.min_dimension, resizer.max_dimension
+    return None
+
+def get_model_resize_target(prm: TrainParameters):
+    """
+    Return the image resizer of the model to train as returned by get_resize_target
+    Keyword arguments:
+    prm     -- Parameters
+    """
+    pipeline_config_path = prm.pipeline_config_path
+    if (not pipeline_config_path or not os.path.exists(pipeline_config_path)):
+        pre_trained_model_dir = prm.pre_trained_model_dir if prm.pre_trained_model_dir else os.path.join(prm.pre_trained_model_base_dir, prm.model['dir_name'])
+        pipeline_config_path = os.path.join(pre_trained_model_dir, 'pipeline.config')
+    return get_resize_target(pipeline_config_path)
+
+def get_resize_scale(resize_target, width, height):
+    """
+    Return the scale to apply to an image for having the smallest size still not upscaled by the model resizer
+    Keyword arguments:
+    resize_target   -- the resizer of the model as returned by get_resize_target or None
+    width           -- the width of the image
+    height          -- the height of the image
+    """
+    if (not resize_target):
+        return 1
+    if (resize_target[0] == 'fixed_shape'):
+        return max(resize_target[1] / height, resize_target[2] / width)
+    return min(resize_target[1] / min(width, height), resize_target[2] / max(width, height))
+
+def resize_image(data, scale, quality = 95):
+    """
+    Downscale an encoded image, returning it JPEG encoded with its new width and height
+    Keyword arguments:
+    data    -- the encoded image
+    scale   -- the scale factor
+    quality -- the JPEG quality
+    """
+    from PIL import Image
+    image = Image.open(io.BytesIO(data))
+    size = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+    # Let the JPEG decoder skip the unneeded resolution
+    image.draft('RGB', size)
+    image = image.convert('RGB').resize(size, Image.BILINEAR)
+    output = io.BytesIO()
+    image.save(output, 'JPEG', quality = quality)
+    return output.getvalue(), size[0], size[1]
+
+def write_csv(annotations, csv_file):
+    """
+    Write the annotations in a csv file, one row per box
+    Keyword arguments:
+    annotations -- the list of annotations of the images
+    csv_file    -- the output file path and name of the csv file
+    """
+    for image in stream_csv(annotations, csv_file):
+        pass
+
+def stream_csv(annotations, csv_file):
+    """
+    Generator writing the annotations in a csv file, one row per box, while yielding them
+    Keyword arguments:
+    annotations -- the iterable of the annotations of the images
+    csv_file    -- the output file path and name of the csv file
+    """
+    with open(csv_file, 'w', newline = '') as f:
+        writer = csv.writer(f)
+        writer.writerow(['filename', 'width', 'height', 'class', 'xmin', 'ymin', 'xmax', 'ymax'])
+        for image in annotations:
+            for label, box in zip(image.classes, image.boxes.tolist()):
+                writer.writerow([image.filename, image.width, image.height, label, *(f'{v:g}' for v in box)])
+            yield image
+
+def get_auto_shards_count(dataset_size):
+    """
+    Return the number of shards suitable for a dataset
+    Keyword arguments:
+    dataset_size    -- the size in bytes of the dataset's images
+    """
+    return max(1, min(-(-dataset_size // _shard_target_size), _max_auto_shards))
+
+def get_tf_record_file_names(output_file, num_shards):
+    """
+    Return the names of the files of a record
+    Keyword arguments:
+    output_file -- the output file path and name
+    num_shards  -- number of shards of the record
+    """
+    if (num_shards < 2):
+        return [output_file]
+    return [f'{output_file}-{index:05d}-of-{num_shards:05d}' for index in range(num_shards)]
+
+def get_tf_record_files(output_file):
+    """
+    Return the existing files of a record: the list of its shards or the single file
+    Keyword arguments:
+    output_file -- the output file path and name
+    """
+    shards = sorted(glob.glob(glob.escape(output_file) + '-' + '[0-9]' * 5 + '-of-' + '[0-9]' * 5))
+    if (len(shards) > 0):
+        return shards
+    return [output_file] if os.path.exists(output_file) else []
+
+def remove_tf_record_files(output_file):
+    """
+    Remove the existing files of a record, the single one and the shards
+    Keyword arguments:
+    output_file -- the output file path and name
+    """
+    for f in get_tf_record_files(output_file):
+        os.remove(f)
+    if (os.path.exists(output_file)):
+        os.remove(output_file)
+
+def get_augmentation_transforms(prm: TrainParameters):
+    """
+    Return the list of the offline augmentation transforms
+    Keyword arguments:
+    prm     -- Parameters
+    """
+    return [t.strip() for t in (prm.augmentations or '').split(',') if t.strip()]
+
+def get_train_records(prm: TrainParameters):
+    """
+    Return the train record, followed by the augmented record if enabled (without the shard suffix)
+    Keyword arguments:
+    prm     -- Parameters
+    """
+    records = [os.path.join(prm.annotations_dir, 'train.record')]
+    if (prm.augmentation_copies > 0):
+        records.append(os.path.join(prm.annotations_dir, 'train_augmented.record'))
+    return records
+
+def get_train_record_files(prm: TrainParameters):
+    """
+    Return the files of the train record, followed by the ones of the augmented record if enabled
+    Keyword arguments:
+    prm     -- Parameters
+    """
+    return [f for record in get_train_records(prm) for f in get_tf_record_files(record)]
+
+def create_tf_records(prm: TrainParameters):
     """
     TensorFlow record files creator
     Keyword arguments:
     prm     -- Parameters
     """
+    options = {
+        'num_workers': prm.num_record_workers,
+        'num_shards': prm.num_record_shards,
+        'rebuild': prm.rebuild_records,
+        'verify_images': prm.verify_images,
+        'streaming': prm.streaming_records,
+        'dedup': prm.dedup_images,
+        'dedup_merge': prm.dedup_merge,
+        'dedup_threshold': prm.dedup_threshold,
+        'annotations_format': prm.annotations_format }
+    if (prm.resize_images):
+        options['resize_target'] = get_model_resize_target(prm)
+        options['resize_quality'] = prm.resize_quality
+        print(f'The images will be downscaled for the image resizer {options["resize_target"]}')
     print("Creating TFRecord for the train images...")
-    TFRecord().create_tf_record(
+    train_record = TFRecord()
+    train_record.create_tf_record(
         prm.train_images_dir,
         os.path.join(prm.annotations_dir, 'train.record'),
-        os.path.join(prm.annotations_dir, 'label_map.pbtxt')) # TODO: Check if there is already a label definition file and use it
+        os.path.join(prm.annotations_dir, 'label_map.pbtxt'), # TODO: Check if there is already a label definition file and use it
+        **options)
+    if (prm.augmentation_copies > 0):
+        from tf_records_augmentation import create_augmented_record
+        print("Creating the augmented TFRecord for the train images...")
+        create_augmented_record(
+            os.path.join(prm.annotations_dir, 'train.record'),
+            os.path.join(prm.annotations_dir, 'train_augmented.record'),
+            prm.augmentation_copies,
+            get_augmentation_transforms(prm),
+            prm.num_record_workers,
+            prm.num_record_shards)
     print("Creating TFRecord for the evaluation images...")
-    TFRecord().create_tf_record(
+    # The evaluation record must share the label indices of the train record
+    eval_record = TFRecord()
+    eval_record.set_labels(train_record.labels)
+    eval_record.create_tf_record(
         prm.eval_images_dir,
-        os.path.join(prm.annotations_dir, 'eval.record'))
+        os.path.join(prm.annotations_dir, 'eval.record'),
+        **options)
+    if (prm.raw_cache):
+        from train_raw_cache import create_raw_cache
+        print("Creating the raw images cache for the train...")
+        create_raw_cache(
+            get_train_records(prm),
+            os.path.join(prm.annotations_dir, 'train.raw'),
+            get_model_resize_target(prm),
+            prm.num_record_workers)
     shutil.copy2(os.path.join(prm.annotations_dir, 'label_map.pbtxt'), prm.model_dir)
     print(f"The labels map file was copied to {(os.path.join(str(Path(prm.model_dir).resolve()), 'label_map.pbtxt'))}")
 
 if __name__ == '__main__':
-    prm = ('prm' in locals() and isinstance(prm, BaseParameters) and prm) or BaseParameters.default
+    prm = ('prm' in locals() and isinstance(prm, TrainParameters) and prm) or TrainParameters.default
     create_tf_records(prm)
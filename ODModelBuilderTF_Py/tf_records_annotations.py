@@ -0,0 +1,132 @@
+import  os
+from    pathlib import Path
+
+try:    from    train_parameters import TrainParameters
+except: pass
+
+class TFRecordAnnotations:
+    """Columnar store of the parsed annotations of the xml files of a TensorFlow record"""
+    def __init__(self, output_file = None):
+        """
+        Constructor
+        Keyword arguments:
+        output_file -- the optional record file path and name of which loading the stored annotations
+        """
+        import numpy as np
+        super().__init__()
+        self.keys = np.zeros((0,), str)
+        self.hashes = np.zeros((0,), str)
+        self.filenames = np.zeros((0,), str)
+        self.widths = np.zeros((0,), np.int32)
+        self.heights = np.zeros((0,), np.int32)
+        self.box_offsets = np.zeros((1,), np.int64)
+        self.boxes = np.zeros((0, 4), np.float32)
+        self.classes = np.zeros((0,), np.int32)
+        self.labels = np.zeros((0,), str)
+        self._key_dict = None
+        if (output_file):
+            with np.load(output_file + '.annotations.npz') as store:
+                self.keys = store['keys']
+                self.hashes = store['hashes']
+                self.filenames = store['filenames']
+                self.widths = store['widths']
+                self.heights = store['heights']
+                self.box_offsets = store['box_offsets']
+                self.boxes = store['boxes']
+                self.classes = store['classes']
+                self.labels = store['labels']
+    def __len__(self):
+        return len(self.keys)
+    @staticmethod
+    def exists(output_file):
+        """
+        Check if a record has stored annotations
+        Keyword arguments:
+        output_file -- the record file path and name
+        """
+        return os.path.exists(output_file + '.annotations.npz')
+    @staticmethod
+    def save(output_file, entries):
+        """
+        Save the annotations of a record
+        Keyword arguments:
+        output_file -- the record file path and name
+        entries     -- list of tuples (xml key, xml hash, annotations) of the xml files. The annotations are None for the files without objects
+        """
+        import numpy as np
+        labels = sorted({ label for key, hash, image in entries if image for label in image.classes })
+        label_ids = { label: i for i, label in enumerate(labels) }
+        images = [image for key, hash, image in entries]
+        box_counts = [len(image.classes) if image else 0 for image in images]
+        store_file = output_file + '.annotations.npz'
+        with open(store_file + '.tmp', 'wb') as f:
+            np.savez(
+                f,
+                keys = np.array([key for key, hash, image in entries], str),
+                hashes = np.array([hash for key, hash, image in entries], str),
+                filenames = np.array([image.filename if image else '' for image in images], str),
+                widths = np.array([image.width if image else 0 for image in images], np.int32),
+                heights = np.array([image.height if image else 0 for image in images], np.int32),
+                box_offsets = np.concatenate([[0], np.cumsum(box_counts, dtype = np.int64)]),
+                boxes = np.concatenate([np.zeros((0, 4), np.float32), *(image.boxes for image in images if image)]),
+                classes = np.array([label_ids[label] for image in images if image for label in image.classes], np.int32),
+                labels = np.array(labels, str))
+        os.replace(store_file + '.tmp', store_file)
+        print(f'Created the annotations file {str(Path(store_file).resolve())}')
+    def __getitem__(self, i):
+        """
+        Return the annotations of an xml file, or None if it doesn't contain any object
+        Keyword arguments:
+        i   -- the index of the xml file
+        """
+        from tf_records import ImageAnnotations
+        if (not self.filenames[i]):
+            return None
+        box_slice = slice(self.box_offsets[i], self.box_offsets[i + 1])
+        return ImageAnnotations(
+            str(self.filenames[i]),
+            int(self.widths[i]),
+            int(self.heights[i]),
+            [str(self.labels[c]) for c in self.classes[box_slice]],
+            self.boxes[box_slice])
+    def get(self, key, hash):
+        """
+        Return a tuple (found, annotations) with the stored annotations of an xml file, if its content hash is unchanged
+        Keyword arguments:
+        key     -- the key of the xml file in the manifest
+        hash    -- the current content hash of the xml file
+        """
+        if (self._key_dict is None):
+            self._key_dict = { str(k): i for i, k in enumerate(self.keys) }
+        i = self._key_dict.get(key)
+        if (i is None or self.hashes[i] != hash):
+            return False, None
+        return True, self[i]
+    def annotations(self):
+        """
+        Generator of the annotations of the xml files containing objects
+        """
+        for i in range(len(self)):
+            image = self[i]
+            if (image is not None):
+                yield image
+    def grouped(self):
+        """
+        Return the annotations grouped by image, sorted by image file name
+        """
+        from tf_records import group_annotations
+        return group_annotations(self.annotations())
+
+if __name__ == '__main__':
+    import numpy as np
+    prm = ('prm' in locals() and isinstance(prm, TrainParameters) and prm) or TrainParameters.default
+    for name in ['train.record', 'eval.record']:
+        output_file = os.path.join(prm.annotations_dir, name)
+        if (TFRecordAnnotations.exists(output_file)):
+            store = TFRecordAnnotations(output_file)
+            counts = np.bincount(store.classes, minlength = len(store.labels))
+            print(f'{name}: {len(store.grouped())} images, {len(store.classes)} boxes')
+            for label, count in zip(store.labels, counts):
+                print(f'    {label}: {count} boxes')
+        else:
+            print(f'{name}: no stored annotations')
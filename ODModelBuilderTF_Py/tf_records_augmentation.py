@@ -0,0 +1,209 @@
+import  io
+import  os
+from    pathlib import Path
+import  time
+
+try:    from    train_parameters import TrainParameters
+except: pass
+try:    from    tf_records_manifest import TFRecordManifest
+except: pass
+try:    from    tf_records_index import TFRecordIndex
+except: pass
+
+# Available box-aware transforms, applied in this order
+augmentation_transforms = ('flip', 'crop', 'scale', 'color')
+# Range of the side of the crops relative to the image's side
+_crop_range = (0.6, 1.0)
+# Minimum fraction of the area of a box that must remain in a crop for keeping it
+_crop_min_overlap = 0.5
+# Range of the scale factors
+_scale_range = (0.5, 1.0)
+# Range of the brightness, contrast and saturation factors
+_color_range = (0.75, 1.25)
+
+def _filter_repeated(values, keep):
+    """
+    Keep in place the values of a repeated field selected by a mask
+    Keyword arguments:
+    values  -- the repeated field
+    keep    -- the mask of the values to keep
+    """
+    kept = [v for v, k in zip(values, keep) if k]
+    del values[:]
+    values.extend(kept)
+
+def augment_image(image, boxes, transforms, rng):
+    """
+    Apply random transforms to an image and its boxes.
+    Return the transformed image, boxes and the mask of the kept boxes
+    Keyword arguments:
+    image       -- the PIL RGB image
+    boxes       -- the float array of rows (xmin, ymin, xmax, ymax) of the normalized boxes
+    transforms  -- the names of the transforms to apply
+    rng         -- the numpy random generator
+    """
+    import  numpy as np
+    from    PIL import Image, ImageEnhance, ImageOps
+    boxes = boxes.copy()
+    keep = np.ones(len(boxes), bool)
+    if ('flip' in transforms and rng.random() < 0.5):
+        image = ImageOps.mirror(image)
+        boxes[:, [0, 2]] = 1 - boxes[:, [2, 0]]
+    if ('crop' in transforms):
+        for _ in range(10):
+            w, h = rng.uniform(*_crop_range, 2)
+            x0, y0 = rng.uniform(0, 1 - w), rng.uniform(0, 1 - h)
+            clipped = np.clip((boxes - [x0, y0, x0, y0]) / [w, h, w, h], 0, 1)
+            area = np.prod(boxes[:, 2:] - boxes[:, :2], axis = 1)
+            clipped_area = np.prod(clipped[:, 2:] - clipped[:, :2], axis = 1) * w * h
+            crop_keep = clipped_area >= _crop_min_overlap * np.maximum(area, 1e-9)
+            if (np.any(crop_keep)):
+                image = image.crop((
+                    round(x0 * image.width), round(y0 * image.height),
+                    round((x0 + w) * image.width), round((y0 + h) * image.height)))
+                boxes = clipped
+                keep = crop_keep
+                break
+    if ('scale' in transforms):
+        scale = rng.uniform(*_scale_range)
+        image = image.resize((max(1, round(image.width * scale)), max(1, round(image.height * scale))), Image.BILINEAR)
+    if ('color' in transforms):
+        for enhancer in (ImageEnhance.Brightness, ImageEnhance.Contrast, ImageEnhance.Color):
+            image = enhancer(image).enhance(rng.uniform(*_color_range))
+    return image, boxes, keep
+
+def augment_example(serialized, copies, transforms, seed, quality = 95):
+    """
+    Create augmented copies of a serialized TensorFlow example.
+    Return the list of tuples (serialized example, image file name, boxes count) of the copies
+    Keyword arguments:
+    serialized  -- the serialized example
+    copies      -- number of augmented copies
+    transforms  -- the names of the transforms to apply
+    seed        -- the seed of the random transforms of the example
+    quality     -- the JPEG quality of the augmented images
+    """
+    import  numpy as np
+    from    PIL import Image
+    import  tensorflow as tf
+    source = tf.train.Example.FromString(serialized)
+    feature = source.features.feature
+    image = Image.open(io.BytesIO(feature['image/encoded'].bytes_list.value[0])).convert('RGB')
+    boxes = np.array([
+        feature['image/object/bbox/xmin'].float_list.value,
+        feature['image/object/bbox/ymin'].float_list.value,
+        feature['image/object/bbox/xmax'].float_list.value,
+        feature['image/object/bbox/ymax'].float_list.value], np.float32).T.reshape(-1, 4)
+    filename = feature['image/filename'].bytes_list.value[0].decode('utf8')
+    results = []
+    for copy, copy_seed in enumerate(np.random.SeedSequence(seed).spawn(copies)):
+        augmented_image, augmented_boxes, keep = augment_image(image, boxes, transforms, np.random.default_rng(copy_seed))
+        output = io.BytesIO()
+        augmented_image.save(output, 'JPEG', quality = quality)
+        example = tf.train.Example()
+        example.CopyFrom(source)
+        augmented = example.features.feature
+        for key in augmented:
+            if (key.startswith('image/object/')):
+                values = getattr(augmented[key], augmented[key].WhichOneof('kind')).value
+                if (len(values) == len(keep)):
+                    _filter_repeated(values, keep)
+        for key, column in zip(('xmin', 'ymin', 'xmax', 'ymax'), augmented_boxes[keep].T.tolist()):
+            del augmented[f'image/object/bbox/{key}'].float_list.value[:]
+            augmented[f'image/object/bbox/{key}'].float_list.value.extend(column)
+        augmented['image/encoded'].bytes_list.value[0] = output.getvalue()
+        augmented['image/format'].bytes_list.value[:] = [b'jpg']
+        augmented['image/width'].int64_list.value[:] = [augmented_image.width]
+        augmented['image/height'].int64_list.value[:] = [augmented_image.height]
+        source_id = feature['image/source_id'].bytes_list.value[0]
+        augmented['image/source_id'].bytes_list.value[:] = [source_id + f'-aug{copy}'.encode('utf8')]
+        results.append((example.SerializeToString(deterministic = True), filename, int(keep.sum())))
+    return results
+
+def create_augmented_record(source_file, output_file, copies, transforms = augmentation_transforms, num_workers = 1, num_shards = 0, seed = 0, quality = 95):
+    """
+    Create a record of augmented copies of the examples of a TensorFlow record, read through its index.
+    The record is skipped if it's up to date with its sources and options
+    Keyword arguments:
+    source_file     -- the source record file path and name (without the shard suffix)
+    output_file     -- the output file path and name
+    copies          -- number of augmented copies of each example
+    transforms      -- the names of the transforms to apply
+    num_workers     -- number of processes augmenting the examples. If < 1 all the available CPUs are used
+    num_shards      -- number of shards of the output file. If < 1 it's chosen from the size of the output
+    seed            -- the seed of the random transforms
+    quality         -- the JPEG quality of the augmented images
+    """
+    from    tf_records import _ordered_map, get_auto_shards_count, get_tf_record_file_names, get_tf_record_files, remove_tf_record_files
+    unknown = set(transforms).difference(augmentation_transforms)
+    if (unknown):
+        raise Exception(f'Error!!! Unknown augmentation transforms {", ".join(sorted(unknown))}')
+    if (not TFRecordIndex.exists(source_file)):
+        raise Exception(f'Error!!! The record {source_file} has no index')
+    record_files = get_tf_record_files(source_file)
+    manifest_file = output_file + '.manifest.json'
+    previous = TFRecordManifest.load(manifest_file)
+    # The entries of the source files have the same format of the ones of the archives and bulk annotations files
+    manifest = TFRecordManifest()
+    manifest.options = { 'copies': copies, 'transforms': list(transforms), 'seed': seed, 'quality': quality, 'num_shards': num_shards }
+    for f in record_files:
+        manifest.entries.update(TFRecordManifest.scan_file(f, previous).entries)
+    if (previous and previous.options == manifest.options and previous.entries == manifest.entries and
+        len(get_tf_record_files(output_file)) == previous.num_shards and TFRecordIndex.exists(output_file)):
+        print(f'The augmented TFRecord file {str(Path(output_file).resolve())} is up to date')
+        return
+    if (num_workers < 1):
+        num_workers = os.cpu_count() or 1
+    if (num_shards < 1):
+        num_shards = get_auto_shards_count(sum(os.path.getsize(f) for f in record_files) * copies)
+    # The source examples are read by plain file reads, in the order of their position in the files
+    source_index = TFRecordIndex(source_file)
+    jobs = ((serialized, copies, tuple(transforms), [seed, i], quality) for i, serialized in enumerate(source_index.read(source_index.subset(1))))
+    executor = None
+    if (num_workers > 1):
+        import  multiprocessing
+        from    concurrent.futures import ProcessPoolExecutor
+        # The workers are spawned as new interpreters: this process already runs the TensorFlow runtime,
+        # which is not safe to fork, and the workers are started lazily by the first jobs in the write loop
+        executor = ProcessPoolExecutor(num_workers, mp_context = multiprocessing.get_context('spawn'))
+        augmented_examples = _ordered_map(executor, augment_example, jobs, num_workers * 4)
+    else:
+        augmented_examples = (augment_example(*job) for job in jobs)
+    import  tensorflow as tf
+    remove_tf_record_files(output_file)
+    output_files = get_tf_record_file_names(output_file, num_shards)
+    writers = [tf.io.TFRecordWriter(f) for f in output_files]
+    offsets = [0] * num_shards
+    index_entries = []
+    count = 0
+    size = 0
+    start_time = time.perf_counter()
+    try:
+        for results in augmented_examples:
+            for serialized, filename, box_count in results:
+                shard = count % num_shards
+                writers[shard].write(serialized)
+                index_entries.append((shard, offsets[shard], len(serialized), filename, box_count))
+                offsets[shard] += TFRecordIndex.get_record_size(serialized)
+                count += 1
+                size += len(serialized)
+    finally:
+        for writer in writers:
+            writer.close()
+        if (executor):
+            executor.shutdown()
+    elapsed = max(time.perf_counter() - start_time, 1e-6)
+    TFRecordIndex.save(output_file, num_shards, index_entries)
+    print(f'Created the augmented TFRecord file {str(Path(output_file).resolve())} with {count} examples '
+          f'({size / 1048576:.1f} MB) in {elapsed:.1f}s with {num_workers} worker(s): {count / elapsed:.1f} images/s')
+    manifest.num_shards = num_shards
+    manifest.save(manifest_file)
+
+if __name__ == '__main__':
+    prm = ('prm' in locals() and isinstance(prm, TrainParameters) and prm) or TrainParameters.default
+    output_file = os.path.join(prm.annotations_dir, 'train_augmented.record')
+    if (TFRecordIndex.exists(output_file)):
+        index = TFRecordIndex(output_file)
+        print(f'train_augmented.record: {len(index)} examples, {int(index.box_counts.sum())} boxes in {index.num_shards} shard(s)')
+    else:
+        print('train_augmented.record: not created')
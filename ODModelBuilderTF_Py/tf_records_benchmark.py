@@ -0,0 +1,195 @@
+from    absl import flags
+import  json
+import  os
+from    pathlib import Path
+import  sys
+import  tempfile
+import  time
+
+try:    from    utilities import *
+except: pass
+
+# Avoiding the absl error for duplicated flags if run again the cell from a notebook
+allow_flags_override();
+
+# Flags for arguments parameters
+flags.DEFINE_integer('benchmark_images', 1000, 'Number of images of the synthetic dataset.')
+flags.DEFINE_integer('benchmark_width', 1280, 'Width of the images of the synthetic dataset.')
+flags.DEFINE_integer('benchmark_height', 720, 'Height of the images of the synthetic dataset.')
+flags.DEFINE_integer('benchmark_boxes', 5, 'Number of boxes per image of the synthetic dataset.')
+flags.DEFINE_integer('benchmark_workers', 1, 'Number of processes encoding the '
+                     'TFRecord examples. If < 1 all the available CPUs are used.')
+flags.DEFINE_string ('benchmark_dir', None, 'Directory of the synthetic dataset. '
+                     'If it already contains a dataset it\'s reused. If not set a temporary one is used.')
+flags.DEFINE_string ('benchmark_output', None, 'Path of the JSON file where to save the results.')
+flags.DEFINE_string ('benchmark_baseline', None, 'Path of the JSON file of stored results '
+                     'to compare with for detecting regressions.')
+flags.DEFINE_float  ('benchmark_tolerance', 0.1, 'Relative tolerance of the comparison with the baseline.')
+
+def generate_voc_dataset(output_dir, num_images, width, height, boxes_per_image, seed = 0):
+    """
+    Generate a synthetic Pascal VOC dataset of JPEG images with their xml annotations
+    Keyword arguments:
+    output_dir      -- the output directory
+    num_images      -- number of images
+    width           -- width of the images
+    height          -- height of the images
+    boxes_per_image -- number of boxes of each image
+    seed            -- the seed of the random generator
+    """
+    import  numpy as np
+    from    PIL import Image, ImageDraw
+    import  xml.etree.ElementTree as ET
+    rng = np.random.default_rng(seed)
+    labels = ['label_a', 'label_b', 'label_c']
+    os.makedirs(output_dir, exist_ok = True)
+    for i in range(num_images):
+        filename = f'image{i:06d}.jpg'
+        # Low frequency noise, for having a realistic JPEG compression ratio
+        noise = rng.integers(0, 256, (max(height // 16, 1), max(width // 16, 1), 3), np.uint8)
+        image = Image.fromarray(noise).resize((width, height), Image.BILINEAR)
+        draw = ImageDraw.Draw(image)
+        root = ET.Element('annotation')
+        ET.SubElement(root, 'folder').text = Path(output_dir).name
+        ET.SubElement(root, 'filename').text = filename
+        size = ET.SubElement(root, 'size')
+        ET.SubElement(size, 'width').text = str(width)
+        ET.SubElement(size, 'height').text = str(height)
+        ET.SubElement(size, 'depth').text = '3'
+        for b in range(boxes_per_image):
+            x0, x1 = sorted(rng.integers(0, width, 2))
+            y0, y1 = sorted(rng.integers(0, height, 2))
+            x1, y1 = max(x1, x0 + 1), max(y1, y0 + 1)
+            draw.rectangle([x0, y0, x1, y1], outline = tuple(int(c) for c in rng.integers(0, 256, 3)), width = 3)
+            member = ET.SubElement(root, 'object')
+            ET.SubElement(member, 'name').text = labels[rng.integers(0, len(labels))]
+            ET.SubElement(member, 'pose').text = 'Unspecified'
+            ET.SubElement(member, 'truncated').text = '0'
+            ET.SubElement(member, 'difficult').text = '0'
+            bndbox = ET.SubElement(member, 'bndbox')
+            for tag, value in zip(('xmin', 'ymin', 'xmax', 'ymax'), (x0, y0, x1, y1)):
+                ET.SubElement(bndbox, tag).text = str(value)
+        image.save(os.path.join(output_dir, filename), 'JPEG', quality = 90)
+        ET.ElementTree(root).write(os.path.join(output_dir, f'image{i:06d}.xml'))
+    print(f'Generated {num_images} synthetic images in {str(Path(output_dir).resolve())}')
+
+def _phase_result(seconds, images, size):
+    """
+    Return the result of a benchmark phase
+    Keyword arguments:
+    seconds     -- elapsed time
+    images      -- number of processed images
+    size        -- number of processed bytes
+    """
+    # The peak RSS is cumulative for the process, so it's reported only for the whole benchmark
+    seconds = max(seconds, 1e-6)
+    return {
+        'seconds': seconds,
+        'images_per_second': images / seconds,
+        'mb_per_second': size / 1048576 / seconds }
+
+def benchmark_tf_records(image_dir, work_dir, num_workers = 1):
+    """
+    Time separately the phases of the creation of a TFRecord file from a dataset
+    Keyword arguments:
+    image_dir   -- the directory containing the images and their xml annotations
+    work_dir    -- the directory where to write the records
+    num_workers -- number of processes encoding the examples in the end to end phase
+    """
+    import  glob
+    import  tensorflow as tf
+    from    tf_records import TFRecord, group_annotations
+    phases = dict()
+    xml_size = sum(os.path.getsize(f) for f in glob.glob(os.path.join(glob.escape(image_dir), '*.xml')))
+    # Parse of the xml files
+    record = TFRecord()
+    start_time = time.perf_counter()
+    parsed = list(record.parse_annotations(image_dir))
+    phases['parse'] = _phase_result(time.perf_counter() - start_time, len(parsed), xml_size)
+    # Grouping of the annotations by image
+    start_time = time.perf_counter()
+    grouped = group_annotations(parsed)
+    phases['group'] = _phase_result(time.perf_counter() - start_time, len(grouped), xml_size)
+    # Creation of the examples
+    image_size = sum(os.path.getsize(os.path.join(image_dir, group.filename)) for group in grouped)
+    record.build_label_dict()
+    start_time = time.perf_counter()
+    serialized = [record.create_tf_example(group, image_dir).SerializeToString() for group in grouped]
+    phases['create_tf_example'] = _phase_result(time.perf_counter() - start_time, len(grouped), image_size)
+    # Write of the record
+    record_size = sum(len(s) for s in serialized)
+    start_time = time.perf_counter()
+    with tf.io.TFRecordWriter(os.path.join(work_dir, 'benchmark.record')) as writer:
+        for s in serialized:
+            writer.write(s)
+    phases['write'] = _phase_result(time.perf_counter() - start_time, len(serialized), record_size)
+    del serialized
+    # End to end creation of the record
+    start_time = time.perf_counter()
+    TFRecord().create_tf_record(image_dir, os.path.join(work_dir, 'end_to_end.record'), num_workers = num_workers, num_shards = 1)
+    phases['end_to_end'] = _phase_result(time.perf_counter() - start_time, len(grouped), image_size)
+    # End to end creation of the record in streaming mode
+    start_time = time.perf_counter()
+    TFRecord().create_tf_record(image_dir, os.path.join(work_dir, 'streaming.record'), num_workers = num_workers, num_shards = 1, streaming = True)
+    phases['end_to_end_streaming'] = _phase_result(time.perf_counter() - start_time, len(grouped), image_size)
+    return phases
+
+def compare_results(results, baseline, tolerance = 0.1):
+    """
+    Compare benchmark results with a baseline, returning the list of the regressions
+    Keyword arguments:
+    results     -- the benchmark results
+    baseline    -- the baseline results
+    tolerance   -- the relative tolerance
+    """
+    regressions = []
+    for name, phase in baseline['phases'].items():
+        current = results['phases'].get(name)
+        if (not current):
+            continue
+        if (current['images_per_second'] < phase['images_per_second'] * (1 - tolerance)):
+            regressions.append(f'{name}: {current["images_per_second"]:.1f} images/s vs {phase["images_per_second"]:.1f} of the baseline')
+    if (results['peak_rss_mb'] > baseline['peak_rss_mb'] * (1 + tolerance)):
+        regressions.append(f'peak RSS: {results["peak_rss_mb"]:.1f} MB vs {baseline["peak_rss_mb"]:.1f} MB of the baseline')
+    return regressions
+
+def benchmark_main(unused_argv):
+    """Main function for the benchmark of the TFRecord creation.
+    Args:
+        unused_argv:                /
+    """
+    FLAGS = flags.FLAGS
+    config = {
+        'images': FLAGS.benchmark_images,
+        'width': FLAGS.benchmark_width,
+        'height': FLAGS.benchmark_height,
+        'boxes': FLAGS.benchmark_boxes,
+        'workers': FLAGS.benchmark_workers }
+    with tempfile.TemporaryDirectory() as temp_dir:
+        image_dir = FLAGS.benchmark_dir or os.path.join(temp_dir, 'images')
+        if (not os.path.isdir(image_dir) or len(os.listdir(image_dir)) == 0):
+            generate_voc_dataset(image_dir, config['images'], config['width'], config['height'], config['boxes'])
+        phases = benchmark_tf_records(image_dir, temp_dir, config['workers'])
+    results = { 'config': config, 'phases': phases, 'peak_rss_mb': get_peak_rss() / 1048576 }
+    for name, phase in phases.items():
+        print(f'{name:20}{phase["seconds"]:10.2f}s{phase["images_per_second"]:12.1f} images/s{phase["mb_per_second"]:10.1f} MB/s')
+    print(f'Peak RSS: {results["peak_rss_mb"]:.1f} MB')
+    if (FLAGS.benchmark_output):
+        with open(FLAGS.benchmark_output, 'w') as f:
+            json.dump(results, f, indent = 2)
+        print(f'Results saved in {str(Path(FLAGS.benchmark_output).resolve())}')
+    if (FLAGS.benchmark_baseline):
+        with open(FLAGS.benchmark_baseline, 'r') as f:
+            baseline = json.load(f)
+        if (baseline['config'] != config):
+            print('Warning: the baseline was obtained with a different configuration')
+        regressions = compare_results(results, baseline, FLAGS.benchmark_tolerance)
+        for regression in regressions:
+            print(f'Regression: {regression}')
+        if (regressions):
+            sys.exit(1)
+        print('No regressions respect to the baseline')
+
+if __name__ == '__main__':
+    import tensorflow as tf
+    tf.compat.v1.app.run(benchmark_main)
@@ -0,0 +1,255 @@
+import  hashlib
+import  io
+import  os
+from    pathlib import Path
+
+try:    from    train_parameters import TrainParameters
+except: pass
+
+# Reference of the duplicated images already written in the record, whose boxes cannot be merged
+_written = -1
+
+def get_dhash(data):
+    """
+    Compute the 64 bits difference hash of an encoded image: the sign of the horizontal gradients of its 9x8 grayscale thumbnail
+    Keyword arguments:
+    data    -- the encoded image
+    """
+    import  numpy as np
+    from    PIL import Image
+    image = Image.open(io.BytesIO(data))
+    # Let the JPEG decoder skip the unneeded resolution
+    image.draft('L', (64, 64))
+    pixels = np.asarray(image.convert('L').resize((9, 8), Image.BILINEAR), np.int16)
+    return int.from_bytes(np.packbits(pixels[:, 1:] > pixels[:, :-1]).tobytes(), 'big')
+
+def merge_boxes(image, duplicate, iou_threshold = 0.9):
+    """
+    Return the annotations of an image with the boxes of its duplicate added, skipping the ones already present.
+    The boxes of the duplicate are scaled to the size of the image
+    Keyword arguments:
+    image           -- the annotations of the kept image
+    duplicate       -- the annotations of the duplicated image
+    iou_threshold   -- the minimum intersection over union of two boxes of the same class for considering them the same object
+    """
+    import numpy as np
+    boxes = duplicate.boxes
+    if (image.width > 0 and image.height > 0 and duplicate.width > 0 and duplicate.height > 0):
+        boxes = boxes * np.array([image.width / duplicate.width, image.height / duplicate.height] * 2, np.float32)
+    classes = list(image.classes)
+    merged = [image.boxes]
+    for label, box in zip(duplicate.classes, boxes):
+        same = [b for l, b in zip(classes, np.concatenate(merged)) if l == label]
+        if (len(same) > 0):
+            same = np.array(same)
+            tl = np.maximum(same[:, :2], box[:2])
+            br = np.minimum(same[:, 2:], box[2:])
+            intersection = np.prod(np.clip(br - tl, 0, None), axis = 1)
+            union = np.prod(same[:, 2:] - same[:, :2], axis = 1) + np.prod(box[2:] - box[:2]) - intersection
+            if (np.any(intersection / np.maximum(union, 1e-6) >= iou_threshold)):
+                continue
+        classes.append(label)
+        merged.append(box[None, :])
+    return image._replace(classes = classes, boxes = np.concatenate(merged).astype(np.float32))
+
+class TFRecordDedup:
+    """Deduplication of the images of a TensorFlow record by exact content hash and optional perceptual hash"""
+    def __init__(self, mode = 'exact', merge = False, threshold = 4):
+        """
+        Constructor
+        Keyword arguments:
+        mode        -- 'exact' for dropping the images with the same content or 'perceptual' for dropping also the near duplicated ones
+        merge       -- merge the boxes of the duplicates in the kept image instead of dropping them
+        threshold   -- the maximum hamming distance of the perceptual hashes of two near duplicated images
+        """
+        super().__init__()
+        if (mode not in ('exact', 'perceptual')):
+            raise Exception(f'Error!!! Unknown deduplication mode {mode}')
+        # The hash of 64 bits is split in threshold + 1 bands, each one of at least a bit
+        if (threshold < 0 or threshold >= 64):
+            raise Exception(f'Error!!! The deduplication threshold {threshold} is not in the range 0 to 63')
+        self.mode = mode
+        self.merge = merge
+        self.threshold = threshold
+        self.removed_exact = 0
+        self.removed_perceptual = 0
+        self.merged = 0
+        self._dhashes = dict()
+        self._exact = dict()
+        self._bands = [dict() for _ in range(self.threshold + 1)]
+    @staticmethod
+    def exists(output_file):
+        """
+        Check if a record has a hash index
+        Keyword arguments:
+        output_file -- the record file path and name
+        """
+        return os.path.exists(output_file + '.hashes.npz')
+    def load(self, output_file, append = False):
+        """
+        Load the hash index of a record. The perceptual hashes are reused as a cache
+        Keyword arguments:
+        output_file -- the record file path and name
+        append      -- the record is being appended, so the new images are checked against the ones already written
+        """
+        import numpy as np
+        with np.load(output_file + '.hashes.npz') as index:
+            for sha1, dhash, has_dhash, in_record in zip(index['sha1s'], index['dhashes'], index['has_dhashes'], index['in_record']):
+                sha1 = str(sha1)
+                dhash = int(dhash) if has_dhash else None
+                if (dhash is not None):
+                    self._dhashes[sha1] = dhash
+                if (append and in_record):
+                    self._add(sha1, dhash if self.mode == 'perceptual' else None, _written)
+    def save(self, output_file):
+        """
+        Save the hash index of a record
+        Keyword arguments:
+        output_file -- the record file path and name
+        """
+        import numpy as np
+        sha1s = sorted(set(self._dhashes).union(self._exact))
+        index_file = output_file + '.hashes.npz'
+        # Written in a temporary file and then renamed, so an interrupted write doesn't leave a corrupt index
+        with open(index_file + '.tmp', 'wb') as f:
+            np.savez(
+                f,
+                sha1s = np.array(sha1s, str),
+                dhashes = np.array([self._dhashes.get(sha1, 0) for sha1 in sha1s], np.uint64),
+                has_dhashes = np.array([sha1 in self._dhashes for sha1 in sha1s], bool),
+                in_record = np.array([sha1 in self._exact for sha1 in sha1s], bool))
+        os.replace(index_file + '.tmp', index_file)
+    def get_hashes(self, image, path, image_hashes = None):
+        """
+        Return the content hash and the perceptual hash (None in exact mode) of an image
+        Keyword arguments:
+        image           -- the annotations of the image
+        path            -- path of the images
+        image_hashes    -- the optional dictionary of the already known content hashes by image file name
+        """
+        data = image.encoded
+        if (data is not None):
+            sha1 = hashlib.sha1(data).hexdigest()
+        else:
+            sha1 = (image_hashes or {}).get(image.filename)
+            if (sha1 is None):
+                with open(os.path.join(path, image.filename), 'rb') as f:
+                    data = f.read()
+                sha1 = hashlib.sha1(data).hexdigest()
+        if (self.mode != 'perceptual'):
+            return sha1, None
+        dhash = self._dhashes.get(sha1)
+        if (dhash is None):
+            if (data is None):
+                with open(os.path.join(path, image.filename), 'rb') as f:
+                    data = f.read()
+            dhash = self._dhashes[sha1] = get_dhash(data)
+        return sha1, dhash
+    def _get_bands(self, dhash):
+        """
+        Split a perceptual hash in threshold + 1 bands. Two hashes within the threshold distance have at least a band in common
+        Keyword arguments:
+        dhash   -- the perceptual hash
+        """
+        width = 64 // len(self._bands)
+        bands = [(dhash >> (i * width)) & ((1 << width) - 1) for i in range(len(self._bands) - 1)]
+        bands.append(dhash >> ((len(self._bands) - 1) * width))
+        return bands
+    def _find(self, sha1, dhash):
+        """
+        Return the reference of the image duplicated by the hashes and True if it's an exact duplicate, or (None, False)
+        Keyword arguments:
+        sha1    -- the content hash
+        dhash   -- the perceptual hash or None
+        """
+        ref = self._exact.get(sha1)
+        if (ref is not None):
+            return ref, True
+        if (dhash is not None):
+            for band, table in zip(self._get_bands(dhash), self._bands):
+                for other, ref in table.get(band, ()):
+                    if (bin(other ^ dhash).count('1') <= self.threshold):
+                        return ref, False
+        return None, False
+    def _add(self, sha1, dhash, ref):
+        """
+        Add the hashes of a kept image
+        Keyword arguments:
+        sha1    -- the content hash
+        dhash   -- the perceptual hash or None
+        ref     -- the reference of the image
+        """
+        self._exact[sha1] = ref
+        if (dhash is not None):
+            for band, table in zip(self._get_bands(dhash), self._bands):
+                table.setdefault(band, []).append((dhash, ref))
+    def _count(self, exact):
+        """
+        Count a removed duplicate
+        Keyword arguments:
+        exact   -- True if it's an exact duplicate
+        """
+        if (exact):
+            self.removed_exact += 1
+        else:
+            self.removed_perceptual += 1
+    def deduplicate(self, images, path, image_hashes = None, num_workers = 8):
+        """
+        Return the list of the images without the duplicates, merging their boxes in the kept images if required
+        Keyword arguments:
+        images          -- the list of the annotations of the images
+        path            -- path of the images
+        image_hashes    -- the optional dictionary of the already known content hashes by image file name
+        num_workers     -- number of threads hashing the images
+        """
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(num_workers) as executor:
+            hashes = list(executor.map(lambda image: self.get_hashes(image, path, image_hashes), images))
+        kept = []
+        for image, (sha1, dhash) in zip(images, hashes):
+            ref, exact = self._find(sha1, dhash)
+            if (ref is None):
+                self._add(sha1, dhash, len(kept))
+                kept.append(image)
+                continue
+            self._count(exact)
+            if (self.merge and ref != _written):
+                kept[ref] = merge_boxes(kept[ref], image)
+                self.merged += 1
+        return kept
+    def filter(self, images, path, image_hashes = None):
+        """
+        Generator of the images without the duplicates, for the streaming of the annotations. The duplicates are dropped
+        Keyword arguments:
+        images          -- the iterable of the annotations of the images
+        path            -- path of the images
+        image_hashes    -- the optional dictionary of the already known content hashes by image file name
+        """
+        if (self.merge):
+            print('Warning: the boxes of the duplicated images cannot be merged in streaming mode. The duplicates are dropped')
+        for image in images:
+            sha1, dhash = self.get_hashes(image, path, image_hashes)
+            ref, exact = self._find(sha1, dhash)
+            if (ref is None):
+                self._add(sha1, dhash, len(self._exact))
+                yield image
+            else:
+                self._count(exact)
+    def report(self):
+        """
+        Print the result of the deduplication
+        """
+        print(f'Removed {self.removed_exact + self.removed_perceptual} duplicated images '
+              f'({self.removed_exact} exact, {self.removed_perceptual} perceptual)' +
+              (f', merging the boxes of {self.merged}' if self.merged else ''))
+
+if __name__ == '__main__':
+    import numpy as np
+    prm = ('prm' in locals() and isinstance(prm, TrainParameters) and prm) or TrainParameters.default
+    for name in ['train.record', 'eval.record']:
+        output_file = os.path.join(prm.annotations_dir, name)
+        if (TFRecordDedup.exists(output_file)):
+            with np.load(output_file + '.hashes.npz') as index:
+                print(f'{name}: {int(index["in_record"].sum())} unique images, {int(index["has_dhashes"].sum())} perceptual hashes')
+        else:
+            print(f'{name}: no hash index')
@@ -0,0 +1,177 @@
+import  os
+from    pathlib import Path
+
+try:    from    train_parameters import TrainParameters
+except: pass
+
+# Size of the framing of each record in a TFRecord file: length (8), length crc (4) and data crc (4)
+_record_overhead = 16
+# Offset of the data of a record from its start
+_record_data_offset = 12
+
+class TFRecordIndex:
+    """Random access index of the examples of a TensorFlow record"""
+    def __init__(self, output_file = None):
+        """
+        Constructor
+        Keyword arguments:
+        output_file -- the optional record file path and name (without the shard suffix) of which loading the index
+        """
+        import numpy as np
+        super().__init__()
+        self.output_file = output_file
+        self.num_shards = 1
+        self.shards = np.zeros((0,), np.int32)
+        self.offsets = np.zeros((0,), np.int64)
+        self.lengths = np.zeros((0,), np.int64)
+        self.box_counts = np.zeros((0,), np.int32)
+        self.filenames = np.zeros((0,), str)
+        self._filename_dict = None
+        if (output_file):
+            with np.load(output_file + '.index.npz') as index:
+                self.num_shards = int(index['num_shards'])
+                self.shards = index['shards']
+                self.offsets = index['offsets']
+                self.lengths = index['lengths']
+                self.box_counts = index['box_counts']
+                self.filenames = index['filenames']
+    def __len__(self):
+        return len(self.offsets)
+    @staticmethod
+    def exists(output_file):
+        """
+        Check if a record has an index
+        Keyword arguments:
+        output_file -- the record file path and name
+        """
+        return os.path.exists(output_file + '.index.npz')
+    @staticmethod
+    def get_record_size(serialized):
+        """
+        Return the size occupied in a TFRecord file by a serialized example
+        Keyword arguments:
+        serialized  -- the serialized example
+        """
+        return len(serialized) + _record_overhead
+    @staticmethod
+    def save(output_file, num_shards, entries, append = False):
+        """
+        Save the index of a record
+        Keyword arguments:
+        output_file -- the record file path and name
+        num_shards  -- the total number of shards of the record
+        entries     -- list of tuples (shard, offset, length, filename, box count) of the examples
+        append      -- append the entries to the existing index
+        """
+        import numpy as np
+        index = TFRecordIndex(output_file) if append else TFRecordIndex()
+        shards, offsets, lengths, filenames, box_counts = zip(*entries) if entries else ([], [], [], [], [])
+        index_file = output_file + '.index.npz'
+        # Written in a temporary file and then renamed, so an interrupted write doesn't leave a corrupt index
+        with open(index_file + '.tmp', 'wb') as f:
+            np.savez(
+                f,
+                num_shards = num_shards,
+                shards = np.concatenate([index.shards, np.array(shards, np.int32)]),
+                offsets = np.concatenate([index.offsets, np.array(offsets, np.int64)]),
+                lengths = np.concatenate([index.lengths, np.array(lengths, np.int64)]),
+                box_counts = np.concatenate([index.box_counts, np.array(box_counts, np.int32)]),
+                filenames = np.concatenate([index.filenames, np.array(filenames, str)]))
+        os.replace(index_file + '.tmp', index_file)
+    @property
+    def files(self):
+        """ The record files referenced by the index """
+        from tf_records import get_tf_record_file_names
+        return get_tf_record_file_names(self.output_file, self.num_shards)
+    def find(self, filename):
+        """
+        Return the index of the example of an image, or -1 if not found
+        Keyword arguments:
+        filename    -- the image file name
+        """
+        if (self._filename_dict is None):
+            self._filename_dict = { str(f): i for i, f in enumerate(self.filenames) }
+        return self._filename_dict.get(filename, -1)
+    def read(self, indices):
+        """
+        Generator of the serialized examples at the indices, in the same order.
+        The files are kept open across consecutive examples of the same shard
+        Keyword arguments:
+        indices     -- the indices of the examples
+        """
+        files = self.files
+        shard = -1
+        f = None
+        try:
+            for i in indices:
+                if (self.shards[i] != shard):
+                    if (f):
+                        f.close()
+                    shard = self.shards[i]
+                    f = open(files[shard], 'rb')
+                f.seek(int(self.offsets[i]) + _record_data_offset)
+                yield f.read(int(self.lengths[i]))
+        finally:
+            if (f):
+                f.close()
+    def __getitem__(self, i):
+        """
+        Return the serialized example at an index
+        Keyword arguments:
+        i   -- the index of the example
+        """
+        return next(self.read([i]))
+    def example(self, i):
+        """
+        Return the parsed example at an index
+        Keyword arguments:
+        i   -- the index of the example
+        """
+        import tensorflow as tf
+        return tf.train.Example.FromString(self[i])
+    def subset(self, sample_1_of_n):
+        """
+        Return the indices of a deterministic subset of 1 example every sample_1_of_n, sorted by file position
+        Keyword arguments:
+        sample_1_of_n   -- the sampling interval
+        """
+        return self._sorted_by_position(range(0, len(self), max(sample_1_of_n, 1)))
+    def shard(self, index, count):
+        """
+        Return the indices of the examples of a worker when they are split among count workers, sorted by file position
+        Keyword arguments:
+        index   -- the index of the worker
+        count   -- the number of workers
+        """
+        return self._sorted_by_position(range(index, len(self), count))
+    def _sorted_by_position(self, indices):
+        """
+        Sort indices by shard and offset for a sequential read of the files
+        Keyword arguments:
+        indices     -- the indices to sort
+        """
+        return sorted(indices, key = lambda i: (self.shards[i], self.offsets[i]))
+    def write(self, indices, output_file):
+        """
+        Write the examples at the indices in a new record file
+        Keyword arguments:
+        indices     -- the indices of the examples
+        output_file -- the output file path and name
+        """
+        import tensorflow as tf
+        count = 0
+        with tf.io.TFRecordWriter(output_file) as writer:
+            for serialized in self.read(indices):
+                writer.write(serialized)
+                count += 1
+        print(f'Created the TFRecord file {str(Path(output_file).resolve())} with {count} examples')
+
+if __name__ == '__main__':
+    prm = ('prm' in locals() and isinstance(prm, TrainParameters) and prm) or TrainParameters.default
+    for name in ['train.record', 'eval.record']:
+        output_file = os.path.join(prm.annotations_dir, name)
+        if (TFRecordIndex.exists(output_file)):
+            index = TFRecordIndex(output_file)
+            print(f'{name}: {len(index)} examples, {int(index.box_counts.sum())} boxes in {index.num_shards} shard(s)')
+        else:
+            print(f'{name}: no index')
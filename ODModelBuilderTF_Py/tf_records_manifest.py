@@ -0,0 +1,165 @@
+import  glob
+import  hashlib
+import  json
+import  os
+from    pathlib import Path
+
+class TFRecordManifest:
+    """Manifest of the annotations and images sources of a TensorFlow record"""
+    version = 1
+    def __init__(self):
+        """ Constructor """
+        super().__init__()
+        self.entries = dict()
+        self.labels = []
+        self.options = dict()
+        self.num_shards = 0
+    @staticmethod
+    def get_file_hash(file_path):
+        """
+        Compute the hash of the content of a file
+        Keyword arguments:
+        file_path   -- the file to hash
+        """
+        hash = hashlib.sha1()
+        with open(file_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                hash.update(chunk)
+        return hash.hexdigest()
+    @staticmethod
+    def get_file_info(file_path, previous = None):
+        """
+        Return the size, the modification time and the content hash of a file.
+        The hash of the previous info is reused if the size and the modification time are unchanged
+        Keyword arguments:
+        file_path   -- the file
+        previous    -- the optional previous info of the file
+        """
+        stat = os.stat(file_path)
+        if (previous and previous[0] == stat.st_size and previous[1] == stat.st_mtime_ns):
+            return previous
+        return [stat.st_size, stat.st_mtime_ns, TFRecordManifest.get_file_hash(file_path)]
+    @staticmethod
+    def get_image_name(xml_file):
+        """
+        Read the name of the image file referenced by an annotation file
+        Keyword arguments:
+        xml_file    -- the annotation file
+        """
+        import xml.etree.ElementTree as ET
+        for event, element in ET.iterparse(xml_file):
+            if (element.tag == 'filename'):
+                return element.text
+        return None
+    @staticmethod
+    def load(file):
+        """
+        Load a manifest file. Return None if it doesn't exist or it's not valid
+        Keyword arguments:
+        file    -- the manifest file
+        """
+        try:
+            with open(file, 'r') as f:
+                content = json.load(f)
+            if (content['version'] != TFRecordManifest.version):
+                return None
+            manifest = TFRecordManifest()
+            manifest.entries = content['entries']
+            manifest.labels = content['labels']
+            manifest.options = content['options']
+            manifest.num_shards = content['num_shards']
+            return manifest
+        except:
+            return None
+    def save(self, file):
+        """
+        Save the manifest
+        Keyword arguments:
+        file    -- the manifest file
+        """
+        content = {
+            'version': TFRecordManifest.version,
+            'labels': self.labels,
+            'options': self.options,
+            'num_shards': self.num_shards,
+            'entries': self.entries }
+        with open(file + '.tmp', 'w') as f:
+            json.dump(content, f)
+        os.replace(file + '.tmp', file)
+        print(f'Created the manifest file {str(Path(file).resolve())}')
+    @staticmethod
+    def scan(image_dir, previous = None, options = None, num_workers = 8):
+        """
+        Build the manifest of the annotations and images contained in a directory
+        Keyword arguments:
+        image_dir   -- the directory containing the images and their annotations
+        previous    -- the optional previous manifest, used to skip the hashing of the unchanged files
+        options     -- the options of the record creation
+        num_workers -- number of threads reading the files
+        """
+        from concurrent.futures import ThreadPoolExecutor
+        previous_entries = previous.entries if previous else dict()
+        def scan_entry(xml_file):
+            key = os.path.relpath(xml_file, image_dir)
+            previous_entry = previous_entries.get(key)
+            try:
+                xml_info = TFRecordManifest.get_file_info(xml_file, previous_entry and previous_entry['xml'])
+                if (previous_entry and xml_info == previous_entry['xml']):
+                    image = previous_entry['image']
+                else:
+                    image = TFRecordManifest.get_image_name(xml_file)
+                    previous_entry = None
+                if (not image):
+                    raise Exception('the annotation has no image file name')
+                image_info = TFRecordManifest.get_file_info(os.path.join(image_dir, image), previous_entry and previous_entry['image_info'])
+            except Exception as exc:
+                # The annotations with an invalid xml or a missing image are skipped, without failing the whole record
+                print(f'Warning: skipping the annotation file {key}: {exc}')
+                return key, None
+            return key, { 'xml': xml_info, 'image': image, 'image_info': image_info }
+        manifest = TFRecordManifest()
+        manifest.options = dict(options or {})
+        xml_files = sorted(glob.glob(os.path.join(glob.escape(image_dir), '*.xml')))
+        with ThreadPoolExecutor(num_workers) as executor:
+            manifest.entries = { key: entry for key, entry in executor.map(scan_entry, xml_files) if entry }
+        return manifest
+    @staticmethod
+    def scan_file(file, previous = None, options = None):
+        """
+        Build the manifest of a single source file, as an archive of the images or a bulk annotations file
+        Keyword arguments:
+        file        -- the source file
+        previous    -- the optional previous manifest, used to skip the hashing of the unchanged file
+        options     -- the options of the record creation
+        """
+        key = Path(file).name
+        previous_entry = previous.entries.get(key) if previous else None
+        manifest = TFRecordManifest()
+        manifest.options = dict(options or {})
+        manifest.entries = { key: { 'file': TFRecordManifest.get_file_info(file, previous_entry and previous_entry.get('file')) } }
+        return manifest
+    def get_added(self, previous):
+        """
+        Return the keys of the entries added respect to a previous manifest,
+        or None if any of the previous entries was changed or removed
+        Keyword arguments:
+        previous    -- the previous manifest
+        """
+        def content(entry):
+            return entry['xml'][0], entry['xml'][2], entry['image'], entry['image_info'][0], entry['image_info'][2]
+        for key, entry in previous.entries.items():
+            current = self.entries.get(key)
+            if (not current or content(current) != content(entry)):
+                return None
+        return [key for key in self.entries if key not in previous.entries]
+
+if __name__ == '__main__':
+    try:    from    train_parameters import TrainParameters
+    except: pass
+    prm = ('prm' in locals() and isinstance(prm, TrainParameters) and prm) or TrainParameters.default
+    for name in ['train.record', 'eval.record']:
+        manifest = TFRecordManifest.load(os.path.join(prm.annotations_dir, name + '.manifest.json'))
+        if (manifest):
+            print(f'{name}: {len(manifest.entries)} images, {len(manifest.labels)} labels, {manifest.num_shards} shard(s)')
+        else:
+            print(f'{name}: no manifest')
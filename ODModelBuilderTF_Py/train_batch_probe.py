@@ -0,0 +1,144 @@
+import  json
+import  os
+import  subprocess
+import  sys
+import  time
+
+try:    from    train_parameters import TrainParameters
+except: pass
+try:    from    utilities import get_peak_rss
+except: pass
+
+# Prefix of the output line of a probe process containing its results
+_result_prefix = 'Batch probe result: '
+# Fraction of the physical memory used as budget when it's not specified
+_default_memory_fraction = 0.8
+
+def probe_batch_size(pipeline_config_path, batch_size, steps = 5, warmup_steps = 2, xla = False):
+    """
+    Run timed train steps of the model of a pipeline with a batch size. Return the dictionary of the examples per second,
+    of the peak resident set size of the process and, if there is a GPU, of the peak and the limit of its memory
+    Keyword arguments:
+    pipeline_config_path    -- the pipeline configuration file
+    batch_size              -- the batch size to probe
+    steps                   -- number of timed steps
+    warmup_steps            -- number of steps executed before the timing, for the tracing of the graph
+    xla                     -- compile the train step with XLA
+    """
+    import  inspect
+    import  tensorflow as tf
+    from    object_detection import inputs, model_lib_v2
+    from    object_detection.builders import model_builder, optimizer_builder
+    from    object_detection.utils import config_util
+    configs = config_util.get_configs_from_pipeline_file(pipeline_config_path)
+    model_config = configs['model']
+    train_config = configs['train_config']
+    train_config.batch_size = batch_size
+    # Same precision and compilation of the train
+    if (train_config.use_bfloat16):
+        tf.keras.mixed_precision.set_global_policy('mixed_bfloat16')
+    if (xla):
+        from train_pipeline import install_xla_train_step
+        install_xla_train_step()
+    detection_model = model_builder.build(model_config = model_config, is_training = True)
+    dataset = inputs.train_input(
+        train_config = train_config,
+        train_input_config = configs['train_input_config'],
+        model_config = model_config,
+        model = detection_model)
+    global_step = tf.Variable(0, trainable = False, dtype = tf.int64)
+    optimizer, _ = optimizer_builder.build(train_config.optimizer, global_step = global_step)
+    step_args = { 'add_regularization_loss': train_config.add_regularization_loss }
+    if ('training_step' in inspect.signature(model_lib_v2.eager_train_step).parameters):
+        step_args['training_step'] = global_step
+    @tf.function
+    def train_step(features, labels):
+        return model_lib_v2.eager_train_step(
+            detection_model, features, labels, train_config.unpad_groundtruth_tensors, optimizer, **step_args)
+    iterator = iter(dataset)
+    for _ in range(warmup_steps):
+        train_step(*next(iterator)).numpy()
+    start_time = time.perf_counter()
+    for _ in range(steps):
+        train_step(*next(iterator)).numpy()
+    elapsed = max(time.perf_counter() - start_time, 1e-6)
+    result = { 'batch_size': batch_size, 'examples_per_second': batch_size * steps / elapsed, 'peak_rss_mb': get_peak_rss() / 1048576 }
+    # On GPU the limit is the device memory available to the TensorFlow allocator
+    if (tf.config.list_physical_devices('GPU')):
+        from tensorflow.python.client import device_lib
+        result['peak_gpu_mb'] = tf.config.experimental.get_memory_info('GPU:0')['peak'] / 1048576
+        limits = [device.memory_limit for device in device_lib.list_local_devices() if device.device_type == 'GPU']
+        if (limits):
+            result['gpu_memory_mb'] = limits[0] / 1048576
+    return result
+
+def run_probe_process(pipeline_config_path, batch_size, steps = 5, xla = False):
+    """
+    Probe a batch size in a separate process, so an out of memory doesn't affect the caller.
+    Return the dictionary of the results or None if the probe failed
+    Keyword arguments:
+    pipeline_config_path    -- the pipeline configuration file
+    batch_size              -- the batch size to probe
+    steps                   -- number of timed steps
+    xla                     -- compile the train step with XLA
+    """
+    cmd = [sys.executable, os.path.abspath(__file__), pipeline_config_path, str(batch_size), str(steps), str(int(xla))]
+    env = { **os.environ, 'PATH': os.pathsep.join(sys.path) + os.pathsep + os.environ['PATH'] }
+    creationflags = subprocess.CREATE_NO_WINDOW if 'CREATE_NO_WINDOW' in dir(subprocess) else 0
+    try:
+        result = subprocess.run(cmd, env = env, cwd = os.getcwd(), stdout = subprocess.PIPE, stderr = subprocess.PIPE, universal_newlines = True, creationflags = creationflags)
+    except Exception as exc:
+        print(f'Warning: cannot start the batch probe process. Exception {exc}')
+        return None
+    for line in result.stdout.splitlines():
+        if (line.startswith(_result_prefix)):
+            return json.loads(line[len(_result_prefix):])
+    print(f'Warning: the probe of the batch size {batch_size} failed with the error code {result.returncode}')
+    return None
+
+def find_batch_size(prm: TrainParameters):
+    """
+    Probe increasing batch sizes on the model to train, returning the one with the best throughput
+    within the memory budget of the host and of the GPU, or None if no batch size could be probed
+    Keyword arguments:
+    prm     -- Parameters
+    """
+    import psutil
+    budget = prm.probe_memory_budget * 1048576 if prm.probe_memory_budget > 0 else psutil.virtual_memory().total * _default_memory_fraction
+    print(f'Probing the batch sizes up to {prm.probe_max_batch_size} within {budget / 1048576:.0f} MB of memory')
+    results = []
+    batch_size = 1
+    while (batch_size <= prm.probe_max_batch_size):
+        result = run_probe_process(prm.pipeline_config_path, batch_size, prm.probe_steps, prm.xla)
+        if (not result):
+            break
+        result['fits'] = result['peak_rss_mb'] * 1048576 <= budget
+        message = f'Batch size {batch_size}: {result["examples_per_second"]:.2f} examples/s, peak RSS {result["peak_rss_mb"]:.0f} MB'
+        if ('peak_gpu_mb' in result):
+            gpu_budget = prm.probe_memory_budget if prm.probe_memory_budget > 0 else result.get('gpu_memory_mb', float('inf')) * _default_memory_fraction
+            result['fits'] = result['fits'] and result['peak_gpu_mb'] <= gpu_budget
+            message += f', peak GPU memory {result["peak_gpu_mb"]:.0f} MB of {gpu_budget:.0f} MB'
+        results.append(result)
+        print(message)
+        if (not result['fits']):
+            break
+        batch_size *= 2
+    if (prm.model_dir):
+        with open(os.path.join(prm.model_dir, 'batch_probe.json'), 'w') as f:
+            json.dump(results, f, indent = 2)
+    fitting = [result for result in results if result['fits']]
+    if (not fitting):
+        print('Warning: no batch size could be probed within the memory budget')
+        return None
+    best = max(fitting, key = lambda result: (result['examples_per_second'], result['batch_size']))
+    print(f'The best batch size is {best["batch_size"]} with {best["examples_per_second"]:.2f} examples/s')
+    return best['batch_size']
+
+if __name__ == '__main__':
+    if (len(sys.argv) > 1):
+        # Single probe executed by run_probe_process
+        result = probe_batch_size(sys.argv[1], int(sys.argv[2]), int(sys.argv[3]), xla = len(sys.argv) > 4 and bool(int(sys.argv[4])))
+        print(_result_prefix + json.dumps(result))
+    else:
+        prm = ('prm' in locals() and isinstance(prm, TrainParameters) and prm) or TrainParameters.default
+        find_batch_size(prm)
@@ -0,0 +1,329 @@
+import  json
+import  os
+import  time
+
+try:    from    train_parameters import TrainParameters
+except: pass
+
+# Name of the file of the evaluation metrics of the checkpoints in the model directory
+checkpoint_metrics_file_name = 'checkpoint_metrics.jsonl'
+
+def read_checkpoint_metrics(model_dir):
+    """
+    Return the dictionary of the evaluation metrics by checkpoint name, the latest evaluation winning
+    Keyword arguments:
+    model_dir   -- the directory of the checkpoints
+    """
+    metrics = dict()
+    metrics_file = os.path.join(model_dir, checkpoint_metrics_file_name)
+    if (os.path.exists(metrics_file)):
+        with open(metrics_file, 'r') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                    metrics[os.path.basename(record['checkpoint'])] = record['metrics']
+                except: pass
+    return metrics
+
+def write_checkpoint_metrics(model_dir, checkpoint, metrics):
+    """
+    Append the evaluation metrics of a checkpoint to the metrics file of the model directory
+    Keyword arguments:
+    model_dir   -- the directory of the checkpoints
+    checkpoint  -- the evaluated checkpoint
+    metrics     -- the dictionary of the metrics
+    """
+    with open(os.path.join(model_dir, checkpoint_metrics_file_name), 'a') as f:
+        f.write(json.dumps({ 'checkpoint': os.path.basename(checkpoint), 'time': time.time(), 'metrics': { k: float(v) for k, v in metrics.items() } }) + '\n')
+
+def is_higher_better(metric):
+    """
+    Return True if the higher values of a metric are the better ones, False for the losses
+    Keyword arguments:
+    metric  -- the name of the metric
+    """
+    return 'loss' not in metric.lower()
+
+def get_best_checkpoint(checkpoints, metrics, metric):
+    """
+    Return the checkpoint with the best value of a metric or None if none is evaluated
+    Keyword arguments:
+    checkpoints -- the checkpoints paths
+    metrics     -- the dictionary of the evaluation metrics by checkpoint name
+    metric      -- the name of the metric
+    """
+    evaluated = [c for c in checkpoints if metric in metrics.get(os.path.basename(c), {})]
+    if (not evaluated):
+        return None
+    sign = 1 if is_higher_better(metric) else -1
+    return max(evaluated, key = lambda c: sign * metrics[os.path.basename(c)][metric])
+
+class CheckpointMetricsLogger:
+    """Evaluation callback logging the metrics of the evaluated checkpoints in the metrics file of the model directory"""
+    def __init__(self, checkpoint_dir, eval_callback = None):
+        """
+        Constructor
+        Keyword arguments:
+        checkpoint_dir  -- the directory of the evaluated checkpoints
+        eval_callback   -- the optional evaluation callback receiving the evaluation events
+        """
+        super().__init__()
+        self.checkpoint_dir = checkpoint_dir
+        self.eval_callback = eval_callback
+        self.checkpoint = None
+    def install(self):
+        """
+        Follow the checkpoints yielded to the evaluation loop of the object detection API,
+        so the metrics of each evaluation are logged for the checkpoint actually evaluated
+        """
+        import tensorflow as tf
+        logger = self
+        original_function = getattr(tf.train.checkpoints_iterator, 'original_function', tf.train.checkpoints_iterator)
+        def checkpoints_iterator(*args, **kwargs):
+            for checkpoint in original_function(*args, **kwargs):
+                logger.checkpoint = checkpoint
+                yield checkpoint
+        checkpoints_iterator.original_function = original_function
+        tf.train.checkpoints_iterator = checkpoints_iterator
+        tf.compat.v2.train.checkpoints_iterator = checkpoints_iterator
+    def uninstall(self):
+        """
+        Restore the original checkpoints iterator
+        """
+        import tensorflow as tf
+        original_function = getattr(tf.train.checkpoints_iterator, 'original_function', tf.train.checkpoints_iterator)
+        tf.train.checkpoints_iterator = original_function
+        tf.compat.v2.train.checkpoints_iterator = original_function
+    def __call__(self, args):
+        """
+        Evaluation callback
+        Keyword arguments:
+        args    -- the evaluation event
+        """
+        try:
+            checkpoint = getattr(args, 'checkpoint', None) or getattr(args, 'latest_checkpoint', None) or self.checkpoint
+            if (checkpoint):
+                write_checkpoint_metrics(self.checkpoint_dir, checkpoint, dict(args.metrics))
+            else:
+                print('Warning: cannot log the checkpoint metrics. The evaluated checkpoint is unknown')
+        except Exception as exc:
+            print(f'Warning: cannot log the checkpoint metrics. Exception {exc}')
+        if (self.eval_callback):
+            self.eval_callback(args)
+
+class _SnapshotCheckpoint:
+    """Checkpoint writing the variables in a host memory snapshot, persisted in the checkpoint directory by the writer"""
+    def __init__(self, checkpoint, writer):
+        """
+        Constructor
+        Keyword arguments:
+        checkpoint  -- the checkpoint to write
+        writer      -- the checkpoint writer
+        """
+        super().__init__()
+        self.checkpoint = checkpoint
+        self.writer = writer
+    def __getattr__(self, name):
+        return getattr(self.checkpoint, name)
+    def write(self, file_prefix, options = None):
+        return self.writer.write(self.checkpoint, file_prefix, options)
+    def _write(self, file_prefix, options = None, *args, **kwargs):
+        # Entry point of the checkpoint managers of TensorFlow >= 2.9, recording the checkpoint by the callbacks of the options
+        return self.writer.write(self.checkpoint, file_prefix, options)
+
+class CheckpointWriter:
+    """Replacement of the checkpoint manager of the object detection API with the asynchronous write and the retention of the checkpoints"""
+    def __init__(self, async_write = False, keep_last = 0, best_metric = None):
+        """
+        Constructor
+        Keyword arguments:
+        async_write     -- snapshot the variables in host memory and write the checkpoints in background
+        keep_last       -- number of latest checkpoints kept. If < 1 the object detection API's retention is used
+        best_metric     -- the evaluation metric selecting the best checkpoint, kept in addition to the latest ones
+        """
+        super().__init__()
+        self.async_write = async_write
+        self.keep_last = keep_last
+        self.best_metric = best_metric
+        self.managers = []
+        self._executor = None
+        self._pending = []
+        self._snapshot_count = 0
+    def install(self):
+        """
+        Make the object detection API create its checkpoint managers from this writer
+        """
+        import tensorflow as tf
+        writer = self
+        original_manager = getattr(tf.compat.v2.train.CheckpointManager, 'original_manager', tf.compat.v2.train.CheckpointManager)
+        if (self.async_write):
+            from concurrent.futures import ThreadPoolExecutor
+            # A single thread, so the checkpoints are persisted and the retention applied in the order of the saves
+            self._executor = ThreadPoolExecutor(1)
+        class Manager(original_manager):
+            def __init__(self, checkpoint, directory, max_to_keep, *args, **kwargs):
+                if (writer.async_write):
+                    checkpoint = _SnapshotCheckpoint(checkpoint, writer)
+                super().__init__(checkpoint, directory, None if writer.keep_last > 0 else max_to_keep, *args, **kwargs)
+                writer.managers.append(self)
+            def save(self, *args, **kwargs):
+                # Only one snapshot at a time is kept in memory
+                writer.sync()
+                path = super().save(*args, **kwargs)
+                if (path and writer.keep_last > 0):
+                    writer.submit(writer.apply_retention, self)
+                return path
+        Manager.original_manager = original_manager
+        tf.train.CheckpointManager = Manager
+        tf.compat.v2.train.CheckpointManager = Manager
+        tf.compat.v1.train.CheckpointManager = Manager
+    def uninstall(self):
+        """
+        Restore the original checkpoint manager, waiting the pending writes
+        """
+        import tensorflow as tf
+        try:
+            self.sync()
+        finally:
+            if (self._executor):
+                self._executor.shutdown()
+                self._executor = None
+            original_manager = getattr(tf.compat.v2.train.CheckpointManager, 'original_manager', tf.compat.v2.train.CheckpointManager)
+            tf.train.CheckpointManager = original_manager
+            tf.compat.v2.train.CheckpointManager = original_manager
+            tf.compat.v1.train.CheckpointManager = original_manager
+    def submit(self, fn, *args):
+        """
+        Execute a function after the pending writes, in background if the writes are asynchronous
+        Keyword arguments:
+        fn      -- the function
+        args    -- the arguments of the function
+        """
+        if (self._executor):
+            self._pending.append(self._executor.submit(fn, *args))
+        else:
+            fn(*args)
+    def sync(self):
+        """
+        Wait the end of the pending asynchronous writes, raising their errors
+        """
+        pending, self._pending = self._pending, []
+        for future in pending:
+            future.result()
+    def write(self, checkpoint, file_prefix, options = None):
+        """
+        Write a checkpoint. In the asynchronous mode the variables are written in a snapshot in host memory
+        and the checkpoint is persisted in background. The write callbacks of the options are called
+        when the checkpoint is complete. Return the path of the checkpoint
+        Keyword arguments:
+        checkpoint  -- the checkpoint
+        file_prefix -- the prefix of the checkpoint files
+        options     -- the optional checkpoint options
+        """
+        import copy
+        file_prefix = os.fspath(file_prefix)
+        callbacks = getattr(options, 'experimental_write_callbacks', None)
+        if (callbacks):
+            options = copy.copy(options)
+            options.experimental_write_callbacks = None
+        if (self.async_write):
+            self._snapshot_count += 1
+            snapshot_prefix = f'ram://checkpoint_snapshots/{self._snapshot_count}/{os.path.basename(file_prefix)}'
+            try:
+                checkpoint.write(snapshot_prefix, options = options)
+                self.submit(self._persist, snapshot_prefix, file_prefix, callbacks)
+                return file_prefix
+            except Exception as exc:
+                print(f'Warning: the snapshots of the checkpoints in host memory are not supported. Writing synchronously. Exception {exc}')
+                self.async_write = False
+        path = checkpoint.write(file_prefix, options = options)
+        self._run_callbacks(callbacks, path)
+        return path
+    def _persist(self, snapshot_prefix, file_prefix, callbacks):
+        """
+        Copy the files of a snapshot in the checkpoint directory and delete them.
+        The index is copied last, so the readers never see a checkpoint before it's complete
+        Keyword arguments:
+        snapshot_prefix -- the prefix of the files of the snapshot
+        file_prefix     -- the prefix of the checkpoint files
+        callbacks       -- the write callbacks to call at the end
+        """
+        import tensorflow as tf
+        tf.io.gfile.makedirs(os.path.dirname(file_prefix))
+        files = sorted(tf.io.gfile.glob(snapshot_prefix + '.*'), key = lambda f: f.endswith('.index'))
+        for f in files:
+            target = file_prefix + f[len(snapshot_prefix):]
+            tf.io.gfile.copy(f, target + '.tmp', overwrite = True)
+            tf.io.gfile.rename(target + '.tmp', target, overwrite = True)
+        for f in files:
+            tf.io.gfile.remove(f)
+        self._run_callbacks(callbacks, file_prefix)
+    @staticmethod
+    def _run_callbacks(callbacks, path):
+        """
+        Call the write callbacks of the checkpoint options
+        Keyword arguments:
+        callbacks   -- the callbacks
+        path        -- the path of the written checkpoint
+        """
+        import inspect
+        for callback in callbacks or []:
+            if (len(inspect.signature(callback).parameters) > 0):
+                callback(path)
+            else:
+                callback()
+    def apply_retention(self, manager):
+        """
+        Delete the checkpoints of a manager other than the latest ones and the best one.
+        All the saved checkpoints are counted, so it must run after the pending writes
+        Keyword arguments:
+        manager -- the checkpoint manager
+        """
+        import tensorflow as tf
+        checkpoints = [c for c in manager.checkpoints if tf.io.gfile.exists(c + '.index')]
+        keep = set(checkpoints[-self.keep_last:])
+        if (self.best_metric):
+            best = get_best_checkpoint(checkpoints, read_checkpoint_metrics(manager.directory), self.best_metric)
+            if (best):
+                keep.add(best)
+        removed = [c for c in checkpoints if c not in keep]
+        if (not removed and len(checkpoints) == len(manager.checkpoints)):
+            return
+        for checkpoint in removed:
+            for f in tf.io.gfile.glob(checkpoint + '.*'):
+                try:
+                    tf.io.gfile.remove(f)
+                except tf.errors.NotFoundError: pass
+        # The state lists the kept checkpoints with the times of their writes
+        kept = [c for c in checkpoints if c in keep]
+        if (kept):
+            tf.compat.v1.train.update_checkpoint_state(
+                manager.directory,
+                kept[-1],
+                kept,
+                all_model_checkpoint_timestamps = [tf.io.gfile.stat(c + '.index').mtime_nsec / 1e9 for c in kept])
+        if (removed):
+            print(f'Removed the checkpoints {", ".join(os.path.basename(c) for c in removed)}')
+    def wrap_checkpoint_callback(self, checkpoint_callback):
+        """
+        Return a checkpoint callback waiting the write of the checkpoint before calling the original one
+        Keyword arguments:
+        checkpoint_callback -- the checkpoint callback
+        """
+        if (not checkpoint_callback or not self.async_write):
+            return checkpoint_callback
+        def callback(args):
+            self.sync()
+            checkpoint_callback(args)
+        return callback
+
+if __name__ == '__main__':
+    prm = ('prm' in locals() and isinstance(prm, TrainParameters) and prm) or TrainParameters.default
+    import tensorflow as tf
+    state = tf.train.get_checkpoint_state(prm.model_dir)
+    checkpoints = list(state.all_model_checkpoint_paths) if state else []
+    metrics = read_checkpoint_metrics(prm.model_dir)
+    best = get_best_checkpoint(checkpoints, metrics, prm.checkpoint_best_metric) if prm.checkpoint_best_metric else None
+    for checkpoint in checkpoints:
+        value = metrics.get(os.path.basename(checkpoint), {}).get(prm.checkpoint_best_metric)
+        print(f'{os.path.basename(checkpoint)}: {prm.checkpoint_best_metric} = {value if value is not None else "not evaluated"}' + (' (best)' if checkpoint == best else ''))
@@ -0,0 +1,105 @@
+import  os
+
+try:    from    train_parameters import TrainParameters
+except: pass
+try:    from    train_checkpoints import is_higher_better, read_checkpoint_metrics, write_checkpoint_metrics
+except: pass
+
+class EarlyStopping:
+    """Checkpoint callback evaluating the checkpoints on a sample of the evaluation set and stopping the train when the metric doesn't improve"""
+    def __init__(self, pipeline_config_path, model_dir, metric, patience, delta = 0.0, every = 1, sample_1_of_n = 1, checkpoint_callback = None):
+        """
+        Constructor
+        Keyword arguments:
+        pipeline_config_path    -- the pipeline configuration file
+        model_dir               -- the directory of the checkpoints
+        metric                  -- the evaluation metric to monitor
+        patience                -- number of evaluations without improvement after which the train is stopped
+        delta                   -- the minimum change of the metric counted as an improvement
+        every                   -- evaluate a checkpoint every this number of checkpoints
+        sample_1_of_n           -- evaluate one example every this number of examples of the evaluation set
+        checkpoint_callback     -- the optional checkpoint callback receiving the checkpoint events
+        """
+        super().__init__()
+        self.pipeline_config_path = pipeline_config_path
+        self.model_dir = model_dir
+        self.metric = metric
+        self.patience = patience
+        self.delta = delta
+        self.every = max(every, 1)
+        self.sample_1_of_n = max(sample_1_of_n, 1)
+        self.checkpoint_callback = checkpoint_callback
+        self.best = None
+        self.wait = 0
+        self._count = 0
+        self._model = None
+    def evaluate(self, checkpoint):
+        """
+        Return the dictionary of the evaluation metrics of a checkpoint
+        Keyword arguments:
+        checkpoint  -- the checkpoint to evaluate
+        """
+        import  tensorflow as tf
+        from    object_detection import inputs, model_lib_v2
+        from    object_detection.builders import model_builder
+        from    object_detection.utils import config_util
+        # The evaluation model and dataset are built at the first evaluation
+        if (self._model is None):
+            self._configs = config_util.get_configs_from_pipeline_file(self.pipeline_config_path)
+            eval_input_config = self._configs['eval_input_configs'][0]
+            eval_input_config.sample_1_of_n_examples = self.sample_1_of_n
+            self._model = model_builder.build(model_config = self._configs['model'], is_training = False)
+            self._dataset = inputs.eval_input(
+                eval_config = self._configs['eval_config'],
+                eval_input_config = eval_input_config,
+                model_config = self._configs['model'],
+                model = self._model)
+            self._global_step = tf.Variable(0, trainable = False, dtype = tf.int64)
+        tf.train.Checkpoint(step = self._global_step, model = self._model).restore(checkpoint).expect_partial()
+        return model_lib_v2.eager_eval_loop(self._model, self._configs, self._dataset, use_tpu = False, global_step = self._global_step)
+    def update(self, value):
+        """
+        Update the state with a new value of the metric. Return True if the train must stop
+        Keyword arguments:
+        value   -- the value of the metric
+        """
+        sign = 1 if is_higher_better(self.metric) else -1
+        if (self.best is None or sign * (value - self.best) > self.delta):
+            self.best = value
+            self.wait = 0
+            return False
+        self.wait += 1
+        return self.wait >= self.patience
+    def __call__(self, args):
+        """
+        Checkpoint callback
+        Keyword arguments:
+        args    -- the checkpoint event. Its cancel attribute is set for stopping the train
+        """
+        import tensorflow as tf
+        self._count += 1
+        if (self._count % self.every == 0):
+            checkpoint = getattr(args, 'latest_checkpoint', None) or tf.train.latest_checkpoint(self.model_dir)
+            metrics = self.evaluate(checkpoint)
+            write_checkpoint_metrics(self.model_dir, checkpoint, metrics)
+            value = float(metrics[self.metric]) if self.metric in metrics else None
+            if (value is None):
+                print(f'Warning: the early stopping metric {self.metric} is not in the evaluation metrics {", ".join(metrics)}')
+            elif (self.update(value)):
+                print(f'Early stopping: {self.metric} of {os.path.basename(checkpoint)} is {value:.4f}, '
+                      f'without improvements of the best {self.best:.4f} in the last {self.wait} evaluations')
+                args.cancel = True
+            else:
+                print(f'Early stopping: {self.metric} of {os.path.basename(checkpoint)} is {value:.4f}, best {self.best:.4f}, '
+                      f'{self.wait} of {self.patience} evaluations without improvements')
+        if (self.checkpoint_callback):
+            self.checkpoint_callback(args)
+
+if __name__ == '__main__':
+    prm = ('prm' in locals() and isinstance(prm, TrainParameters) and prm) or TrainParameters.default
+    early_stopping = EarlyStopping(prm.pipeline_config_path, prm.model_dir, prm.early_stopping_metric, max(prm.early_stopping_patience, 1), prm.early_stopping_delta)
+    metrics = read_checkpoint_metrics(prm.model_dir)
+    for checkpoint, values in metrics.items():
+        if (prm.early_stopping_metric in values):
+            stop = early_stopping.update(values[prm.early_stopping_metric])
+            print(f'{checkpoint}: {prm.early_stopping_metric} = {values[prm.early_stopping_metric]:.4f}' + (' (stop)' if stop else ''))
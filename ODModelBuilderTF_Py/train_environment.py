@@ -6,6 +6,8 @@ try:    from    default_cfg import Cfg
 except: pass
 try:    from    train_parameters import TrainParameters
 except: pass
+try:    from    utilities import is_archive
+except: pass
 
 def init_train_environment(prm: TrainParameters):
     """
@@ -17,18 +19,18 @@ def init_train_environment(prm: TrainParameters):
     if (os.path.isdir('/content') and os.path.isdir('/mnt/MyDrive')):
         # Check the existence of the train images dir
         gdrive_dir = os.path.join('/mnt', 'MyDrive', prm.train_images_dir)
-        if (not os.path.isdir(gdrive_dir)):
+        if (not os.path.isdir(gdrive_dir) and not is_archive(gdrive_dir)):
             raise Exception('Error!!! The train images dir doesn`t exist')
         if (not os.path.exists('/content/train-images')):
-            os.symlink(gdrive_dir, '/content/train-images', True)
+            os.symlink(gdrive_dir, '/content/train-images', os.path.isdir(gdrive_dir))
         print(f"Google drive's {prm.train_images_dir} is linked to /content/train-images")
         prm.train_images_dir = '/content/train-images'
         # Check the existence of the evaluation images dir
         gdrive_dir = os.path.join('/mnt', 'MyDrive', prm.eval_images_dir)
-        if (not os.path.isdir(gdrive_dir)):
+        if (not os.path.isdir(gdrive_dir) and not is_archive(gdrive_dir)):
             raise Exception('Error!!! The evaluation images dir doesn`t exist')
         if (not os.path.exists('/content/eval-images')):
-            os.symlink(gdrive_dir, '/content/eval-images', True)
+            os.symlink(gdrive_dir, '/content/eval-images', os.path.isdir(gdrive_dir))
         print(f"Google drive's {prm.eval_images_dir} is linked to /content/eval-images")
         prm.eval_images_dir = '/content/eval-images'
         # Check the existence of the output directory
@@ -49,10 +51,10 @@ def init_train_environment(prm: TrainParameters):
                 os.mkdir(prm.annotations_dir)
         print(f'The annotations files will be in {str(Path(prm.annotations_dir).resolve())}')
     else:
-        if (not os.path.isdir(prm.train_images_dir)):
+        if (not os.path.isdir(prm.train_images_dir) and not is_archive(prm.train_images_dir)):
             raise Exception('Error!!! The train images dir doesn`t exist')
         print(f'Train images from {str(Path(prm.train_images_dir).resolve())}')
-        if (not os.path.isdir(prm.eval_images_dir)):
+        if (not os.path.isdir(prm.eval_images_dir) and not is_archive(prm.eval_images_dir)):
             raise Exception('Error!!! The evaluation images dir doesn`t exist')
         print(f'Train images from {str(Path(prm.eval_images_dir).resolve())}')
         if (not os.path.exists(prm.model_dir)):
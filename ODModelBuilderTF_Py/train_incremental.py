@@ -0,0 +1,362 @@
+import  os
+from    pathlib import Path
+import  shutil
+import  sys
+import  time
+
+try:    from    train_parameters import TrainParameters
+except: pass
+
+# Fraction of the schedule of the pipeline used by the incremental train if its steps are not specified
+_default_incremental_fraction = 0.1
+# Scopes of the class prediction heads in the checkpoints of the object detection API models:
+# the SSD heads, the second stage heads of Faster R-CNN and the object center heads of CenterNet
+_class_head_scopes = (
+    '/_prediction_heads/class_predictions_with_background/',
+    '/_mask_rcnn_box_predictor/_class_prediction_head/',
+    '/_prediction_head_dict/object_center/')
+# Weights of the output layers of the class heads, with the classes in their last dimension
+_class_head_weights = ('kernel', 'pointwise_kernel', 'bias')
+# Suffix of the names of the variables in the checkpoints
+_variable_suffix = '/.ATTRIBUTES/VARIABLE_VALUE'
+
+def get_archive_dir(model_dir):
+    """
+    Return the directory of the archived trains of a model directory
+    Keyword arguments:
+    model_dir   -- the model directory
+    """
+    return os.path.join(model_dir, 'archive')
+
+def get_warm_start_checkpoint(model_dir):
+    """
+    Return the warm start checkpoint of an incremental train or None if it doesn't exist
+    Keyword arguments:
+    model_dir   -- the model directory
+    """
+    checkpoint = os.path.join(model_dir, 'warm_start', 'ckpt-0')
+    return checkpoint if os.path.exists(checkpoint + '.index') else None
+
+def read_labels_map(model_dir):
+    """
+    Return the content of the labels map of the previous train in a model directory or None if it doesn't exist.
+    It must be read before the creation of the records, that overwrites it with the current labels
+    Keyword arguments:
+    model_dir   -- the model directory
+    """
+    labels_file = os.path.join(model_dir, 'label_map.pbtxt')
+    if (not os.path.exists(labels_file)):
+        return None
+    with open(labels_file, 'r') as f:
+        return f.read()
+
+def archive_checkpoints(prm: TrainParameters, labels_map = None):
+    """
+    Move the checkpoints of the previous train, with its labels map and pipeline, in a new directory of the archive,
+    so the incremental train starts from the step 0. Return the archive directory or None if there are no checkpoints
+    Keyword arguments:
+    prm         -- Parameters
+    labels_map  -- the content of the labels map of the previous train as returned by read_labels_map
+    """
+    import tensorflow as tf
+    from train_checkpoints import checkpoint_metrics_file_name
+    if (not tf.train.latest_checkpoint(prm.model_dir)):
+        return None
+    archive_dir = os.path.join(get_archive_dir(prm.model_dir), time.strftime('%Y%m%d-%H%M%S'))
+    os.makedirs(archive_dir)
+    names = [f for f in os.listdir(prm.model_dir) if f.startswith('ckpt-')]
+    names.extend(f for f in ['checkpoint', checkpoint_metrics_file_name] if os.path.exists(os.path.join(prm.model_dir, f)))
+    for name in names:
+        shutil.move(os.path.join(prm.model_dir, name), archive_dir)
+    # The checkpoint state file contains the absolute paths of the checkpoints
+    state = tf.train.get_checkpoint_state(archive_dir)
+    if (state):
+        tf.compat.v1.train.update_checkpoint_state(
+            archive_dir,
+            os.path.join(archive_dir, os.path.basename(state.model_checkpoint_path)),
+            [os.path.join(archive_dir, os.path.basename(p)) for p in state.all_model_checkpoint_paths])
+    if (labels_map is not None):
+        with open(os.path.join(archive_dir, 'label_map.pbtxt'), 'w') as f:
+            f.write(labels_map)
+    if (os.path.exists(os.path.join(prm.model_dir, 'pipeline.config'))):
+        shutil.copy2(os.path.join(prm.model_dir, 'pipeline.config'), archive_dir)
+    print(f'The checkpoints of the previous train were archived in {str(Path(archive_dir).resolve())}')
+    return archive_dir
+
+def get_latest_archive(model_dir):
+    """
+    Return the latest archive directory containing checkpoints or None if there are no archives
+    Keyword arguments:
+    model_dir   -- the model directory
+    """
+    import tensorflow as tf
+    archive_dir = get_archive_dir(model_dir)
+    archives = sorted(os.listdir(archive_dir), reverse = True) if os.path.isdir(archive_dir) else []
+    for archive in archives:
+        if (tf.train.latest_checkpoint(os.path.join(archive_dir, archive))):
+            return os.path.join(archive_dir, archive)
+    return None
+
+def prepare_warm_start(prm: TrainParameters, labels_map = None):
+    """
+    Archive the checkpoints of the previous train and create the warm start checkpoint of the incremental train
+    for the current labels. Without new checkpoints the warm start checkpoint is rebuilt from the latest archive,
+    so it always follows the labels of the records. Return the warm start checkpoint or None
+    Keyword arguments:
+    prm         -- Parameters
+    labels_map  -- the content of the labels map of the previous train as returned by read_labels_map
+    """
+    archive_dir = archive_checkpoints(prm, labels_map) or get_latest_archive(prm.model_dir)
+    if (archive_dir):
+        return create_warm_start_checkpoint(prm, archive_dir)
+    output_dir = os.path.join(prm.model_dir, 'warm_start')
+    if (os.path.isdir(output_dir)):
+        shutil.rmtree(output_dir)
+        print('Removed the warm start checkpoint without archived trains')
+    return None
+
+def get_class_offset(model_config):
+    """
+    Return the number of extra classes (the background) preceding the labels in the class prediction heads of a model
+    Keyword arguments:
+    model_config    -- the model configuration
+    """
+    meta_architecture = model_config.WhichOneof('model')
+    if (meta_architecture == 'ssd'):
+        return 1 if model_config.ssd.add_background_class else 0
+    if (meta_architecture == 'faster_rcnn'):
+        return 1
+    return 0
+
+def get_class_head_variables(names):
+    """
+    Return the names of the variables of the output layers of the class prediction heads among the variables of a checkpoint.
+    The towers of layers preceding the heads and the optimizer slots are excluded
+    Keyword arguments:
+    names   -- the names of the variables in the checkpoint
+    """
+    import re
+    layers = dict()
+    for name in names:
+        if (not name.startswith('model/') or not name.endswith(_variable_suffix)):
+            continue
+        layer, _, weight = name[:-len(_variable_suffix)].rpartition('/')
+        if (weight not in _class_head_weights or not any(scope in layer + '/' for scope in _class_head_scopes)):
+            continue
+        # The objectness heads of the first stage of Faster R-CNN don't depend on the labels
+        if ('/_first_stage_box_predictor/' in layer):
+            continue
+        # The output layer of a head made by a sequence of layers is the last one of the sequence
+        parent, _, last = layer.rpartition('/')
+        match = re.fullmatch(r'(?:layer_with_weights-)?(\d+)', last)
+        key, position = (parent, int(match.group(1))) if match else (layer, 0)
+        if (key not in layers or position > layers[key][0]):
+            layers[key] = (position, [])
+        if (position == layers[key][0]):
+            layers[key][1].append(name)
+    return set(name for _, layer_names in layers.values() for name in layer_names)
+
+def remap_classes(value, mapping, old_count):
+    """
+    Return the values of a class prediction head with the classes in a new order.
+    The new classes get zero weights and the lowest bias of the known ones
+    Keyword arguments:
+    value       -- the array of the variable. Its last dimension is the number of anchors by the number of classes
+    mapping     -- the list of the old class index of each new class, or None for the new classes
+    old_count   -- the old number of classes
+    """
+    import numpy as np
+    shape = value.shape[:-1] + (value.shape[-1] // old_count, old_count)
+    old = value.reshape(shape)
+    fill = old.min(axis = -1, keepdims = True) if value.ndim == 1 else np.zeros(shape[:-1] + (1,), value.dtype)
+    new = np.concatenate([old[..., i:i + 1] if i is not None else fill for i in mapping], axis = -1)
+    return new.reshape(value.shape[:-1] + (-1,))
+
+def remap_checkpoint(checkpoint, output_checkpoint, mapping, old_count):
+    """
+    Write a copy of a checkpoint with the classes of the class prediction heads in a new order.
+    Return the names of the remapped variables
+    Keyword arguments:
+    checkpoint          -- the source checkpoint
+    output_checkpoint   -- the output checkpoint
+    mapping             -- the list of the old class index of each new class, or None for the new classes
+    old_count           -- the old number of classes
+    """
+    import  numpy as np
+    import  tensorflow as tf
+    reader = tf.train.load_checkpoint(checkpoint)
+    dtypes = reader.get_variable_to_dtype_map()
+    names = sorted(dtypes)
+    heads = get_class_head_variables(names) if mapping != list(range(old_count)) else set()
+    tensors = []
+    remapped = []
+    for name in names:
+        value = reader.get_tensor(name)
+        if (name in heads and np.ndim(value) > 0):
+            if (value.shape[-1] % old_count == 0):
+                value = remap_classes(value, mapping, old_count)
+                remapped.append(name)
+            else:
+                print(f'Warning: the variable {name} is not a class prediction head of {old_count} classes')
+        tensors.append(tf.constant(value, dtype = dtypes[name]))
+    tf.raw_ops.SaveV2(prefix = output_checkpoint, tensor_names = names, shape_and_slices = [''] * len(names), tensors = tensors)
+    return remapped
+
+def create_warm_start_checkpoint(prm: TrainParameters, archive_dir):
+    """
+    Create the warm start checkpoint of an incremental train from the latest archived checkpoint,
+    remapping by name the classes of the heads if the labels changed. Return the checkpoint
+    Keyword arguments:
+    prm         -- Parameters
+    archive_dir -- the archive directory of the previous train
+    """
+    import  tensorflow as tf
+    from    object_detection.utils import config_util, label_map_util
+    checkpoint = tf.train.latest_checkpoint(archive_dir)
+    new_labels = label_map_util.get_label_map_dict(os.path.join(prm.annotations_dir, 'label_map.pbtxt'))
+    old_labels_file = os.path.join(archive_dir, 'label_map.pbtxt')
+    if (os.path.exists(old_labels_file)):
+        old_labels = label_map_util.get_label_map_dict(old_labels_file)
+    else:
+        old_classes = config_util.get_configs_from_pipeline_file(os.path.join(archive_dir, 'pipeline.config'))['model']
+        old_classes = getattr(old_classes, old_classes.WhichOneof('model')).num_classes
+        if (old_classes != len(new_labels)):
+            raise Exception(f'Error!!! The labels of the previous train are unknown and their number {old_classes} is different from the current {len(new_labels)}')
+        print('Warning: the labels of the previous train are unknown. They are considered the same of the current train')
+        old_labels = new_labels
+    pipeline_config_path = os.path.join(archive_dir, 'pipeline.config')
+    if (not os.path.exists(pipeline_config_path)):
+        pipeline_config_path = prm.pipeline_config_path
+    offset = get_class_offset(config_util.get_configs_from_pipeline_file(pipeline_config_path)['model'])
+    old_count = len(old_labels) + offset
+    old_ids = { name: id - 1 + offset for name, id in old_labels.items() }
+    mapping = list(range(offset)) + [old_ids.get(name) for name, id in sorted(new_labels.items(), key = lambda item: item[1])]
+    added = sorted(set(new_labels).difference(old_labels))
+    removed = sorted(set(old_labels).difference(new_labels))
+    output_dir = os.path.join(prm.model_dir, 'warm_start')
+    if (os.path.isdir(output_dir)):
+        shutil.rmtree(output_dir)
+    os.makedirs(output_dir)
+    output_checkpoint = os.path.join(output_dir, 'ckpt-0')
+    remapped = remap_checkpoint(checkpoint, output_checkpoint, mapping, old_count)
+    print(f'Created the warm start checkpoint {str(Path(output_checkpoint).resolve())} from {checkpoint}')
+    if (added or removed):
+        print(f'Remapped {len(remapped)} class prediction variables. Added labels: {", ".join(added) or "none"}. Removed labels: {", ".join(removed) or "none"}')
+    return output_checkpoint
+
+def scale_learning_rate_schedule(optimizer_config, scale):
+    """
+    Scale the steps of the learning rate schedule of an optimizer
+    Keyword arguments:
+    optimizer_config    -- the optimizer configuration
+    scale               -- the scale factor of the steps
+    """
+    optimizer = getattr(optimizer_config, optimizer_config.WhichOneof('optimizer'))
+    learning_rate = getattr(optimizer.learning_rate, optimizer.learning_rate.WhichOneof('learning_rate'))
+    kind = optimizer.learning_rate.WhichOneof('learning_rate')
+    if (kind == 'cosine_decay_learning_rate'):
+        learning_rate.total_steps = max(1, round(learning_rate.total_steps * scale))
+        learning_rate.warmup_steps = min(round(learning_rate.warmup_steps * scale), learning_rate.total_steps)
+    elif (kind == 'exponential_decay_learning_rate'):
+        learning_rate.decay_steps = max(1, round(learning_rate.decay_steps * scale))
+        learning_rate.burnin_steps = round(learning_rate.burnin_steps * scale)
+    elif (kind == 'manual_step_learning_rate'):
+        for step in learning_rate.schedule:
+            step.step = max(1, round(step.step * scale))
+
+def config_incremental_pipeline(pipeline_config, prm: TrainParameters, checkpoint):
+    """
+    Configure a pipeline for the incremental train from a warm start checkpoint with a shortened schedule.
+    Return the number of train steps
+    Keyword arguments:
+    pipeline_config -- the pipeline configuration
+    prm             -- Parameters
+    checkpoint      -- the warm start checkpoint
+    """
+    train_config = pipeline_config.train_config
+    # The pipeline is rewritten in place: if it's already configured from this checkpoint its schedule is already shortened
+    configured = train_config.fine_tune_checkpoint == checkpoint and train_config.fine_tune_checkpoint_type == 'full'
+    train_config.fine_tune_checkpoint = checkpoint
+    train_config.fine_tune_checkpoint_type = 'full'
+    num_steps = prm.incremental_train_steps
+    if (configured and (num_steps < 1 or num_steps == train_config.num_steps)):
+        return train_config.num_steps
+    if (num_steps < 1):
+        num_steps = max(1, round(train_config.num_steps * _default_incremental_fraction))
+    if (train_config.num_steps > 0):
+        scale_learning_rate_schedule(train_config.optimizer, num_steps / train_config.num_steps)
+    train_config.num_steps = num_steps
+    print(f'Incremental train of {num_steps} steps from {checkpoint}')
+    return num_steps
+
+def check_class_heads_remap():
+    """
+    Check the remapping of the classes on a small checkpoint with the variables layout of an SSD model
+    with weight shared heads: two anchors, three labels and the background, a label added by the new train.
+    Return True if only the output layers of the class prediction heads changed
+    """
+    import  tempfile
+    import  numpy as np
+    import  tensorflow as tf
+    anchors, old_count, channels = 2, 4, 8
+    rng = np.random.default_rng(0)
+    class Layer(tf.Module):
+        def __init__(self, inputs, outputs):
+            super().__init__()
+            self.kernel = tf.Variable(rng.normal(size = (3, 3, inputs, outputs)).astype(np.float32))
+            self.bias = tf.Variable(rng.normal(size = (outputs,)).astype(np.float32))
+    class Head(tf.Module):
+        def __init__(self, name, outputs):
+            super().__init__()
+            setattr(self, name, Layer(channels, outputs))
+    # The towers have as many channels as a class prediction head of 4 classes and 2 anchors, but they must not be remapped
+    box_predictor = tf.Module()
+    box_predictor._base_tower_layers_for_heads = {
+        'box_encodings': [Layer(channels, channels)],
+        'class_predictions_with_background': [Layer(channels, channels), Layer(channels, channels)] }
+    box_predictor._prediction_heads = {
+        'box_encodings': Head('_box_encoder_predictor', anchors * 4),
+        'class_predictions_with_background': Head('_class_predictor', anchors * old_count) }
+    model = tf.Module()
+    model._feature_extractor = Layer(3, channels)
+    model._box_predictor = box_predictor
+    mapping = [0, 1, 2, 3, None]
+    heads = [
+        'model/_box_predictor/_prediction_heads/class_predictions_with_background/_class_predictor/kernel' + _variable_suffix,
+        'model/_box_predictor/_prediction_heads/class_predictions_with_background/_class_predictor/bias' + _variable_suffix]
+    with tempfile.TemporaryDirectory() as temp_dir:
+        checkpoint = tf.train.Checkpoint(model = model).write(os.path.join(temp_dir, 'ckpt-1'))
+        remapped = remap_checkpoint(checkpoint, os.path.join(temp_dir, 'ckpt-0'), mapping, old_count)
+        old = tf.train.load_checkpoint(checkpoint)
+        new = tf.train.load_checkpoint(os.path.join(temp_dir, 'ckpt-0'))
+        success = sorted(remapped) == sorted(heads)
+        for name in old.get_variable_to_shape_map():
+            old_value, new_value = old.get_tensor(name), new.get_tensor(name)
+            if (name in heads):
+                shape = old_value.shape[:-1] + (anchors, old_count)
+                new_shape = old_value.shape[:-1] + (anchors, len(mapping))
+                ok = (new_value.shape == new_shape[:-2] + (anchors * len(mapping),) and
+                      np.array_equal(new_value.reshape(new_shape)[..., :old_count], old_value.reshape(shape)))
+            else:
+                ok = np.array_equal(old_value, new_value)
+            if (not ok):
+                print(f'The variable {name} is wrong after the remap of the classes')
+                success = False
+    print(f'Remapped the variables {", ".join(remapped) or "none"}')
+    return success
+
+if __name__ == '__main__':
+    # Check of the remapping of the class heads: python train_incremental.py check
+    if (len(sys.argv) > 1 and sys.argv[1] == 'check'):
+        if (not check_class_heads_remap()):
+            raise Exception('Error!!! The check of the remapping of the class heads failed')
+        print('The check of the remapping of the class heads succeeded')
+        sys.exit(0)
+    prm = ('prm' in locals() and isinstance(prm, TrainParameters) and prm) or TrainParameters.default
+    archive_dir = get_archive_dir(prm.model_dir)
+    archives = sorted(os.listdir(archive_dir)) if os.path.isdir(archive_dir) else []
+    print(f'{len(archives)} archived train(s) in {archive_dir}')
+    for archive in archives:
+        print(f'    {archive}')
+    checkpoint = get_warm_start_checkpoint(prm.model_dir)
+    print(f'Warm start checkpoint: {checkpoint or "none"}')
@@ -21,6 +21,85 @@ flags.DEFINE_string ('pre_trained_model_dir', None, 'Path to the directory '
 flags.DEFINE_integer('batch_size', 0, 'The size of batch. If < 1 it uses the '
                      'value contained in the pipeline configuration file.')
 flags.DEFINE_integer('tensorboard_port', 8080, 'The port of the tensorboard server')
+flags.DEFINE_integer('num_record_workers', 1, 'Number of processes encoding the '
+                     'TFRecord examples. If < 1 all the available CPUs are used.')
+flags.DEFINE_integer('num_record_shards', 0, 'Number of shards of the TFRecord '
+                     'files. If < 1 it\'s chosen from the size of the dataset.')
+flags.DEFINE_bool   ('rebuild_records', False, 'Force the rebuild of the TFRecord '
+                     'files even if their manifests tell that they are up to date.')
+flags.DEFINE_integer('verify_images', 0, 'Decode and check the size of 1 image '
+                     'every verify_images while creating the TFRecord files. '
+                     'If < 1 the images are not verified.')
+flags.DEFINE_bool   ('resize_images', False, 'Downscale the images of the TFRecord '
+                     'files to the size required by the image resizer of the model.')
+flags.DEFINE_integer('resize_quality', 95, 'The JPEG quality of the downscaled images.')
+flags.DEFINE_bool   ('raw_cache', False, 'Create a memory mapped cache of the '
+                     'pre-decoded train images and read them from it during the train.')
+flags.DEFINE_bool   ('streaming_records', False, 'Create the TFRecord files streaming '
+                     'the annotations, with a memory usage independent of the dataset size.')
+flags.DEFINE_string ('dedup_images', None, 'Remove the duplicated images from the TFRecord '
+                     'files: exact for the same content or perceptual also for the near duplicated ones.')
+flags.DEFINE_bool   ('dedup_merge', False, 'Merge the boxes of the duplicated images '
+                     'in the kept ones instead of dropping them. Not available with streaming_records.')
+flags.DEFINE_integer('dedup_threshold', 4, 'The maximum hamming distance of the perceptual '
+                     'hashes of two near duplicated images, from 0 to 63.')
+flags.DEFINE_integer('augmentation_copies', 0, 'Number of augmented copies of each train '
+                     'image written offline in extra TFRecord shards. If < 1 no offline augmentation is done.')
+flags.DEFINE_string ('augmentations', 'flip,crop,scale,color', 'Comma separated list of the '
+                     'offline augmentation transforms. The equivalent online augmentations are disabled.')
+flags.DEFINE_string ('annotations_format', 'voc', 'Format of the annotations: voc for an xml '
+                     'file per image, coco or csv for a single annotations file in the images directory.')
+flags.DEFINE_integer('num_readers', 0, 'Number of record files read in parallel by the train '
+                     'input reader. If < 1 it uses the value contained in the pipeline configuration file.')
+flags.DEFINE_integer('num_parallel_batches', 0, 'Number of batches decoded in parallel by the train '
+                     'input reader. If < 1 it uses the value contained in the pipeline configuration file.')
+flags.DEFINE_integer('num_prefetch_batches', 0, 'Number of batches prefetched by the train '
+                     'input reader. If < 1 it uses the value contained in the pipeline configuration file.')
+flags.DEFINE_integer('read_block_length', 0, 'Number of consecutive records read from each file by the train '
+                     'input reader. If < 1 it uses the value contained in the pipeline configuration file.')
+flags.DEFINE_integer('shuffle_buffer_size', 0, 'Size of the shuffle buffer of the train '
+                     'input reader. If < 1 it uses the value contained in the pipeline configuration file.')
+flags.DEFINE_integer('queue_capacity', 0, 'Capacity of the queue of the train '
+                     'input reader. If < 1 it uses the value contained in the pipeline configuration file.')
+flags.DEFINE_bool   ('input_auto_tune', False, 'Derive the train input reader settings not explicitly set '
+                     'from the number of CPUs, the number of record shards and the available memory.')
+flags.DEFINE_bool   ('probe_batch_size', False, 'Probe increasing batch sizes with a few timed train '
+                     'steps before the train and use the one with the best throughput within the memory budget.')
+flags.DEFINE_integer('probe_max_batch_size', 64, 'The maximum batch size probed.')
+flags.DEFINE_integer('probe_steps', 5, 'Number of timed train steps of each probed batch size.')
+flags.DEFINE_integer('probe_memory_budget', 0, 'The memory budget in MB of the probed batch sizes, '
+                     'for the host memory and the GPU memory. If < 1 it\'s the 80% of the physical memory and of the GPU memory.')
+flags.DEFINE_bool   ('step_metrics', False, 'Add the wall time, throughput, input wait, compute time and memory '
+                     'to the train step events and log them in train_metrics.jsonl of the model directory.')
+flags.DEFINE_string ('profile_steps', None, 'Capture a TensorFlow profiler trace of the train steps '
+                     'in the window START:END.')
+flags.DEFINE_string ('profile_dir', None, 'Path to the directory of the profiler traces. '
+                     'If not specified it\'s the train directory of the model, shown in the tensorboard.')
+flags.DEFINE_integer('worker_index', 0, 'Index of this process in a multi-worker train with num_workers > 1. '
+                     'The worker 0 is the chief, preparing the records and the pipeline shared with the others.')
+flags.DEFINE_string ('worker_hosts', None, 'Comma separated host:port list of the workers of a multi-worker train. '
+                     'If not specified the chief starts the other workers as local processes.')
+flags.DEFINE_string ('mixed_precision', None, 'Train with the mixed precision bfloat16, '
+                     'fast on the CPUs with AMX or AVX512-BF16 instructions.')
+flags.DEFINE_bool   ('xla', False, 'Compile the losses and the gradients of the train step with the XLA JIT compiler.')
+flags.DEFINE_bool   ('async_checkpoints', False, 'Snapshot the variables in host memory and write '
+                     'the checkpoints in background, without pausing the train.')
+flags.DEFINE_integer('checkpoint_keep_last', 0, 'Number of latest checkpoints kept, plus the best one '
+                     'by checkpoint_best_metric. If < 1 the default retention of the checkpoints is used.')
+flags.DEFINE_string ('checkpoint_best_metric', 'DetectionBoxes_Precision/mAP', 'The evaluation metric '
+                     'of checkpoint_metrics.jsonl in the model directory selecting the best checkpoint to keep. The metrics are '
+                     'logged by the early stopping or by the evaluation run with log_checkpoint_metrics.')
+flags.DEFINE_integer('early_stopping_patience', 0, 'Stop the train after this number of evaluations of the '
+                     'checkpoints without improvements of early_stopping_metric. If < 1 the early stopping is disabled.')
+flags.DEFINE_float  ('early_stopping_delta', 0.0, 'The minimum change of the early stopping metric counted as an improvement.')
+flags.DEFINE_string ('early_stopping_metric', 'DetectionBoxes_Precision/mAP', 'The evaluation metric monitored by the early stopping.')
+flags.DEFINE_integer('early_stopping_every', 1, 'Evaluate a checkpoint for the early stopping every this number of checkpoints.')
+flags.DEFINE_integer('early_stopping_sample_1_of_n', 4, 'Evaluate one example every this number of examples '
+                     'of the evaluation set for the early stopping.')
+flags.DEFINE_bool   ('incremental_train', False, 'Warm start the train from the latest checkpoint of the model '
+                     'directory, remapping the classes by label name, with a shortened schedule. The previous checkpoints are archived.')
+flags.DEFINE_integer('incremental_train_steps', 0, 'Number of steps of the incremental train. '
+                     'If < 1 it\'s the 10% of the steps of the pipeline configuration file.')
 
 def train_main(unused_argv, **kwargs):
     """Main function for the train.
@@ -35,21 +114,93 @@ def train_main(unused_argv, **kwargs):
     from tf_records import create_tf_records
     from train_environment import init_train_environment
     from train_parameters import TrainParameters
-    from train_pipeline import config_train_pipeline
+    from train_pipeline import config_train_pipeline, config_train_precision
     train_parameters = TrainParameters()
     train_parameters.update_values()
     # Check if the number of train steps is 0
     if (train_parameters.num_train_steps == 0 or not train_parameters.model_dir):
         print('Train parameters not set. Skipping.')
         return
-    init_train_environment(train_parameters)
-    if (not train_parameters.pre_trained_model_dir):
-        download_pretrained_model(train_parameters)
-    create_tf_records(train_parameters)
-    config_train_pipeline(train_parameters)
+    config_train_precision(train_parameters)
+    # The workers of a multi-worker train use the records and the pipeline prepared by the chief
+    if (train_parameters.worker_index == 0):
+        init_train_environment(train_parameters)
+        if (not train_parameters.pre_trained_model_dir):
+            download_pretrained_model(train_parameters)
+        # The labels of the previous train are read before the records creation overwrites them,
+        # and its checkpoints are archived only after the records are created
+        labels_map = None
+        if (train_parameters.incremental_train):
+            from train_incremental import read_labels_map
+            labels_map = read_labels_map(train_parameters.model_dir)
+        create_tf_records(train_parameters)
+        if (train_parameters.incremental_train):
+            from train_incremental import prepare_warm_start
+            prepare_warm_start(train_parameters, labels_map)
+        config_train_pipeline(train_parameters)
+        if (train_parameters.probe_batch_size):
+            from train_batch_probe import find_batch_size
+            batch_size = find_batch_size(train_parameters)
+            if (batch_size):
+                train_parameters.batch_size = batch_size
+                config_train_pipeline(train_parameters)
+    if (train_parameters.raw_cache):
+        from tf_records import get_train_record_files
+        from train_raw_cache import install_raw_cache_reader
+        install_raw_cache_reader(
+            os.path.join(train_parameters.annotations_dir, 'train.raw'),
+            get_train_record_files(train_parameters))
+    profiler = None
+    if (train_parameters.profile_steps):
+        from train_profiler import TrainProfiler, get_profile_dir, parse_profile_steps
+        profiler = TrainProfiler(
+            *parse_profile_steps(train_parameters.profile_steps),
+            get_profile_dir(train_parameters),
+            kwargs.get('step_callback'))
+        TrainProfiler.install_tensorboard_plugin()
+        kwargs['step_callback'] = profiler
+    step_metrics = None
+    if (train_parameters.step_metrics):
+        from object_detection.utils import config_util
+        from tf_records import get_train_record_files
+        from train_step_metrics import TrainStepMetrics, metrics_file_name
+        batch_size = config_util.get_configs_from_pipeline_file(train_parameters.pipeline_config_path)['train_config'].batch_size
+        step_metrics = TrainStepMetrics(
+            os.path.join(train_parameters.model_dir, metrics_file_name),
+            batch_size,
+            kwargs.get('step_callback'))
+        step_metrics.install_input_timer(get_train_record_files(train_parameters))
+        kwargs['step_callback'] = step_metrics
+    if (train_parameters.early_stopping_patience > 0):
+        if (train_parameters.num_workers > 1):
+            raise Exception('Error!!! The early stopping is not supported in the multi-worker train')
+        from train_early_stopping import EarlyStopping
+        kwargs['checkpoint_callback'] = EarlyStopping(
+            train_parameters.pipeline_config_path,
+            train_parameters.model_dir,
+            train_parameters.early_stopping_metric,
+            train_parameters.early_stopping_patience,
+            train_parameters.early_stopping_delta,
+            train_parameters.early_stopping_every,
+            train_parameters.early_stopping_sample_1_of_n,
+            kwargs.get('checkpoint_callback'))
+    checkpoint_writer = None
+    if (train_parameters.async_checkpoints or train_parameters.checkpoint_keep_last > 0):
+        from train_checkpoints import CheckpointWriter
+        checkpoint_writer = CheckpointWriter(
+            train_parameters.async_checkpoints,
+            train_parameters.checkpoint_keep_last,
+            train_parameters.checkpoint_best_metric)
+        checkpoint_writer.install()
+        kwargs['checkpoint_callback'] = checkpoint_writer.wrap_checkpoint_callback(kwargs.get('checkpoint_callback'))
     # Import the train main function
     from object_detection import model_main_tf2
     train_parameters.update_flags()
+    # Start the other workers of a multi-worker train
+    workers = None
+    if (train_parameters.num_workers > 1):
+        from train_workers import start_workers
+        workers = start_workers(train_parameters)
     if (train_parameters.num_train_steps < 0):
         setattr(flags.FLAGS, 'num_train_steps', None)
     # Start the tensorboard
@@ -61,6 +212,15 @@ def train_main(unused_argv, **kwargs):
     finally:
         # Stop the tensorboard
         stop_tensorboard(tb_process)
+        if (checkpoint_writer):
+            checkpoint_writer.uninstall()
+        if (profiler):
+            profiler.stop()
+        if (workers is not None):
+            from train_workers import stop_workers
+            stop_workers(workers)
+        if (step_metrics):
+            step_metrics.close()
 
 if __name__ == '__main__':
     if (not is_executable()):
@@ -21,8 +21,50 @@ class TrainParameters(BaseParameters):
         self._record_summaries = True
         self._batch_size = Cfg.batch_size if Cfg.batch_size > 1 else None
         self._tensorboard_port = 8080
+        self._num_record_workers = 1
+        self._num_record_shards = 0
+        self._rebuild_records = False
+        self._verify_images = 0
+        self._resize_images = False
+        self._resize_quality = 95
+        self._raw_cache = False
+        self._streaming_records = False
+        self._dedup_images = None
+        self._dedup_merge = False
+        self._dedup_threshold = 4
+        self._augmentation_copies = 0
+        self._augmentations = 'flip,crop,scale,color'
+        self._annotations_format = 'voc'
+        self._num_readers = 0
+        self._num_parallel_batches = 0
+        self._num_prefetch_batches = 0
+        self._read_block_length = 0
+        self._shuffle_buffer_size = 0
+        self._queue_capacity = 0
+        self._input_auto_tune = False
+        self._probe_batch_size = False
+        self._probe_max_batch_size = 64
+        self._probe_steps = 5
+        self._probe_memory_budget = 0
+        self._step_metrics = False
+        self._profile_steps = None
+        self._profile_dir = None
+        self._worker_index = 0
+        self._worker_hosts = None
+        self._mixed_precision = None
+        self._xla = False
+        self._async_checkpoints = False
+        self._checkpoint_keep_last = 0
+        self._checkpoint_best_metric = 'DetectionBoxes_Precision/mAP'
+        self._early_stopping_patience = 0
+        self._early_stopping_delta = 0.0
+        self._early_stopping_metric = 'DetectionBoxes_Precision/mAP'
+        self._early_stopping_every = 1
+        self._early_stopping_sample_1_of_n = 4
+        self._incremental_train = False
+        self._incremental_train_steps = 0
         self._is_path.extend([
-            'pre_trained_model_dir', 'pipeline_config_path'])
+            'pre_trained_model_dir', 'pipeline_config_path', 'profile_dir'])
     default = None
     @property
     def pre_trained_model_dir(self): return self._pre_trained_model_dir
@@ -68,6 +110,174 @@ class TrainParameters(BaseParameters):
     def tensorboard_port(self): return self._tensorboard_port
     @tensorboard_port.setter
     def tensorboard_port(self, value): self._tensorboard_port = value
+    @property
+    def num_record_workers(self): return self._num_record_workers
+    @num_record_workers.setter
+    def num_record_workers(self, value): self._num_record_workers = value
+    @property
+    def num_record_shards(self): return self._num_record_shards
+    @num_record_shards.setter
+    def num_record_shards(self, value): self._num_record_shards = value
+    @property
+    def rebuild_records(self): return self._rebuild_records
+    @rebuild_records.setter
+    def rebuild_records(self, value): self._rebuild_records = value
+    @property
+    def verify_images(self): return self._verify_images
+    @verify_images.setter
+    def verify_images(self, value): self._verify_images = value
+    @property
+    def resize_images(self): return self._resize_images
+    @resize_images.setter
+    def resize_images(self, value): self._resize_images = value
+    @property
+    def resize_quality(self): return self._resize_quality
+    @resize_quality.setter
+    def resize_quality(self, value): self._resize_quality = value
+    @property
+    def raw_cache(self): return self._raw_cache
+    @raw_cache.setter
+    def raw_cache(self, value): self._raw_cache = value
+    @property
+    def streaming_records(self): return self._streaming_records
+    @streaming_records.setter
+    def streaming_records(self, value): self._streaming_records = value
+    @property
+    def dedup_images(self): return self._dedup_images
+    @dedup_images.setter
+    def dedup_images(self, value): self._dedup_images = value
+    @property
+    def dedup_merge(self): return self._dedup_merge
+    @dedup_merge.setter
+    def dedup_merge(self, value): self._dedup_merge = value
+    @property
+    def dedup_threshold(self): return self._dedup_threshold
+    @dedup_threshold.setter
+    def dedup_threshold(self, value): self._dedup_threshold = value
+    @property
+    def augmentation_copies(self): return self._augmentation_copies
+    @augmentation_copies.setter
+    def augmentation_copies(self, value): self._augmentation_copies = value
+    @property
+    def augmentations(self): return self._augmentations
+    @augmentations.setter
+    def augmentations(self, value): self._augmentations = value
+    @property
+    def annotations_format(self): return self._annotations_format
+    @annotations_format.setter
+    def annotations_format(self, value): self._annotations_format = value
+    @property
+    def num_readers(self): return self._num_readers
+    @num_readers.setter
+    def num_readers(self, value): self._num_readers = value
+    @property
+    def num_parallel_batches(self): return self._num_parallel_batches
+    @num_parallel_batches.setter
+    def num_parallel_batches(self, value): self._num_parallel_batches = value
+    @property
+    def num_prefetch_batches(self): return self._num_prefetch_batches
+    @num_prefetch_batches.setter
+    def num_prefetch_batches(self, value): self._num_prefetch_batches = value
+    @property
+    def read_block_length(self): return self._read_block_length
+    @read_block_length.setter
+    def read_block_length(self, value): self._read_block_length = value
+    @property
+    def shuffle_buffer_size(self): return self._shuffle_buffer_size
+    @shuffle_buffer_size.setter
+    def shuffle_buffer_size(self, value): self._shuffle_buffer_size = value
+    @property
+    def queue_capacity(self): return self._queue_capacity
+    @queue_capacity.setter
+    def queue_capacity(self, value): self._queue_capacity = value
+    @property
+    def input_auto_tune(self): return self._input_auto_tune
+    @input_auto_tune.setter
+    def input_auto_tune(self, value): self._input_auto_tune = value
+    @property
+    def probe_batch_size(self): return self._probe_batch_size
+    @probe_batch_size.setter
+    def probe_batch_size(self, value): self._probe_batch_size = value
+    @property
+    def probe_max_batch_size(self): return self._probe_max_batch_size
+    @probe_max_batch_size.setter
+    def probe_max_batch_size(self, value): self._probe_max_batch_size = value
+    @property
+    def probe_steps(self): return self._probe_steps
+    @probe_steps.setter
+    def probe_steps(self, value): self._probe_steps = value
+    @property
+    def probe_memory_budget(self): return self._probe_memory_budget
+    @probe_memory_budget.setter
+    def probe_memory_budget(self, value): self._probe_memory_budget = value
+    @property
+    def step_metrics(self): return self._step_metrics
+    @step_metrics.setter
+    def step_metrics(self, value): self._step_metrics = value
+    @property
+    def profile_steps(self): return self._profile_steps
+    @profile_steps.setter
+    def profile_steps(self, value): self._profile_steps = value
+    @property
+    def profile_dir(self): return self._profile_dir
+    @profile_dir.setter
+    def profile_dir(self, value): self._profile_dir = value
+    @property
+    def worker_index(self): return self._worker_index
+    @worker_index.setter
+    def worker_index(self, value): self._worker_index = value
+    @property
+    def worker_hosts(self): return self._worker_hosts
+    @worker_hosts.setter
+    def worker_hosts(self, value): self._worker_hosts = value
+    @property
+    def mixed_precision(self): return self._mixed_precision
+    @mixed_precision.setter
+    def mixed_precision(self, value): self._mixed_precision = value
+    @property
+    def xla(self): return self._xla
+    @xla.setter
+    def xla(self, value): self._xla = value
+    @property
+    def async_checkpoints(self): return self._async_checkpoints
+    @async_checkpoints.setter
+    def async_checkpoints(self, value): self._async_checkpoints = value
+    @property
+    def checkpoint_keep_last(self): return self._checkpoint_keep_last
+    @checkpoint_keep_last.setter
+    def checkpoint_keep_last(self, value): self._checkpoint_keep_last = value
+    @property
+    def checkpoint_best_metric(self): return self._checkpoint_best_metric
+    @checkpoint_best_metric.setter
+    def checkpoint_best_metric(self, value): self._checkpoint_best_metric = value
+    @property
+    def early_stopping_patience(self): return self._early_stopping_patience
+    @early_stopping_patience.setter
+    def early_stopping_patience(self, value): self._early_stopping_patience = value
+    @property
+    def early_stopping_delta(self): return self._early_stopping_delta
+    @early_stopping_delta.setter
+    def early_stopping_delta(self, value): self._early_stopping_delta = value
+    @property
+    def early_stopping_metric(self): return self._early_stopping_metric
+    @early_stopping_metric.setter
+    def early_stopping_metric(self, value): self._early_stopping_metric = value
+    @property
+    def early_stopping_every(self): return self._early_stopping_every
+    @early_stopping_every.setter
+    def early_stopping_every(self, value): self._early_stopping_every = value
+    @property
+    def early_stopping_sample_1_of_n(self): return self._early_stopping_sample_1_of_n
+    @early_stopping_sample_1_of_n.setter
+    def early_stopping_sample_1_of_n(self, value): self._early_stopping_sample_1_of_n = value
+    @property
+    def incremental_train(self): return self._incremental_train
+    @incremental_train.setter
+    def incremental_train(self, value): self._incremental_train = value
+    @property
+    def incremental_train_steps(self): return self._incremental_train_steps
+    @incremental_train_steps.setter
+    def incremental_train_steps(self, value): self._incremental_train_steps = value
 
 TrainParameters.default = TrainParameters.default or TrainParameters()
 
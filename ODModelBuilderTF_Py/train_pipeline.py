@@ -6,6 +6,128 @@ except: pass
 try:    from    train_parameters import TrainParameters
 except: pass
 
+# Settings of the train input reader that can be tuned
+_input_reader_settings = ['num_readers', 'num_parallel_batches', 'num_prefetch_batches', 'read_block_length', 'shuffle_buffer_size', 'queue_capacity']
+# Fraction of the available memory used by the shuffle buffer and by the prefetched batches in the automatic tuning
+_shuffle_memory_fraction = 0.1
+_prefetch_memory_fraction = 0.05
+# Estimated ratio between the size of a decoded image and its encoded size
+_decoded_size_ratio = 10
+# Online data augmentation options replaced by each offline augmentation transform
+_online_augmentations = {
+    'flip': ['random_horizontal_flip'],
+    'crop': ['random_crop_image', 'random_crop_pad_image', 'random_crop_to_aspect_ratio', 'ssd_random_crop',
+             'ssd_random_crop_pad', 'ssd_random_crop_fixed_aspect_ratio', 'ssd_random_crop_pad_fixed_aspect_ratio'],
+    'scale': ['random_image_scale'],
+    'color': ['random_adjust_brightness', 'random_adjust_contrast', 'random_adjust_saturation', 'random_distort_color'] }
+# Supported mixed precisions of the train
+_mixed_precisions = ['bfloat16']
+
+def config_train_precision(prm: TrainParameters):
+    """
+    Configure in the process the mixed precision policy and the XLA compilation of the train
+    Keyword arguments:
+    prm     -- Parameters
+    """
+    import tensorflow as tf
+    if (prm.mixed_precision):
+        if (prm.mixed_precision not in _mixed_precisions):
+            raise Exception(f'Error!!! Unsupported mixed precision {prm.mixed_precision}. Supported: {", ".join(_mixed_precisions)}')
+        tf.keras.mixed_precision.set_global_policy('mixed_' + prm.mixed_precision)
+        print(f'The train uses the mixed precision {prm.mixed_precision}')
+    if (prm.xla):
+        install_xla_train_step()
+        print('The train step is compiled with XLA')
+
+def install_xla_train_step():
+    """
+    Make the object detection API compute the losses of the train step, and their gradients, in a function compiled by XLA.
+    The update of the optimizer stays out of the compiled function, because the distribution strategies
+    cannot synchronize the gradients of the replicas inside a nested function
+    """
+    import  tensorflow as tf
+    from    object_detection import model_lib_v2
+    compute_losses = getattr(model_lib_v2, '_compute_losses_and_predictions_dicts', None)
+    if (compute_losses is None):
+        raise Exception('Error!!! The XLA compilation of the train step is not supported by this object detection API version')
+    original_function = getattr(compute_losses, 'original_function', compute_losses)
+    try:
+        compiled = tf.function(original_function, jit_compile = True)
+    except TypeError:
+        compiled = tf.function(original_function, experimental_compile = True)
+    compiled.original_function = original_function
+    model_lib_v2._compute_losses_and_predictions_dicts = compiled
+
+def set_input_path(input_reader, record_file):
+    """
+    Set the input path of an input reader with the files of a record
+    Keyword arguments:
+    input_reader    -- the input reader configuration
+    record_file     -- the record's file path and name
+    """
+    from tf_records import get_tf_record_files
+    input_path = input_reader.tf_record_input_reader.input_path
+    del input_path[:]
+    input_path.extend(get_tf_record_files(record_file) or [record_file])
+
+def get_input_reader_settings(prm: TrainParameters, batch_size):
+    """
+    Return the dictionary of the settings of the train input reader. The settings not explicitly set
+    are derived in automatic tuning mode from the number of CPUs, the number of shards and the available memory
+    Keyword arguments:
+    prm         -- Parameters
+    batch_size  -- the train batch size
+    """
+    settings = { name: getattr(prm, name) for name in _input_reader_settings if getattr(prm, name) > 0 }
+    if (not prm.input_auto_tune):
+        return settings
+    import  psutil
+    from    tf_records import get_train_record_files
+    from    tf_records_index import TFRecordIndex
+    cpus = os.cpu_count() or 1
+    record_files = get_train_record_files(prm)
+    # Average size of the serialized examples, from the index of the records if available
+    count = 0
+    for output_file in [os.path.join(prm.annotations_dir, 'train.record'), os.path.join(prm.annotations_dir, 'train_augmented.record')]:
+        if (TFRecordIndex.exists(output_file)):
+            count += len(TFRecordIndex(output_file))
+    example_size = sum(os.path.getsize(f) for f in record_files) / max(count, 1)
+    available = psutil.virtual_memory().available
+    num_readers = settings.get('num_readers', max(1, min(len(record_files), cpus)))
+    shuffle_buffer_size = int(available * _shuffle_memory_fraction / max(example_size, 1))
+    if (count > 0):
+        shuffle_buffer_size = min(shuffle_buffer_size, count)
+    batch_memory = batch_size * example_size * _decoded_size_ratio
+    auto = {
+        'num_readers': num_readers,
+        'read_block_length': max(1, min(15, -(-batch_size // num_readers))),
+        'num_parallel_batches': max(1, -(-cpus // batch_size)),
+        'num_prefetch_batches': max(2, min(8, int(available * _prefetch_memory_fraction / max(batch_memory, 1)))),
+        'shuffle_buffer_size': max(batch_size, shuffle_buffer_size),
+        'queue_capacity': max(batch_size, shuffle_buffer_size) }
+    auto.update(settings)
+    return auto
+
+def remove_online_augmentations(train_config, transforms):
+    """
+    Remove the online data augmentation options equivalent to the offline augmentation transforms
+    Keyword arguments:
+    train_config    -- the train configuration
+    transforms      -- the names of the offline augmentation transforms
+    """
+    removed = { option for t in transforms for option in _online_augmentations.get(t, []) }
+    options = train_config.data_augmentation_options
+    kept = []
+    for option in options:
+        step = option.WhichOneof('preprocessing_step')
+        if (step in removed):
+            print(f'The online augmentation {step} is replaced by the offline augmentation')
+        else:
+            kept.append(type(option)())
+            kept[-1].CopyFrom(option)
+    del options[:]
+    options.extend(kept)
+
 def config_train_pipeline(prm: TrainParameters):
     """
     Configure the training pipeline
@@ -40,12 +162,35 @@ def config_train_pipeline(prm: TrainParameters):
         text_format.Merge(proto_str, pipeline_config)
     pipeline_config.model.ssd.num_classes = labels_count
     pipeline_config.train_config.batch_size = prm.batch_size if prm.batch_size > 0 else pipeline_config.train_config.batch_size
-    pipeline_config.train_config.fine_tune_checkpoint = os.path.join(pre_trained_model_dir, 'checkpoint', 'ckpt-0')
-    pipeline_config.train_config.fine_tune_checkpoint_type = 'detection'
+    warm_start_checkpoint = None
+    if (prm.incremental_train):
+        from train_incremental import config_incremental_pipeline, get_warm_start_checkpoint
+        warm_start_checkpoint = get_warm_start_checkpoint(prm.model_dir)
+        if (not warm_start_checkpoint):
+            print('Warning: there is no previous train checkpoint for the incremental train. Training from the pre-trained model')
+    if (warm_start_checkpoint):
+        prm.num_train_steps = config_incremental_pipeline(pipeline_config, prm, warm_start_checkpoint)
+    else:
+        pipeline_config.train_config.fine_tune_checkpoint = os.path.join(pre_trained_model_dir, 'checkpoint', 'ckpt-0')
+        pipeline_config.train_config.fine_tune_checkpoint_type = 'detection'
     pipeline_config.train_input_reader.label_map_path = os.path.join(prm.annotations_dir, 'label_map.pbtxt')
-    pipeline_config.train_input_reader.tf_record_input_reader.input_path[0] = os.path.join(prm.annotations_dir, 'train.record')
+    set_input_path(pipeline_config.train_input_reader, os.path.join(prm.annotations_dir, 'train.record'))
+    for name, value in get_input_reader_settings(prm, pipeline_config.train_config.batch_size).items():
+        setattr(pipeline_config.train_input_reader, name, value)
+        print(f'The train input reader {name} is {value}')
+    if (prm.augmentation_copies > 0):
+        from tf_records import get_augmentation_transforms, get_tf_record_files
+        augmented_files = get_tf_record_files(os.path.join(prm.annotations_dir, 'train_augmented.record'))
+        if (augmented_files):
+            pipeline_config.train_input_reader.tf_record_input_reader.input_path.extend(augmented_files)
+            remove_online_augmentations(pipeline_config.train_config, get_augmentation_transforms(prm))
+    if (prm.mixed_precision):
+        pipeline_config.train_config.use_bfloat16 = prm.mixed_precision == 'bfloat16'
+    if (prm.xla):
+        # Groundtruth of static shapes, as in the TPU train, so the compiled step isn't recompiled for each number of boxes
+        pipeline_config.train_config.unpad_groundtruth_tensors = False
     pipeline_config.eval_input_reader[0].label_map_path = os.path.join(prm.annotations_dir, 'label_map.pbtxt')
-    pipeline_config.eval_input_reader[0].tf_record_input_reader.input_path[0] = os.path.join(prm.annotations_dir, 'eval.record')
+    set_input_path(pipeline_config.eval_input_reader[0], os.path.join(prm.annotations_dir, 'eval.record'))
     config_text = text_format.MessageToString(pipeline_config)
     with tf.io.gfile.GFile(output_file, 'wb') as f:
         f.write(config_text)
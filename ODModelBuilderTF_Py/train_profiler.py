@@ -0,0 +1,103 @@
+import  os
+from    pathlib import Path
+
+try:    from    train_parameters import TrainParameters
+except: pass
+try:    from    utilities import get_package_info, install
+except: pass
+
+def parse_profile_steps(profile_steps: str):
+    """
+    Return the tuple (start, end) of a profiling window specified as START:END
+    Keyword arguments:
+    profile_steps   -- the window of steps
+    """
+    try:
+        start, end = (int(s) for s in profile_steps.split(':'))
+    except:
+        raise Exception(f'Error!!! The profile steps {profile_steps} are not in the form START:END')
+    if (start < 0 or end <= start):
+        raise Exception(f'Error!!! The profile steps {profile_steps} are not a valid window')
+    return start, end
+
+def get_profile_dir(prm: TrainParameters):
+    """
+    Return the directory of the profiler traces: the specified one or the train directory of the model
+    Keyword arguments:
+    prm     -- Parameters
+    """
+    return prm.profile_dir if prm.profile_dir else os.path.join(prm.model_dir, 'train')
+
+class TrainProfiler:
+    """Step callback capturing a TensorFlow profiler trace of a window of train steps"""
+    def __init__(self, start_step, end_step, profile_dir, step_callback = None):
+        """
+        Constructor
+        Keyword arguments:
+        start_step      -- the step after which the capture starts
+        end_step        -- the step after which the capture stops
+        profile_dir     -- the output directory of the trace. It's shown by a tensorboard having it or a parent as logdir
+        step_callback   -- the optional step callback receiving the steps events
+        """
+        super().__init__()
+        self.start_step = start_step
+        self.end_step = end_step
+        self.profile_dir = profile_dir
+        self.step_callback = step_callback
+        self.profiling = False
+        self.done = False
+    @staticmethod
+    def install_tensorboard_plugin():
+        """
+        Install the tensorboard plugin showing the profiler traces if missing
+        """
+        if (not get_package_info('tensorboard_plugin_profile').name):
+            install('tensorboard_plugin_profile', [])
+    def start(self):
+        """
+        Start the capture of the trace, including the host CPU activity and the input pipeline
+        """
+        import tensorflow as tf
+        options = tf.profiler.experimental.ProfilerOptions(host_tracer_level = 2, python_tracer_level = 0, device_tracer_level = 1)
+        try:
+            tf.profiler.experimental.start(self.profile_dir, options = options)
+            self.profiling = True
+            print(f'Profiling the train steps from {self.start_step} to {self.end_step} in {str(Path(self.profile_dir).resolve())}')
+        except Exception as exc:
+            print(f'Warning: cannot start the profiler. Exception {exc}')
+            self.done = True
+    def stop(self):
+        """
+        Stop the capture of the trace and write it
+        """
+        import tensorflow as tf
+        if (not self.profiling):
+            return
+        self.profiling = False
+        self.done = True
+        try:
+            tf.profiler.experimental.stop()
+            print(f'Written the profiler trace in {str(Path(self.profile_dir).resolve())}')
+        except Exception as exc:
+            print(f'Warning: cannot stop the profiler. Exception {exc}')
+    def __call__(self, args):
+        """
+        Step callback
+        Keyword arguments:
+        args    -- the step event
+        """
+        global_step = int(args.global_step)
+        if (self.profiling and global_step >= self.end_step):
+            self.stop()
+        elif (not self.profiling and not self.done and self.start_step <= global_step < self.end_step):
+            self.start()
+        if (self.step_callback):
+            self.step_callback(args)
+
+if __name__ == '__main__':
+    prm = ('prm' in locals() and isinstance(prm, TrainParameters) and prm) or TrainParameters.default
+    profile_dir = os.path.join(get_profile_dir(prm), 'plugins', 'profile')
+    runs = sorted(os.listdir(profile_dir)) if os.path.isdir(profile_dir) else []
+    print(f'{len(runs)} profiler trace(s) in {profile_dir}')
+    for run in runs:
+        print(f'    {run}')
@@ -0,0 +1,256 @@
+import  json
+import  os
+from    pathlib import Path
+import  time
+
+try:    from    train_parameters import TrainParameters
+except: pass
+
+def _decode_example(serialized, resize_target):
+    """
+    Decode a serialized TensorFlow example in the pixels array and the annotations of the image
+    Keyword arguments:
+    serialized      -- the serialized example
+    resize_target   -- the resizer of the model as returned by get_resize_target or None
+    """
+    import  io
+    import  numpy as np
+    from    PIL import Image
+    import  tensorflow as tf
+    from    tf_records import get_resize_scale
+    feature = tf.train.Example.FromString(serialized).features.feature
+    image = Image.open(io.BytesIO(feature['image/encoded'].bytes_list.value[0]))
+    scale = get_resize_scale(resize_target, image.width, image.height)
+    if (scale < 1):
+        size = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+        image.draft('RGB', size)
+        image = image.convert('RGB').resize(size, Image.BILINEAR)
+    pixels = np.asarray(image.convert('RGB'), np.uint8)
+    boxes = np.array([
+        feature['image/object/bbox/ymin'].float_list.value,
+        feature['image/object/bbox/xmin'].float_list.value,
+        feature['image/object/bbox/ymax'].float_list.value,
+        feature['image/object/bbox/xmax'].float_list.value], np.float32).T.reshape(-1, 4)
+    classes = np.array(feature['image/object/class/label'].int64_list.value, np.int64)
+    filename = feature['image/filename'].bytes_list.value[0].decode('utf8')
+    return filename, pixels, boxes, classes
+
+def _get_sources_info(record_files):
+    """
+    Return the list of name, size and modification time of the record files
+    Keyword arguments:
+    record_files    -- the record files
+    """
+    return [[str(Path(f).resolve()), os.path.getsize(f), os.stat(f).st_mtime_ns] for f in record_files]
+
+def create_raw_cache(records, cache_file, resize_target = None, num_workers = 1):
+    """
+    Create a cache of pre-decoded images from TensorFlow records.
+    The pixels of the images are stored as uint8 in cache_file and the index of offsets,
+    shapes and annotations in cache_file.index.npz. The cache is skipped if it's up to date
+    with its sources and resizer.
+    Keyword arguments:
+    records         -- the record file paths and names (without the shard suffix), with their indexes
+    cache_file      -- the output file path and name of the cache
+    resize_target   -- the resizer of the model as returned by get_resize_target or None
+    num_workers     -- number of processes decoding the images. If < 1 all the available CPUs are used
+    """
+    import  numpy as np
+    from    tf_records import _ordered_map, get_tf_record_files
+    from    tf_records_index import TFRecordIndex
+    for record in records:
+        if (not TFRecordIndex.exists(record)):
+            raise Exception(f'Error!!! The record {record} has no index')
+    index_file = cache_file + '.index.npz'
+    sources = _get_sources_info([f for record in records for f in get_tf_record_files(record)])
+    resizer = json.dumps(resize_target)
+    try:
+        with np.load(index_file) as index:
+            if (os.path.exists(cache_file) and index['sources'].tolist() == [str(s) for s in sources] and str(index['resize_target']) == resizer):
+                print(f'The raw images cache {str(Path(cache_file).resolve())} is up to date')
+                return
+    except: pass
+    if (num_workers < 1):
+        num_workers = os.cpu_count() or 1
+    filenames = []
+    offsets = []
+    shapes = []
+    box_offsets = [0]
+    boxes = []
+    classes = []
+    offset = 0
+    start_time = time.perf_counter()
+    # The examples are read by plain file reads through the indexes of the records, without a TensorFlow dataset
+    def read_examples():
+        for record in records:
+            record_index = TFRecordIndex(record)
+            yield from record_index.read(record_index.subset(1))
+    jobs = ((serialized, resize_target) for serialized in read_examples())
+    def decoded_examples():
+        if (num_workers > 1):
+            from concurrent.futures import ProcessPoolExecutor
+            with ProcessPoolExecutor(num_workers) as executor:
+                yield from _ordered_map(executor, _decode_example, jobs, num_workers * 4)
+        else:
+            for job in jobs:
+                yield _decode_example(*job)
+    with open(cache_file, 'wb') as f:
+        for filename, pixels, image_boxes, image_classes in decoded_examples():
+            f.write(pixels.tobytes())
+            filenames.append(filename)
+            offsets.append(offset)
+            shapes.append(pixels.shape)
+            offset += pixels.nbytes
+            boxes.append(image_boxes)
+            classes.append(image_classes)
+            box_offsets.append(box_offsets[-1] + len(image_boxes))
+    # Written in a temporary file and then renamed, so an interrupted write doesn't leave a corrupt index
+    with open(index_file + '.tmp', 'wb') as f:
+        np.savez(
+            f,
+            sources = np.array([str(s) for s in sources]),
+            resize_target = np.array(resizer),
+            filenames = np.array(filenames),
+            offsets = np.array(offsets, np.int64),
+            shapes = np.array(shapes, np.int64).reshape(-1, 3),
+            box_offsets = np.array(box_offsets, np.int64),
+            boxes = np.concatenate(boxes) if boxes else np.zeros((0, 4), np.float32),
+            classes = np.concatenate(classes) if classes else np.zeros((0,), np.int64))
+    os.replace(index_file + '.tmp', index_file)
+    elapsed = max(time.perf_counter() - start_time, 1e-6)
+    print(f'Created the raw images cache {str(Path(cache_file).resolve())} '
+          f'({len(filenames)} images, {offset / 1048576:.1f} MB) in {elapsed:.1f}s')
+
+class RawCache:
+    """Reader of the cache of pre-decoded images"""
+    def __init__(self, cache_file):
+        """
+        Constructor
+        Keyword arguments:
+        cache_file  -- the cache file path and name
+        """
+        import numpy as np
+        super().__init__()
+        with np.load(cache_file + '.index.npz') as index:
+            self.filenames = index['filenames']
+            self.offsets = index['offsets']
+            self.shapes = index['shapes']
+            self.box_offsets = index['box_offsets']
+            self.boxes = index['boxes']
+            self.classes = index['classes']
+        self.cache_file = cache_file
+        self.pixels = np.memmap(cache_file, np.uint8, 'r')
+    def __len__(self):
+        return len(self.offsets)
+    def __getitem__(self, i):
+        """
+        Return the filename, the pixels and the boxes and classes of an image.
+        The pixels are a view of the memory mapped cache, without copies
+        Keyword arguments:
+        i   -- index of the image
+        """
+        shape = self.shapes[i]
+        offset = self.offsets[i]
+        pixels = self.pixels[offset:offset + shape[0] * shape[1] * shape[2]].reshape(shape)
+        box_slice = slice(self.box_offsets[i], self.box_offsets[i + 1])
+        return self.filenames[i], pixels, self.boxes[box_slice], self.classes[box_slice]
+    def dataset(self, shuffle = True, seed = None, sample_1_of_n = 1, num_shards = 1, shard_index = 0, num_parallel_calls = None):
+        """
+        Return a dataset of the images with the same tensors produced by the TFRecord decoder of the object detection API.
+        The pixels are read from the cache by the tf.data file readers, without running python code for each image
+        Keyword arguments:
+        shuffle             -- shuffle the order of the images at each iteration
+        seed                -- the seed of the shuffling
+        sample_1_of_n       -- take one image every this number of images
+        num_shards          -- number of shards of the images, as the input pipelines of a distributed train
+        shard_index         -- the index of the shard of this dataset
+        num_parallel_calls  -- number of images read and decoded in parallel. If None it's tuned automatically
+        """
+        import numpy as np
+        import tensorflow as tf
+        from object_detection.core import standard_fields as fields
+        num_parallel_calls = num_parallel_calls or tf.data.experimental.AUTOTUNE
+        offsets = tf.constant(self.offsets, tf.int64)
+        sizes = np.prod(self.shapes, axis = 1)
+        # The bytes following each image, excluded as footer of its record
+        footers = tf.constant(len(self.pixels) - self.offsets - sizes, tf.int64)
+        sizes = tf.constant(sizes, tf.int64)
+        shapes = tf.constant(self.shapes, tf.int64)
+        filenames = tf.constant(self.filenames.astype(str))
+        boxes = tf.RaggedTensor.from_row_splits(self.boxes, self.box_offsets)
+        classes = tf.RaggedTensor.from_row_splits(self.classes, self.box_offsets)
+        dataset = tf.data.Dataset.range(len(self))
+        if (sample_1_of_n > 1):
+            dataset = dataset.shard(sample_1_of_n, 0)
+        if (num_shards > 1):
+            dataset = dataset.shard(num_shards, shard_index)
+        if (shuffle):
+            dataset = dataset.shuffle(len(self), seed = seed, reshuffle_each_iteration = True)
+        # Each image is the single fixed length record of the cache file between the preceding and the following images
+        def read_image(i):
+            images = tf.data.FixedLengthRecordDataset(self.cache_file, sizes[i], header_bytes = offsets[i], footer_bytes = footers[i])
+            return images.map(lambda data: (i, data))
+        dataset = dataset.interleave(read_image, cycle_length = 16, num_parallel_calls = num_parallel_calls, deterministic = True)
+        def decode_image(i, data):
+            image = tf.reshape(tf.io.decode_raw(data, tf.uint8), shapes[i])
+            # Static channels as the images of the TFRecord decoder
+            image.set_shape([None, None, 3])
+            return filenames[i], image, boxes[i], classes[i]
+        dataset = dataset.map(decode_image, num_parallel_calls = num_parallel_calls)
+        def to_tensor_dict(filename, image, boxes, classes):
+            num_boxes = tf.shape(boxes)[0]
+            return {
+                fields.InputDataFields.image: image,
+                fields.InputDataFields.original_image_spatial_shape: tf.shape(image)[:2],
+                fields.InputDataFields.source_id: filename,
+                fields.InputDataFields.key: filename,
+                fields.InputDataFields.filename: filename,
+                fields.InputDataFields.groundtruth_boxes: boxes,
+                fields.InputDataFields.groundtruth_classes: classes,
+                fields.InputDataFields.groundtruth_weights: tf.ones([num_boxes], tf.float32),
+                fields.InputDataFields.groundtruth_area: tf.zeros([num_boxes], tf.float32),
+                fields.InputDataFields.groundtruth_is_crowd: tf.zeros([num_boxes], tf.bool),
+                fields.InputDataFields.groundtruth_difficult: tf.zeros([num_boxes], tf.int64),
+                fields.InputDataFields.groundtruth_group_of: tf.zeros([num_boxes], tf.bool) }
+        return dataset.map(to_tensor_dict, num_parallel_calls = num_parallel_calls)
+
+def install_raw_cache_reader(cache_file, record_files):
+    """
+    Make the object detection API read the train images from the raw cache instead of decoding the record files
+    Keyword arguments:
+    cache_file      -- the cache file path and name
+    record_files    -- the record files replaced by the cache
+    """
+    import tensorflow as tf
+    from object_detection.builders import dataset_builder
+    original_build = getattr(dataset_builder.build, 'original_build', dataset_builder.build)
+    record_files = [str(Path(f).resolve()) for f in record_files]
+    def build(input_reader_config, batch_size = None, transform_input_data_fn = None, input_context = None, reduce_to_frame_fn = None):
+        input_path = [str(Path(f).resolve()) for f in input_reader_config.tf_record_input_reader.input_path]
+        if (input_path != record_files or reduce_to_frame_fn):
+            return original_build(input_reader_config, batch_size, transform_input_data_fn, input_context, reduce_to_frame_fn)
+        # Parallelism of the maps as in the dataset builder of the object detection API
+        if (batch_size):
+            num_parallel_calls = batch_size * input_reader_config.num_parallel_batches
+        else:
+            num_parallel_calls = input_reader_config.num_parallel_map_calls
+        dataset = RawCache(cache_file).dataset(
+            shuffle = input_reader_config.shuffle,
+            sample_1_of_n = input_reader_config.sample_1_of_n_examples,
+            num_shards = input_context.num_input_pipelines if input_context else 1,
+            shard_index = input_context.input_pipeline_id if input_context else 0,
+            num_parallel_calls = num_parallel_calls or None)
+        dataset = dataset.repeat(input_reader_config.num_epochs or None)
+        if (transform_input_data_fn):
+            dataset = dataset.map(transform_input_data_fn, num_parallel_calls = num_parallel_calls or tf.data.experimental.AUTOTUNE)
+        if (batch_size):
+            dataset = dataset.batch(batch_size, drop_remainder = input_reader_config.drop_remainder)
+        return dataset.prefetch(input_reader_config.num_prefetch_batches or tf.data.experimental.AUTOTUNE)
+    build.original_build = original_build
+    dataset_builder.build = build
+    print(f'The train images will be read from the raw images cache {str(Path(cache_file).resolve())}')
+
+if __name__ == '__main__':
+    prm = ('prm' in locals() and isinstance(prm, TrainParameters) and prm) or TrainParameters.default
+    cache = RawCache(os.path.join(prm.annotations_dir, 'train.raw'))
+    print(f'The raw images cache contains {len(cache)} images')
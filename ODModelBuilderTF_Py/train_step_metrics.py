@@ -0,0 +1,125 @@
+import  collections
+import  json
+import  os
+from    pathlib import Path
+import  time
+
+try:    from    train_parameters import TrainParameters
+except: pass
+
+# Name of the metrics file in the model directory
+metrics_file_name = 'train_metrics.jsonl'
+# Fraction of the step time blocked on the input over which a train is considered input bound
+_input_bound_fraction = 0.25
+
+class TrainStepMetrics:
+    """Step callback adding the wall time, throughput, input wait, compute time and memory of the train steps, logged in a JSON lines file"""
+    def __init__(self, output_file, batch_size, step_callback = None):
+        """
+        Constructor
+        Keyword arguments:
+        output_file     -- the JSON lines metrics file path and name. The metrics are appended
+        batch_size      -- the train batch size
+        step_callback   -- the optional step callback receiving the steps events with the metrics
+        """
+        super().__init__()
+        self.output_file = output_file
+        self.batch_size = batch_size
+        self.step_callback = step_callback
+        self._batch_times = collections.deque(maxlen = 64)
+        self._last_time = None
+        self._file = None
+    def install_input_timer(self, record_files):
+        """
+        Make the object detection API timestamp each train batch leaving the input pipeline
+        Keyword arguments:
+        record_files    -- the train record files
+        """
+        import tensorflow as tf
+        from object_detection.builders import dataset_builder
+        previous_build = getattr(dataset_builder.build, 'metrics_previous_build', dataset_builder.build)
+        record_files = [str(Path(f).resolve()) for f in record_files]
+        def timestamp():
+            self._batch_times.append(time.perf_counter())
+            return 0
+        def add_timestamp(*element):
+            with tf.control_dependencies([tf.py_function(timestamp, [], tf.int32)]):
+                element = tf.nest.map_structure(tf.identity, element)
+            return element if len(element) > 1 else element[0]
+        def build(input_reader_config, *args, **kwargs):
+            dataset = previous_build(input_reader_config, *args, **kwargs)
+            input_path = [str(Path(f).resolve()) for f in input_reader_config.tf_record_input_reader.input_path]
+            return dataset.map(add_timestamp) if input_path == record_files else dataset
+        build.metrics_previous_build = previous_build
+        # Let the other installers of readers (raw cache) replace the original builder
+        build.original_build = getattr(previous_build, 'original_build', previous_build)
+        dataset_builder.build = build
+    def __call__(self, args):
+        """
+        Step callback
+        Keyword arguments:
+        args    -- the step event. The metrics are added as attributes
+        """
+        import psutil
+        now = time.perf_counter()
+        step_time = now - self._last_time if self._last_time is not None else float(getattr(args, 'per_step_time', 0))
+        batch_time = self._batch_times.popleft() if self._batch_times else None
+        input_wait_time = min(max(batch_time - self._last_time, 0), step_time) if batch_time is not None and self._last_time is not None else 0.0
+        args.wall_time = time.time()
+        args.step_time = step_time
+        args.examples_per_second = self.batch_size / step_time if step_time > 0 else 0.0
+        args.input_wait_time = input_wait_time
+        args.compute_time = step_time - input_wait_time
+        args.rss_mb = psutil.Process().memory_info().rss / 1048576
+        if (self._file is None):
+            self._file = open(self.output_file, 'a', buffering = 1)
+        self._file.write(json.dumps({
+            'step': int(args.global_step),
+            'wall_time': args.wall_time,
+            'step_time': args.step_time,
+            'examples_per_second': args.examples_per_second,
+            'input_wait_time': args.input_wait_time,
+            'compute_time': args.compute_time,
+            'rss_mb': args.rss_mb,
+            'loss': float(args.loss) }) + '\n')
+        try:
+            if (self.step_callback):
+                self.step_callback(args)
+        finally:
+            # The time spent in the callbacks is not part of the next step
+            self._last_time = time.perf_counter()
+    def close(self):
+        """
+        Close the metrics file
+        """
+        if (self._file is not None):
+            self._file.close()
+            self._file = None
+
+def summarize_step_metrics(metrics_file):
+    """
+    Print the averages of the step metrics of a file, telling if the train is input bound or compute bound
+    Keyword arguments:
+    metrics_file    -- the JSON lines metrics file
+    """
+    with open(metrics_file, 'r') as f:
+        # The first step includes the tracing of the train function
+        records = [json.loads(line) for line in f if line.strip()][1:]
+    if (not records):
+        print(f'No step metrics in {metrics_file}')
+        return
+    step_time = sum(r['step_time'] for r in records) / len(records)
+    input_wait_time = sum(r['input_wait_time'] for r in records) / len(records)
+    examples_per_second = sum(r['examples_per_second'] for r in records) / len(records)
+    wait_fraction = input_wait_time / step_time if step_time > 0 else 0
+    print(f'{len(records)} steps: {step_time:.3f}s per step, {examples_per_second:.2f} examples/s, '
+          f'{input_wait_time:.3f}s waiting the input ({wait_fraction:.0%}), peak RSS {max(r["rss_mb"] for r in records):.0f} MB')
+    print('The train is input bound' if wait_fraction > _input_bound_fraction else 'The train is compute bound')
+
+if __name__ == '__main__':
+    prm = ('prm' in locals() and isinstance(prm, TrainParameters) and prm) or TrainParameters.default
+    metrics_file = os.path.join(prm.model_dir, metrics_file_name)
+    if (os.path.exists(metrics_file)):
+        summarize_step_metrics(metrics_file)
+    else:
+        print(f'{metrics_file_name}: not created')
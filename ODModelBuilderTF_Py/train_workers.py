@@ -0,0 +1,188 @@
+from    absl import flags
+import  json
+import  os
+import  socket
+import  subprocess
+import  sys
+
+try:    from    train_parameters import TrainParameters
+except: pass
+
+# Flags overridden in the workers: the tensorboard, the metrics, the profiler and the probes are only of the chief
+_worker_flags_overrides = ['--tensorboard_port=0', '--nostep_metrics', '--profile_steps=', '--noprobe_batch_size']
+# Prefix of the output line of a check worker containing its result
+_check_result_prefix = 'Worker check result: '
+
+def get_free_ports(count):
+    """
+    Return a list of free TCP ports of the local host
+    Keyword arguments:
+    count   -- number of ports
+    """
+    sockets = [socket.socket(socket.AF_INET, socket.SOCK_STREAM) for _ in range(count)]
+    try:
+        for s in sockets:
+            s.bind(('localhost', 0))
+        return [s.getsockname()[1] for s in sockets]
+    finally:
+        for s in sockets:
+            s.close()
+
+def get_tf_config(worker_hosts, worker_index):
+    """
+    Return the TF_CONFIG of a worker of a multi-worker train. The worker 0 is the chief
+    Keyword arguments:
+    worker_hosts    -- the list of host:port of the workers
+    worker_index    -- the index of the worker
+    """
+    return json.dumps({ 'cluster': { 'worker': list(worker_hosts) }, 'task': { 'type': 'worker', 'index': worker_index } })
+
+def get_worker_args(prm: TrainParameters):
+    """
+    Return the command line flags reproducing the train parameters in a worker process
+    Keyword arguments:
+    prm     -- Parameters
+    """
+    args = []
+    propnames = [p for p in dir(type(prm)) if isinstance(getattr(type(prm), p), property)]
+    for prop in propnames:
+        name = prm._flags_aliases.get(prop, prop)
+        if (name not in flags.FLAGS or name in ('worker_index', 'worker_hosts')):
+            continue
+        flag = flags.FLAGS[name]
+        if (flag.value is not None and flag.value != flag.default):
+            args.append(flag.serialize())
+    return args
+
+def start_workers(prm: TrainParameters):
+    """
+    Configure the TF_CONFIG of the process for a multi-worker train and, if it's the chief
+    without specified hosts, start the other workers as local processes.
+    Return the list of the started processes
+    Keyword arguments:
+    prm     -- Parameters
+    """
+    worker_hosts = [h.strip() for h in prm.worker_hosts.split(',') if h.strip()] if prm.worker_hosts else None
+    if (worker_hosts and len(worker_hosts) != prm.num_workers):
+        raise Exception(f'Error!!! The number of worker hosts {len(worker_hosts)} is different from the number of workers {prm.num_workers}')
+    if (prm.worker_index < 0 or prm.worker_index >= prm.num_workers):
+        raise Exception(f'Error!!! The worker index {prm.worker_index} is not in the range of the {prm.num_workers} workers')
+    processes = []
+    local = not worker_hosts
+    if (local):
+        if (prm.worker_index > 0):
+            raise Exception('Error!!! The worker hosts must be specified for the workers other than the chief')
+        worker_hosts = [f'localhost:{port}' for port in get_free_ports(prm.num_workers)]
+    os.environ['TF_CONFIG'] = get_tf_config(worker_hosts, prm.worker_index)
+    if (not local):
+        print(f'Multi-worker train: worker {prm.worker_index} of {", ".join(worker_hosts)}')
+        return processes
+    # Share the CPUs among the local workers
+    threads = max(1, (os.cpu_count() or 1) // prm.num_workers)
+    try:
+        import tensorflow as tf
+        tf.config.threading.set_intra_op_parallelism_threads(threads)
+    except: pass
+    args = get_worker_args(prm)
+    for index in range(1, prm.num_workers):
+        cmd = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'train_main.py')]
+        cmd.extend(args)
+        cmd.extend(_worker_flags_overrides)
+        cmd.extend([f'--worker_index={index}', f'--worker_hosts={",".join(worker_hosts)}'])
+        env = {
+            **os.environ,
+            'PATH': os.pathsep.join(sys.path) + os.pathsep + os.environ['PATH'],
+            'TF_CONFIG': get_tf_config(worker_hosts, index),
+            'TF_NUM_INTRAOP_THREADS': str(threads) }
+        creationflags = subprocess.CREATE_NO_WINDOW if 'CREATE_NO_WINDOW' in dir(subprocess) else 0
+        log_file = open(os.path.join(prm.model_dir, f'worker{index}.log'), 'w')
+        processes.append(subprocess.Popen(cmd, env = env, cwd = os.getcwd(), stdout = log_file, stderr = subprocess.STDOUT, universal_newlines = True, creationflags = creationflags))
+        log_file.close()
+    print(f'Started {len(processes)} local worker(s) on {", ".join(worker_hosts[1:])}. Their output is in the worker*.log files of the model directory')
+    return processes
+
+def stop_workers(processes, timeout = 60):
+    """
+    Wait the end of the local workers, terminating the ones still running after a timeout, and remove the TF_CONFIG of the process
+    Keyword arguments:
+    processes   -- the processes of the workers
+    timeout     -- the timeout in seconds
+    """
+    for process in processes or []:
+        try:
+            process.wait(timeout)
+        except subprocess.TimeoutExpired:
+            print(f'Warning: terminating the worker process {process.pid}')
+            process.terminate()
+            process.wait()
+        if (process.returncode):
+            print(f'Warning: the worker process {process.pid} exited with the error code {process.returncode}')
+    os.environ.pop('TF_CONFIG', None)
+
+def run_check_worker(worker_hosts, worker_index):
+    """
+    Join a multi-worker cluster on the CPU and all-reduce the index of the worker.
+    Return the dictionary of the reduced value and of the number of replicas in sync
+    Keyword arguments:
+    worker_hosts    -- the list of host:port of the workers
+    worker_index    -- the index of this worker
+    """
+    os.environ['TF_CONFIG'] = get_tf_config(worker_hosts, worker_index)
+    import tensorflow as tf
+    strategy = tf.distribute.MultiWorkerMirroredStrategy()
+    value = strategy.reduce(tf.distribute.ReduceOp.SUM, strategy.run(lambda: tf.constant(float(worker_index))), axis = None)
+    return { 'worker_index': worker_index, 'sum': float(value), 'replicas': strategy.num_replicas_in_sync }
+
+def check_workers(num_workers = 2, timeout = 120):
+    """
+    Check the multi-worker train setup on the local CPUs: start the workers with the TF_CONFIG of the launcher,
+    each one all-reducing its index through a MultiWorkerMirroredStrategy. Return True if all the workers got the expected sum
+    Keyword arguments:
+    num_workers -- number of local workers
+    timeout     -- the timeout in seconds of the check
+    """
+    worker_hosts = [f'localhost:{port}' for port in get_free_ports(num_workers)]
+    for index in range(num_workers):
+        print(f'TF_CONFIG of the worker {index}: {get_tf_config(worker_hosts, index)}')
+    threads = max(1, (os.cpu_count() or 1) // num_workers)
+    env = {
+        **os.environ,
+        'PATH': os.pathsep.join(sys.path) + os.pathsep + os.environ['PATH'],
+        'CUDA_VISIBLE_DEVICES': '-1',
+        'TF_NUM_INTRAOP_THREADS': str(threads) }
+    creationflags = subprocess.CREATE_NO_WINDOW if 'CREATE_NO_WINDOW' in dir(subprocess) else 0
+    processes = [
+        subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), str(index), ','.join(worker_hosts)],
+            env = env, cwd = os.getcwd(), stdout = subprocess.PIPE, stderr = subprocess.STDOUT, universal_newlines = True, creationflags = creationflags)
+        for index in range(num_workers)]
+    expected = sum(range(num_workers))
+    success = True
+    for index, process in enumerate(processes):
+        try:
+            output, _ = process.communicate(timeout = timeout)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            output, _ = process.communicate()
+        results = [json.loads(line[len(_check_result_prefix):]) for line in output.splitlines() if line.startswith(_check_result_prefix)]
+        if (results and results[0]['sum'] == expected and results[0]['replicas'] == num_workers):
+            print(f'Worker {index} on {worker_hosts[index]}: all-reduce of {num_workers} replicas ok')
+        else:
+            print(f'Worker {index} on {worker_hosts[index]}: failed with the error code {process.returncode}')
+            print(output)
+            success = False
+    return success
+
+if __name__ == '__main__':
+    if (len(sys.argv) > 2):
+        # Single worker executed by check_workers
+        print(_check_result_prefix + json.dumps(run_check_worker(sys.argv[2].split(','), int(sys.argv[1]))), flush = True)
+        # Exit without waiting the shutdown of the collective operations of the cluster
+        os._exit(0)
+    # Check of the multi-worker setup with local CPU workers: python train_workers.py [num_workers]
+    # A multi-worker train with local workers is started by the chief: python train_main.py --num_workers=2 ...
+    # On multiple hosts each worker is started with: python train_main.py --num_workers=N --worker_index=I --worker_hosts=host0:port,...
+    prm = ('prm' in locals() and isinstance(prm, TrainParameters) and prm) or TrainParameters.default
+    num_workers = int(sys.argv[1]) if len(sys.argv) > 1 else max(prm.num_workers, 2)
+    if (not check_workers(num_workers)):
+        raise Exception('Error!!! The check of the local workers failed')
@@ -82,6 +82,19 @@ def get_package_info(package_name: str, no_deps=False):
             return super().__init__(*args, **kwargs)
     return Result()
 
+def get_peak_rss():
+    """
+    Return the peak resident set size of the process in bytes
+    """
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024
+    except: pass
+    import psutil
+    memory_info = psutil.Process().memory_info()
+    return getattr(memory_info, 'peak_wset', memory_info.rss)
+
 def get_type_of_script():
     """
     Return of the type of the script is being executed
@@ -111,6 +124,14 @@ def install(package: str, extra_args: []):
         script_args.append(package)
     execute_script(script_args)
 
+def is_archive(path: str):
+    """
+    True if the path is a tar or zip archive file
+    """
+    import tarfile
+    import zipfile
+    return os.path.isfile(path) and (zipfile.is_zipfile(path) or tarfile.is_tarfile(path))
+
 def is_colab():
     """
     True if running as an executable